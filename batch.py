@@ -0,0 +1,149 @@
+"""
+batch.py
+Headless loot generation: JSONL loot requests in, JSONL items out.
+No tkinter, so it runs on machines without a display.
+
+Each input line is one request:
+    {"name": "Bob", "char_class": "Rogue", "level": 7, "count": 3}
+("class" works in place of "char_class", count defaults to 1.)
+Each output line is one generated item for one request.
+
+    python batch.py requests.jsonl > items.jsonl
+    cat requests.jsonl | python batch.py --chunk-size 50000 > items.jsonl
+    python batch.py requests.jsonl --seed 42 --workers 8 > items.jsonl
+
+With --seed the output is reproducible: the same seed and chunk size give the
+same items whatever --workers is.
+"""
+
+import argparse
+import json
+import sys
+
+from loot_metrics import LootMetrics
+from loot_model import Character, LootBatch
+from loot_parallel import chunk_drops, generate_parallel, group_runs
+from loot_service import LootService
+from storage_loot import LootHistoryWriter
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def read_requests(lines):
+    """Yield (Character, count) for every valid request line. Bad lines are reported and skipped."""
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            character = Character(
+                name=str(request["name"]),
+                char_class=str(request["char_class"] if "char_class" in request else request["class"]),
+                level=int(request["level"]),
+            )
+            count = int(request.get("count", 1))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Skipping request on line {line_number}: {e!r}", file=sys.stderr)
+            continue
+        if character.level < 1 or character.level > 20:
+            print(f"Skipping request on line {line_number}: level must be between 1 and 20", file=sys.stderr)
+            continue
+        yield character, count
+
+
+def item_record(character: Character, batch: LootBatch, row: int) -> dict:
+    """The JSON object written for one generated item."""
+    return {
+        "name": character.name,
+        "char_class": character.char_class,
+        "level": character.level,
+        "base_item": batch.base_items[row],
+        "full_name": batch.full_names[row],
+        "modifiers": batch.modifiers[row],
+        "power_text": batch.power_texts[row],
+        "power_score": batch.power_scores[row],
+        "tier": batch.tiers[row],
+    }
+
+
+def run(lines, out, chunk_size: int = DEFAULT_CHUNK_SIZE,
+        history_writer: LootHistoryWriter | None = None,
+        service: LootService | None = None,
+        seed: int | None = None, workers: int | None = None,
+        metrics: LootMetrics | None = None, metrics_file: str | None = None) -> int:
+    """Generate loot for every request in lines and write it to out. Returns the item count.
+    With a seed the chunks are rolled by loot_parallel.generate_parallel instead of service
+    (generation in worker processes is not timed into metrics).
+    With metrics_file, metrics are written there after every chunk.
+    """
+    requests = read_requests(lines)
+    if seed is None:
+        service = service or LootService(metrics=metrics)
+        grouped = (group_runs(chunk) for chunk in chunk_drops(requests, chunk_size))
+        chunks = ((characters, service.generate_loot_batch(characters, counts))
+                  for characters, counts in grouped)
+    else:
+        chunks = generate_parallel(requests, seed, workers=workers, shard_size=chunk_size)
+
+    total = 0
+    for chunk, batch in chunks:
+        output = []
+        for row in range(len(batch)):
+            character = chunk[batch.character_index[row]]
+            output.append(json.dumps(item_record(character, batch, row)))
+            if history_writer is not None:
+                history_writer.write(character, batch.item(row))
+        out.write("\n".join(output))
+        out.write("\n")
+        total += len(batch)
+        if metrics is not None and metrics_file:
+            metrics.write_text(metrics_file)
+    return total
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate loot from a JSONL request file.")
+    parser.add_argument("requests", nargs="?", default="-",
+                        help="JSONL request file, or - for stdin (the default)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="how many items to generate and write at a time")
+    parser.add_argument("--no-history", action="store_true",
+                        help="don't append the generated items to the loot history")
+    parser.add_argument("--metrics-file", default=None,
+                        help="write timings and counters here (Prometheus text format) after every chunk")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="master seed for reproducible output")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes to use with --seed (default: one per CPU)")
+    args = parser.parse_args(argv)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers is not None and args.seed is None:
+        parser.error("--workers needs --seed")
+
+    metrics = LootMetrics() if args.metrics_file else None
+    history_writer = None if args.no_history else LootHistoryWriter(max_rows=args.chunk_size, metrics=metrics)
+    try:
+        if args.requests == "-":
+            total = run(sys.stdin, sys.stdout, args.chunk_size, history_writer,
+                        seed=args.seed, workers=args.workers,
+                        metrics=metrics, metrics_file=args.metrics_file)
+        else:
+            with open(args.requests, encoding="utf-8") as f:
+                total = run(f, sys.stdout, args.chunk_size, history_writer,
+                            seed=args.seed, workers=args.workers,
+                            metrics=metrics, metrics_file=args.metrics_file)
+    finally:
+        if history_writer is not None:
+            history_writer.close()
+        if metrics is not None:
+            metrics.write_text(args.metrics_file)
+    print(f"Generated {total} items.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
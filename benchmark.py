@@ -0,0 +1,185 @@
+"""
+benchmark.py
+Benchmarks for the loot generation and storage hot paths.
+
+    python benchmark.py --output before.json
+    python benchmark.py --quick --output after.json
+
+Every benchmark is seeded, and results are written as JSON (ops, seconds,
+ops_per_sec, peak_memory_bytes) so two runs can be compared. Storage benchmarks
+run in a temporary directory and never touch the real data files.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import storage_characters
+import storage_loot
+from loot_model import Character
+from loot_service import LootService
+
+LEVELS = [1, 5, 10, 20]
+CLASSES = ["Warrior", "Rogue", "Wizard"]
+ROSTER_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+QUICK_ROSTER_SIZES = [1_000, 10_000]
+
+
+def measure(name: str, params: dict, ops: int, fn) -> dict:
+    """Time fn() (which does ops operations), then run it again under tracemalloc for peak memory."""
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "params": params,
+        "ops": ops,
+        "seconds": seconds,
+        "ops_per_sec": ops / seconds if seconds > 0 else None,
+        "peak_memory_bytes": peak,
+    }
+    print(f"{name:32} {json.dumps(params):36} {result['ops_per_sec'] or 0:>14,.0f} ops/s", file=sys.stderr)
+    return result
+
+
+def bench_generation(seed: int, count: int) -> list[dict]:
+    results = []
+    for level in LEVELS:
+        character = Character(name="Bench", char_class="Wizard", level=level)
+
+        def generate():
+            service = LootService(rng=random.Random(seed))
+            for _ in range(count):
+                service.generate_loot_for_character(character)
+        results.append(measure("generate_loot_for_character", {"level": level}, count, generate))
+
+        def roll():
+            service = LootService(rng=random.Random(seed))
+            for _ in range(count):
+                service._roll_modifiers(level)
+        results.append(measure("_roll_modifiers", {"level": level}, count, roll))
+
+        service = LootService(rng=random.Random(seed))
+        rolled = [service._roll_modifiers(level) for _ in range(count)]
+
+        def names():
+            for modifier_ids in rolled:
+                service._build_item_name("Staff", modifier_ids)
+        results.append(measure("_build_item_name", {"level": level}, count, names))
+
+        def power_texts():
+            for modifier_ids in rolled:
+                service._build_power_text(modifier_ids)
+        results.append(measure("_build_power_text", {"level": level}, count, power_texts))
+    return results
+
+
+def bench_history(seed: int, count: int) -> list[dict]:
+    service = LootService(rng=random.Random(seed))
+    drops = []
+    for i in range(count):
+        character = Character(name=f"Bench{i % 100}", char_class=CLASSES[i % 3], level=1 + i % 20)
+        drops.append((character, service.generate_loot_for_character(character)))
+
+    def save_each():
+        for character, item in drops:
+            storage_loot.save_loot_history(character, item)
+
+    def save_buffered():
+        with storage_loot.LootHistoryWriter(max_delay=0) as writer:
+            for character, item in drops:
+                writer.write(character, item)
+
+    return [
+        measure("save_loot_history", {}, count, save_each),
+        measure("LootHistoryWriter.write", {}, count, save_buffered),
+    ]
+
+
+def bench_roster(seed: int, sizes: list[int], modify_count: int) -> list[dict]:
+    results = []
+    rng = random.Random(seed)
+    for size in sizes:
+        roster = [Character(name=f"Hero{i}", char_class=CLASSES[i % 3], level=rng.randint(1, 20))
+                  for i in range(size)]
+        params = {"roster_size": size}
+
+        results.append(measure("save_characters", params, size,
+                               lambda: storage_characters.save_characters(roster)))
+        results.append(measure("load_characters", params, size, storage_characters.load_characters))
+
+        # half updates of existing characters, half new ones
+        changes = []
+        for i in range(modify_count):
+            if i % 2:
+                changes.append(Character(name=f"Hero{rng.randrange(size)}", char_class="Rogue", level=20))
+            else:
+                changes.append(Character(name=f"New{i}", char_class="Rogue", level=1))
+
+        def modify():
+            working = list(roster)
+            for character in changes:
+                storage_characters.modify_character(working, character)
+        results.append(measure("modify_character", params, modify_count, modify))
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark loot generation and storage.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--count", type=int, default=20000,
+                        help="items per generation/history benchmark")
+    parser.add_argument("--modify-count", type=int, default=200,
+                        help="modify_character calls per roster size")
+    parser.add_argument("--quick", action="store_true",
+                        help=f"only roster sizes {QUICK_ROSTER_SIZES}")
+    parser.add_argument("--output", default=None, help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    storage_loot.BASE_ITEMS_FILE = os.path.join(here, "base_items.txt")
+    storage_loot.MODIFIERS_FILE = os.path.join(here, "modifiers.txt")
+    storage_loot.MODIFIER_BITS_FILE = os.path.join(here, "modifier_bits.txt")
+
+    results = bench_generation(args.seed, args.count)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage_loot.LOOT_HISTORY_FILE = os.path.join(tmp, "loot_history.csv")
+        storage_characters.CHARACTERS_FILE = os.path.join(tmp, "characters.csv")
+        storage_characters.CHARACTERS_LOG_FILE = os.path.join(tmp, "characters.log")
+        results += bench_history(args.seed, args.count)
+        sizes = QUICK_ROSTER_SIZES if args.quick else ROSTER_SIZES
+        results += bench_roster(args.seed, sizes, args.modify_count)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "count": args.count,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+character_index.py
+Characters sorted by name for type-to-filter lookups in the GUI.
+
+A prefix search is two bisects into the sorted keys and gives back a range of
+positions, so filtering a big roster never copies or formats it. The GUI only
+formats the rows it actually shows.
+"""
+
+import bisect
+
+from loot_model import Character
+
+# sorts after any character a name can contain, used as the upper bound of a prefix
+_PREFIX_END = "\U0010ffff"
+
+
+class CharacterIndex:
+    """Characters keyed by (name, char_class), ordered by name ignoring case."""
+    def __init__(self, characters=()):
+        self._by_key: dict[tuple[str, str], Character] = {}
+        # (casefolded name, name, char_class), kept sorted
+        self._keys: list[tuple[str, str, str]] = []
+        self.extend(characters)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def extend(self, characters) -> None:
+        """Add many characters at once. Ones already in the index are updated."""
+        new_keys = []
+        for character in characters:
+            key = (character.name, character.char_class)
+            if key not in self._by_key:
+                new_keys.append((character.name.casefold(), character.name, character.char_class))
+            self._by_key[key] = character
+        if new_keys:
+            new_keys.sort()
+            self._keys.extend(new_keys)
+            # two sorted runs, which sort() merges in one linear pass
+            self._keys.sort()
+
+    def upsert(self, character: Character) -> int:
+        """Add or update one character. Returns its position."""
+        key = (character.name, character.char_class)
+        sort_key = (character.name.casefold(), character.name, character.char_class)
+        if key not in self._by_key:
+            bisect.insort(self._keys, sort_key)
+        self._by_key[key] = character
+        return bisect.bisect_left(self._keys, sort_key)
+
+    def get(self, name: str, char_class: str) -> Character | None:
+        return self._by_key.get((name, char_class))
+
+    def at(self, position: int) -> Character:
+        """The character at a position in name order."""
+        _, name, char_class = self._keys[position]
+        return self._by_key[(name, char_class)]
+
+    def prefix_range(self, prefix: str) -> tuple[int, int]:
+        """Positions [start, end) of the characters whose name starts with prefix, ignoring case."""
+        folded = prefix.casefold()
+        start = bisect.bisect_left(self._keys, (folded,))
+        end = bisect.bisect_left(self._keys, (folded + _PREFIX_END,))
+        return start, end
@@ -0,0 +1,81 @@
+"""
+file_lock.py
+Advisory whole-file locks between processes.
+
+locked(path) takes an exclusive lock on path + ".lock" with fcntl.flock on POSIX and
+msvcrt.locking on Windows. Where neither is available it only keeps out other
+threads of the same process.
+The lock file stays open for the life of the process (one per path and process,
+a forked child opens its own), so taking the lock costs two system calls, not an
+open and close as well.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# (path, pid) -> (thread lock, open lock file). Threads of this process queue up on
+# the thread lock first, so only one of them waits on the OS lock.
+_locks: dict[tuple[str, int], tuple[threading.Lock, object]] = {}
+_locks_guard = threading.Lock()
+
+
+def lock_path(path: str) -> str:
+    """The file whose lock guards path."""
+    return path + ".lock"
+
+
+def _acquire(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK gives up after about 10 seconds, keep waiting like flock does
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+
+def _release(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_for(path: str) -> tuple[threading.Lock, object]:
+    # keyed by pid too: a forked child shares its parent's open files, and flock
+    # treats the same open file as the same owner, so it must open its own
+    key = (os.path.abspath(path), os.getpid())
+    entry = _locks.get(key)
+    if entry is None:
+        with _locks_guard:
+            entry = _locks.get(key)
+            if entry is None:
+                entry = _locks[key] = (threading.Lock(), open(lock_path(path), "a+b"))
+    return entry
+
+
+@contextmanager
+def locked(path: str):
+    """Hold an exclusive lock on path for the duration of the with block."""
+    thread_lock, f = _lock_for(path)
+    with thread_lock:
+        _acquire(f)
+        try:
+            yield
+        finally:
+            _release(f)
@@ -0,0 +1,224 @@
+"""
+loot_analytics.py
+Running aggregates over the loot history, kept in a small summary file next to it.
+
+storage_loot updates them on every save (see TRACK_LOOT_ANALYTICS there), so a
+dashboard reads the summary with load_summary() instead of re-parsing the history:
+drops per class and level, how often each modifier shows up, power_score mean and
+percentiles per level, and how often max_mods cut a roll down.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from file_lock import locked
+from loot_model import Character, Item
+
+# bump when the summary layout changes
+SUMMARY_FORMAT = 1
+# save_if_due() writes the summary at most this often, in seconds
+SAVE_INTERVAL = 1.0
+
+
+class _Aggregates:
+    """The counters themselves. Two of them add up with merge()."""
+    def __init__(self):
+        self.drops: Counter[tuple[str, int]] = Counter()
+        self.modifiers: Counter[str] = Counter()
+        self.power_scores: dict[int, Counter[int]] = {}  # level -> power_score -> count
+        self.truncations = 0
+        # drops whose truncation is known, items read back from the history file don't say
+        self.truncation_checked = 0
+
+    def add(self, character: Character, item: Item, truncation_known: bool = True) -> None:
+        self.drops[(character.char_class, character.level)] += 1
+        self.modifiers.update(item.modifiers)
+        scores = self.power_scores.get(character.level)
+        if scores is None:
+            scores = self.power_scores[character.level] = Counter()
+        scores[item.power_score] += 1
+        if truncation_known:
+            self.truncation_checked += 1
+            if item.truncated:
+                self.truncations += 1
+
+    def merge(self, other: "_Aggregates") -> None:
+        self.drops.update(other.drops)
+        self.modifiers.update(other.modifiers)
+        for level, scores in other.power_scores.items():
+            self.power_scores.setdefault(level, Counter()).update(scores)
+        self.truncations += other.truncations
+        self.truncation_checked += other.truncation_checked
+
+    def to_json(self) -> dict:
+        return {
+            "format": SUMMARY_FORMAT,
+            "drops": [[char_class, level, count] for (char_class, level), count in sorted(self.drops.items())],
+            "modifiers": dict(sorted(self.modifiers.items())),
+            "power_scores": {str(level): {str(score): count for score, count in sorted(scores.items())}
+                             for level, scores in sorted(self.power_scores.items())},
+            "truncations": self.truncations,
+            "truncation_checked": self.truncation_checked,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "_Aggregates":
+        aggregates = cls()
+        if data.get("format") != SUMMARY_FORMAT:
+            return aggregates
+        for char_class, level, count in data["drops"]:
+            aggregates.drops[(char_class, int(level))] = count
+        aggregates.modifiers.update(data["modifiers"])
+        for level, scores in data["power_scores"].items():
+            aggregates.power_scores[int(level)] = Counter({int(score): count for score, count in scores.items()})
+        aggregates.truncations = data["truncations"]
+        aggregates.truncation_checked = data["truncation_checked"]
+        return aggregates
+
+
+def _read_aggregates(path: str) -> _Aggregates:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return _Aggregates.from_json(json.load(f))
+    except FileNotFoundError:
+        return _Aggregates()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Could not read loot summary {path}, starting over: {e}")
+        return _Aggregates()
+
+
+def _write_aggregates(path: str, aggregates: _Aggregates) -> None:
+    temp_path = path + f".{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(aggregates.to_json(), f, separators=(",", ":"))
+    # os.replace so a dashboard never reads a half written file
+    os.replace(temp_path, path)
+
+
+def _percentile(scores: Counter[int], count: int, q: float) -> int:
+    """Nearest-rank percentile of a power_score histogram."""
+    target = max(1, q * count)
+    seen = 0
+    for score in sorted(scores):
+        seen += scores[score]
+        if seen >= target:
+            return score
+    return max(scores)
+
+
+def _summarize(aggregates: _Aggregates) -> dict:
+    total = sum(aggregates.drops.values())
+    power_score = []
+    for level, scores in sorted(aggregates.power_scores.items()):
+        count = sum(scores.values())
+        if not count:
+            continue
+        power_score.append({
+            "level": level,
+            "count": count,
+            "mean": sum(score * n for score, n in scores.items()) / count,
+            "p50": _percentile(scores, count, 0.5),
+            "p90": _percentile(scores, count, 0.9),
+            "p99": _percentile(scores, count, 0.99),
+        })
+    checked = aggregates.truncation_checked
+    return {
+        "total_drops": total,
+        "drops": [
+            {"char_class": char_class, "level": level, "count": count}
+            for (char_class, level), count in sorted(aggregates.drops.items())
+        ],
+        "modifiers": [
+            {"modifier": name, "count": count, "per_drop": count / total if total else 0.0}
+            for name, count in aggregates.modifiers.most_common()
+        ],
+        "power_score": power_score,
+        "max_mods_truncations": aggregates.truncations,
+        "max_mods_truncation_rate": aggregates.truncations / checked if checked else 0.0,
+    }
+
+
+class LootAnalytics:
+    """Aggregates for one history, loaded from its summary file and added to as drops are saved.
+    save() adds this process's new drops to whatever is in the file now, so several
+    processes saving to the same history all end up counted.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._saved = _read_aggregates(path)
+        self._unsaved = _Aggregates()
+        self._last_save = time.monotonic()
+        atexit.register(self.save)
+
+    def record(self, character: Character, item: Item) -> None:
+        """Count one saved drop."""
+        with self._lock:
+            self._unsaved.add(character, item)
+
+    def save_if_due(self) -> None:
+        """save(), if the last one was more than SAVE_INTERVAL seconds ago."""
+        if time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        """Write the summary file, adding what was recorded since the last save."""
+        with self._lock:
+            self._last_save = time.monotonic()
+            if not self._unsaved.drops:
+                return
+            try:
+                # locked, or two processes both read the old file and one's counts get lost
+                with locked(self.path):
+                    aggregates = _read_aggregates(self.path)
+                    aggregates.merge(self._unsaved)
+                    _write_aggregates(self.path, aggregates)
+            except OSError as e:
+                print(f"Error saving loot summary: {e}")
+                return
+            self._saved = aggregates
+            self._unsaved = _Aggregates()
+
+    def rebuild(self, drops) -> None:
+        """Replace the whole summary with a recount of drops, an iterable of (Character, Item).
+        For drops read back from a history file, which don't say whether they were truncated.
+        """
+        aggregates = _Aggregates()
+        for character, item in drops:
+            aggregates.add(character, item, truncation_known=False)
+        with self._lock, locked(self.path):
+            _write_aggregates(self.path, aggregates)
+            self._saved = aggregates
+            self._unsaved = _Aggregates()
+            self._last_save = time.monotonic()
+
+    def snapshot(self) -> dict:
+        """Everything counted so far, saved or not, as plain dicts."""
+        with self._lock:
+            aggregates = _Aggregates()
+            aggregates.merge(self._saved)
+            aggregates.merge(self._unsaved)
+        return _summarize(aggregates)
+
+
+_instances: dict[str, LootAnalytics] = {}
+_instances_lock = threading.Lock()
+
+
+def analytics_for(path: str) -> LootAnalytics:
+    """The process-wide LootAnalytics for a summary file, so every writer of a history shares one."""
+    key = os.path.abspath(path)
+    with _instances_lock:
+        analytics = _instances.get(key)
+        if analytics is None:
+            analytics = _instances[key] = LootAnalytics(path)
+        return analytics
+
+
+def load_summary(path: str) -> dict:
+    """Read a summary file for a dashboard, without tracking anything."""
+    return _summarize(_read_aggregates(path))
@@ -0,0 +1,78 @@
+"""
+loot_cache.py
+LRU cache of rendered item names and power texts.
+
+Only so many (base item, modifier combination) pairs ever come up, so the
+strings for them are built once, interned, and handed out again on repeats.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from loot_tables import ModifierTable
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class RenderCache:
+    """Maps (base item, modifier ids in roll order) to (full_name, power_text)."""
+    def __init__(self, table: ModifierTable, maxsize: int = DEFAULT_CACHE_SIZE):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.table = table
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple[str, tuple[int, ...]], tuple[str, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def render(self, base_item: str, modifier_ids: list[int]) -> tuple[str, str]:
+        """The full name and power text for this item, built on a miss."""
+        key = (base_item, tuple(modifier_ids))
+        # the hit path takes no lock: OrderedDict.get and move_to_end are single C calls,
+        # the worst a race can do is lose a hit count or an LRU bump
+        entry = self._entries.get(key)
+        if entry is not None:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                pass  # evicted by another thread just now
+            self.hits += 1
+            return entry
+
+        # build outside the lock, two threads missing the same key just both build it
+        entry = (
+            sys.intern(self.table.build_name(base_item, modifier_ids)),
+            sys.intern(self.table.build_power_text(modifier_ids)),
+        )
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def stats(self) -> dict:
+        """Hit/miss counts and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
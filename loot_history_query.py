@@ -0,0 +1,378 @@
+"""
+loot_history_query.py
+Indexed lookups over loot_history.csv.
+
+storage_loot appends one line to loot_history.csv.idx for every history row:
+    offset|length|name|class|level|power_score|modifiers|modifier mask in hex
+LootHistoryQuery folds those lines into loot_history.csv.idx.db, a SQLite file with
+the rows' offsets keyed by character, class, level and modifier bit, and remembers
+how far into the .idx file it got. So a new process only reads the .idx lines added
+since the last one, and a lookup only reads the index pages of its own keys before
+reading the matching rows out of the history file.
+Rows that made it into the history but not the index (older history files, a crash
+between the two writes) are picked up and indexed on the next refresh().
+
+    python loot_history_query.py --character Bob
+    python loot_history_query.py --class Wizard --min-level 10 --max-level 15 --top 20
+    python loot_history_query.py --modifier Vampiric
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+from collections import Counter
+
+import storage_loot
+from loot_model import Character, Item
+from storage_loot import (history_index_path, modifier_mask, parse_history_row, _history_lock,
+                          _history_row, _write_index_entries)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    offset INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    char_class TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    power_score INTEGER NOT NULL,
+    mask TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+CREATE INDEX IF NOT EXISTS entries_class_level ON entries (char_class, level);
+CREATE INDEX IF NOT EXISTS entries_level ON entries (level);
+CREATE TABLE IF NOT EXISTS modifier_postings (
+    bit INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (bit, offset)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS unparsed (
+    offset INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL
+);
+"""
+
+_INSERT_ENTRY = "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)"
+_INSERT_POSTING = "INSERT OR IGNORE INTO modifier_postings VALUES (?, ?)"
+_INSERT_UNPARSED = "INSERT OR IGNORE INTO unparsed VALUES (?, ?)"
+
+# index lines folded in per transaction, so other processes get a turn
+_INGEST_BATCH = 50000
+
+
+def history_query_db_path(path: str) -> str:
+    """The SQLite index kept next to a loot history file."""
+    return history_index_path(path) + ".db"
+
+
+def _bits(mask: int):
+    """Yield the index of each set bit of a mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _entry_rows(offset: int, length: int, name: str, char_class: str, level: int,
+                power_score: int, mask: int, entries: list, postings: list) -> None:
+    entries.append((offset, length, name, char_class, level, power_score, f"{mask:x}"))
+    postings.extend((bit, offset) for bit in _bits(mask))
+
+
+class LootHistoryQuery:
+    """Answers loot history questions without scanning the whole history file.
+    Call refresh() to pick up rows appended since the last call; every query does
+    this itself first. Several processes can share one history and its index.
+    """
+    def __init__(self, path: str | None = None):
+        self.path = path or storage_loot.LOOT_HISTORY_FILE
+        self.index_path = history_index_path(self.path)
+        self.db_path = history_query_db_path(self.path)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "LootHistoryQuery":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def refresh(self) -> None:
+        """Fold in new index lines, then index any history rows the index is missing."""
+        self._check_truncated()
+        while self._read_index():
+            pass
+        if self._size(self.path) > self._meta("indexed_end"):
+            self._catch_up()
+
+    def drops_for_character(self, name: str):
+        """Every drop for characters with this name, oldest first."""
+        yield from self.find(name=name)
+
+    def drops_with_modifier(self, modifier: str):
+        """Every drop that rolled this modifier, oldest first."""
+        yield from self.find(modifier=modifier)
+
+    def find(self, name: str | None = None, char_class: str | None = None,
+             min_level: int | None = None, max_level: int | None = None,
+             modifier: str | None = None, modifiers: list[str] | None = None):
+        """Yield (Character, Item) for drops matching all the given filters, oldest first.
+        modifier is one modifier the drop must have, modifiers a list it must have all of.
+        """
+        rows = self._select("offset, length", "ORDER BY offset", name, char_class,
+                            min_level, max_level, modifier, modifiers)
+        for offset, length in rows:
+            yield self._read_row(offset, length)
+
+    def top_power(self, n: int, name: str | None = None, char_class: str | None = None,
+                  min_level: int | None = None, max_level: int | None = None,
+                  modifier: str | None = None, modifiers: list[str] | None = None):
+        """Yield the n drops with the highest power_score matching the filters, best first."""
+        rows = self._select("offset, length", f"ORDER BY power_score DESC, offset LIMIT {int(n)}",
+                            name, char_class, min_level, max_level, modifier, modifiers)
+        for offset, length in rows:
+            yield self._read_row(offset, length)
+
+    def modifier_set_counts(self, name: str | None = None, char_class: str | None = None,
+                            min_level: int | None = None, max_level: int | None = None) -> Counter[int]:
+        """How many drops rolled each distinct set of modifiers, keyed by modifier mask.
+        Turn a mask back into names with ModifierTable.names_in().
+        """
+        rows = self._select("mask, COUNT(*)", "GROUP BY mask", name, char_class, min_level, max_level)
+        return Counter({int(mask, 16): count for mask, count in rows})
+
+    def _select(self, columns: str, tail: str, name, char_class, min_level, max_level,
+                modifier=None, modifiers=None) -> list[tuple]:
+        """Run a query over the index entries matching every filter that was given."""
+        self.refresh()
+
+        where: list[str] = []
+        params: list = []
+        if modifier is not None or modifiers:
+            wanted_names = ([modifier] if modifier is not None else []) + list(modifiers or ())
+            wanted = modifier_mask(wanted_names)
+            if wanted.bit_count() != len(set(wanted_names)):
+                return []  # a modifier that was never registered, so no drop has it
+            for bit in _bits(wanted):
+                where.append("offset IN (SELECT offset FROM modifier_postings WHERE bit = ?)")
+                params.append(bit)
+        if name is not None:
+            where.append("name = ?")
+            params.append(name)
+        if char_class is not None:
+            where.append("char_class = ?")
+            params.append(char_class)
+        if min_level is not None:
+            where.append("level >= ?")
+            params.append(min_level)
+        if max_level is not None:
+            where.append("level <= ?")
+            params.append(max_level)
+
+        sql = f"SELECT {columns} FROM entries"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._conn.execute(f"{sql} {tail}", params).fetchall()
+
+    def _meta(self, key: str) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_meta(self, key: str, value: int) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _check_truncated(self) -> None:
+        """Start the index over if the history or .idx file got shorter than what it covers,
+        as when storage_loot_shards rolls back an interrupted merge.
+        """
+        if (self._size(self.index_path) >= self._meta("index_position")
+                and self._size(self.path) >= self._meta("indexed_end")):
+            return
+        with self._transaction():
+            for table in ("meta", "entries", "modifier_postings", "unparsed"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def _read_index(self) -> bool:
+        """Fold up to _INGEST_BATCH new index lines into the database. True if there may be more."""
+        with self._transaction():
+            position = self._meta("index_position")
+            try:
+                f = open(self.index_path, "rb")
+            except FileNotFoundError:
+                return False
+            with f:
+                f.seek(position)
+                lines = []
+                consumed = 0
+                for raw in f:
+                    # only use complete lines, a half written one is read next time
+                    if not raw.endswith(b"\n"):
+                        break
+                    lines.append(raw.decode("utf-8"))
+                    consumed += len(raw)
+                    if len(lines) >= _INGEST_BATCH:
+                        break
+            if not lines:
+                return False
+
+            entries: list[tuple] = []
+            postings: list[tuple[int, int]] = []
+            for row in csv.reader(lines, delimiter="|"):
+                # index lines written before masks were added have no mask column
+                if len(row) not in (7, 8):
+                    continue
+                try:
+                    offset, length, level, power_score = int(row[0]), int(row[1]), int(row[4]), int(row[5])
+                    if len(row) == 8:
+                        mask = int(row[7], 16)
+                    else:
+                        mask = modifier_mask(row[6].split(", ")) if row[6] else 0
+                except ValueError:
+                    continue
+                _entry_rows(offset, length, row[2], row[3], level, power_score, mask, entries, postings)
+            self._insert(entries, postings)
+            self._set_meta("index_position", position + consumed)
+            self._advance_indexed_end({offset: length for offset, length, *_ in entries})
+        return len(lines) >= _INGEST_BATCH
+
+    def _insert(self, entries: list[tuple], postings: list[tuple[int, int]]) -> None:
+        self._conn.executemany(_INSERT_ENTRY, entries)
+        self._conn.executemany(_INSERT_POSTING, postings)
+
+    def _advance_indexed_end(self, fresh: dict[int, int] | None = None) -> None:
+        """Move indexed_end past every row now indexed. fresh holds rows just added, to save lookups."""
+        fresh = fresh or {}
+        end = self._meta("indexed_end")
+        while True:
+            length = fresh.get(end)
+            if length is None:
+                row = self._conn.execute(
+                    "SELECT length FROM entries WHERE offset = ? UNION ALL "
+                    "SELECT length FROM unparsed WHERE offset = ?", (end, end)).fetchone()
+                if row is None:
+                    break
+                length = row[0]
+            end += length
+        self._set_meta("indexed_end", end)
+
+    def _catch_up(self) -> None:
+        """Index history rows from the first one the index doesn't cover.
+        Holds the history lock, so a writer can't be adding the same rows' index lines meanwhile.
+        """
+        with _history_lock(self.path):
+            # a writer may have finished its index lines while we waited for the lock
+            while self._read_index():
+                pass
+            with self._transaction():
+                start = self._meta("indexed_end")
+                if self._size(self.path) <= start:
+                    return
+                new_entries = []
+                entries: list[tuple] = []
+                postings: list[tuple[int, int]] = []
+                unparsed: list[tuple[int, int]] = []
+                with open(self.path, "rb") as f:
+                    f.seek(start)
+                    consumed = [start]
+
+                    def lines():
+                        for raw in f:
+                            if not raw.endswith(b"\n"):
+                                return  # unfinished row at the end of the file
+                            consumed[0] += len(raw)
+                            yield raw.decode("utf-8")
+
+                    row_start = start
+                    try:
+                        for row in csv.reader(lines(), delimiter="|"):
+                            row_end = consumed[0]
+                            parsed = parse_history_row(row)
+                            if parsed is not None:
+                                character, item = parsed
+                                new_entries.append((row_start, row_end - row_start, character, item))
+                                _entry_rows(row_start, row_end - row_start, character.name,
+                                            character.char_class, character.level, item.power_score,
+                                            item.modifier_mask, entries, postings)
+                            else:
+                                unparsed.append((row_start, row_end - row_start))
+                            row_start = row_end
+                    except csv.Error:
+                        pass  # same thing, inside a quoted field
+
+                self._insert(entries, postings)
+                self._conn.executemany(_INSERT_UNPARSED, unparsed)
+                if new_entries:
+                    # save the work in the .idx file too, which is ours alone while the lock is held
+                    with open(self.index_path, "a", newline="", encoding="utf-8") as f:
+                        _write_index_entries(f, new_entries)
+                    self._set_meta("index_position", self._size(self.index_path))
+                fresh = {offset: length for offset, length, *_ in entries}
+                fresh.update(unparsed)
+                self._advance_indexed_end(fresh)
+
+    def _read_row(self, offset: int, length: int) -> tuple[Character, Item]:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        row = next(csv.reader(io.StringIO(data.decode("utf-8"), newline=""), delimiter="|"))
+        return parse_history_row(row)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT on a connection, rolled back if the block raises."""
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._conn.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Look up drops in the loot history.")
+    parser.add_argument("--history", default=None, help=f"history file (default {storage_loot.LOOT_HISTORY_FILE})")
+    parser.add_argument("--character", default=None, help="character name")
+    parser.add_argument("--class", dest="char_class", default=None, help="character class")
+    parser.add_argument("--min-level", type=int, default=None)
+    parser.add_argument("--max-level", type=int, default=None)
+    parser.add_argument("--modifier", action="append", default=None,
+                        help="modifier the drop must have, can be given more than once")
+    parser.add_argument("--top", type=int, default=None, help="only the N highest power_score drops")
+    args = parser.parse_args(argv)
+
+    filters = dict(name=args.character, char_class=args.char_class, min_level=args.min_level,
+                   max_level=args.max_level, modifiers=args.modifier)
+    writer = csv.writer(sys.stdout, delimiter="|")
+    with LootHistoryQuery(args.history) as query:
+        drops = query.top_power(args.top, **filters) if args.top is not None else query.find(**filters)
+        for character, item in drops:
+            writer.writerow(_history_row(character, item))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
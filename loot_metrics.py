@@ -0,0 +1,153 @@
+"""
+loot_metrics.py
+Optional timings and counters for loot generation and history writes.
+
+Hand a LootMetrics to LootService (and LootHistoryWriter / save_loot_history) to
+record where time goes. Read it back with snapshot(), or in the Prometheus text
+format with render_text(), write_text(path) or serve(port).
+"""
+
+import bisect
+import os
+import threading
+
+# bucket upper bounds in seconds: 1us, 2us, 4us ... about 8s
+BUCKET_BOUNDS: tuple[float, ...] = tuple(1e-6 * 2 ** i for i in range(24))
+
+
+class LatencyHistogram:
+    """Counts observations into fixed exponential buckets. Not locked, LootMetrics does that."""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)  # the last one is "more than 8s"
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile (0 if nothing was observed)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": list(self.counts),
+        }
+
+
+class LootMetrics:
+    """Per-stage latency histograms plus drop, modifier and truncation counters. Thread safe."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: dict[str, LatencyHistogram] = {}
+        self._drops: dict[tuple[str, int], int] = {}
+        self._modifiers_rolled = 0
+        self._truncations = 0
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record how long one stage took."""
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def count_drop(self, char_class: str, level: int, modifier_count: int) -> None:
+        """Record one generated item."""
+        with self._lock:
+            key = (char_class, level)
+            self._drops[key] = self._drops.get(key, 0) + 1
+            self._modifiers_rolled += modifier_count
+
+    def count_truncations(self, count: int = 1) -> None:
+        """Record items that rolled more modifiers than max_mods allowed."""
+        with self._lock:
+            self._truncations += count
+
+    def snapshot(self) -> dict:
+        """A plain-dict copy of everything recorded so far."""
+        with self._lock:
+            return {
+                "stages": {stage: h.snapshot() for stage, h in self._stages.items()},
+                "drops": [
+                    {"char_class": char_class, "level": level, "count": count}
+                    for (char_class, level), count in sorted(self._drops.items())
+                ],
+                "modifiers_rolled": self._modifiers_rolled,
+                "max_mods_truncations": self._truncations,
+            }
+
+    def render_text(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP loot_stage_seconds Time spent in each loot generation or storage stage.",
+                "# TYPE loot_stage_seconds histogram",
+            ]
+            for stage, h in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKET_BOUNDS, h.counts):
+                    cumulative += count
+                    lines.append(f'loot_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'loot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'loot_stage_seconds_sum{{stage="{stage}"}} {h.total:.9f}')
+                lines.append(f'loot_stage_seconds_count{{stage="{stage}"}} {h.count}')
+
+            lines.append("# HELP loot_drops_total Items generated, by class and level.")
+            lines.append("# TYPE loot_drops_total counter")
+            for (char_class, level), count in sorted(self._drops.items()):
+                label = char_class.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'loot_drops_total{{char_class="{label}",level="{level}"}} {count}')
+
+            lines.append("# HELP loot_modifiers_rolled_total Modifiers on generated items.")
+            lines.append("# TYPE loot_modifiers_rolled_total counter")
+            lines.append(f"loot_modifiers_rolled_total {self._modifiers_rolled}")
+            lines.append("# HELP loot_max_mods_truncations_total Items cut back to max_mods modifiers.")
+            lines.append("# TYPE loot_max_mods_truncations_total counter")
+            lines.append(f"loot_max_mods_truncations_total {self._truncations}")
+        return "\n".join(lines) + "\n"
+
+    def write_text(self, path: str) -> None:
+        """Write render_text() to a file, e.g. for a node exporter textfile collector."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_text())
+        # os.replace so a scraper never reads a half written file
+        os.replace(temp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serve render_text() over HTTP from a background thread. Call shutdown() on the result to stop."""
+        # http.server pulls in a lot of modules, only pay for it when serving
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # scrapes shouldn't spam the console
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -22,4 +22,112 @@ class Item:
     full_name: str
     modifiers: list[str]
     power_text: str
-    power_score: int
\ No newline at end of file
+    power_score: int
+    tier: str = "common"
+    truncated: bool = False  # rolled more modifiers than max_mods allowed and was cut back
+    # the modifiers as a set of bits, see loot_tables.ModifierTable.masks
+    modifier_mask: int = 0
+
+
+class CompactItem:
+    """A loot item stored as just its base item, modifier ids and power score.
+    full_name, modifiers and power_text are built from the shared modifier table
+    when first asked for, so it can stand in for an Item anywhere one is read.
+    """
+    __slots__ = ("base_item", "modifier_ids", "power_score", "tier", "truncated",
+                 "_table", "_full_name", "_power_text")
+
+    def __init__(self, base_item: str, modifier_ids: tuple[int, ...], power_score: int, table,
+                 tier: str = "common", truncated: bool = False):
+        self.base_item = base_item
+        self.modifier_ids = modifier_ids
+        self.power_score = power_score
+        self.tier = tier
+        self.truncated = truncated
+        self._table = table  # a loot_tables.ModifierTable
+        self._full_name: str | None = None
+        self._power_text: str | None = None
+
+    @property
+    def full_name(self) -> str:
+        if self._full_name is None:
+            self._full_name = self._table.build_name(self.base_item, self.modifier_ids)
+        return self._full_name
+
+    @property
+    def power_text(self) -> str:
+        if self._power_text is None:
+            self._power_text = self._table.build_power_text(self.modifier_ids)
+        return self._power_text
+
+    @property
+    def modifiers(self) -> list[str]:
+        names = self._table.names
+        return [names[i] for i in self.modifier_ids]
+
+    @property
+    def modifier_mask(self) -> int:
+        return self._table.mask_of(self.modifier_ids)
+
+    def to_item(self) -> Item:
+        """A regular Item with every field filled in."""
+        return Item(
+            base_item=self.base_item,
+            full_name=self.full_name,
+            modifiers=self.modifiers,
+            power_text=self.power_text,
+            power_score=self.power_score,
+            tier=self.tier,
+            truncated=self.truncated,
+            modifier_mask=self.modifier_mask,
+        )
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CompactItem):
+            return (self.base_item == other.base_item
+                    and self.modifier_ids == other.modifier_ids
+                    and self.power_score == other.power_score
+                    and self.tier == other.tier
+                    and self.truncated == other.truncated
+                    and self._table is other._table)
+        if isinstance(other, Item):
+            return self.to_item() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return (f"CompactItem(base_item={self.base_item!r}, modifier_ids={self.modifier_ids!r}, "
+                f"power_score={self.power_score!r}, tier={self.tier!r})")
+
+
+@dataclass
+class LootBatch:
+    """Loot generated in bulk, stored column by column instead of one Item per drop.
+    Row i of every list belongs to the same drop.
+    """
+    character_index: list[int]
+    base_items: list[str]
+    full_names: list[str]
+    modifiers: list[list[str]]
+    power_texts: list[str]
+    power_scores: list[int]
+    tiers: list[str]
+    truncated: list[bool]
+    modifier_masks: list[int]
+
+    def __len__(self) -> int:
+        return len(self.base_items)
+
+    def item(self, row: int) -> Item:
+        """Build a regular Item for one row of the batch."""
+        return Item(
+            base_item=self.base_items[row],
+            full_name=self.full_names[row],
+            modifiers=self.modifiers[row],
+            power_text=self.power_texts[row],
+            power_score=self.power_scores[row],
+            tier=self.tiers[row],
+            truncated=self.truncated[row],
+            modifier_mask=self.modifier_masks[row],
+        )
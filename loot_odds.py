@@ -0,0 +1,112 @@
+"""
+loot_odds.py
+Exact drop odds worked out from the loot tables, no rolling needed.
+"""
+
+from dataclasses import dataclass
+
+from loot_tables import EMPTY_BASE_ITEMS, BaseItemTable, ModifierTable, max_modifiers_for_level
+
+
+@dataclass
+class DropOdds:
+    """Probability of every outcome for one level and class."""
+    level: int
+    char_class: str
+    modifier_count: list[float]        # modifier_count[k] = chance of ending up with k modifiers
+    modifier_chance: dict[str, float]  # chance each modifier is on the item
+    power_score: dict[int, float]      # power_score -> chance
+    base_items: dict[str, float]       # base item -> chance
+    tiers: dict[str, float]            # rarity tier -> chance
+
+
+def poisson_binomial(chances: list[float]) -> list[float]:
+    """Distribution of how many of the independent rolls succeed.
+    result[k] is the chance that exactly k of them succeed.
+    """
+    dist = [1.0]
+    for p in chances:
+        q = 1.0 - p
+        nxt = [0.0] * (len(dist) + 1)
+        for k, value in enumerate(dist):
+            nxt[k] += value * q
+            nxt[k + 1] += value * p
+        dist = nxt
+    return dist
+
+
+class OddsCalculator:
+    """Works out DropOdds for a modifier table and base item list.
+    The modifier part only depends on level, so it is cached per level.
+    """
+    def __init__(self, table: ModifierTable, base_items_by_class: dict[str, BaseItemTable]):
+        self._table = table
+        self._base_items_by_class = base_items_by_class
+        self._by_level: dict[int, tuple[list[float], dict[str, float]]] = {}
+
+    def updated(self, table: ModifierTable, base_items_by_class: dict[str, BaseItemTable]) -> "OddsCalculator":
+        """A calculator for new tables that keeps the cached levels whose modifiers didn't change."""
+        result = OddsCalculator(table, base_items_by_class)
+        for level, cached in self._by_level.items():
+            old = self._table.eligible(level)
+            if old == table.eligible(level) and all(
+                    self._table.names[i] == table.names[i] for i, _ in old):
+                result._by_level[level] = cached
+        return result
+
+    def odds(self, level: int, char_class: str) -> DropOdds:
+        """Exact odds for a character of this level and class."""
+        modifier_count, modifier_chance = self._level_odds(level)
+        power_score = {level + k: p for k, p in enumerate(modifier_count) if p > 0.0}
+        return DropOdds(
+            level=level,
+            char_class=char_class,
+            modifier_count=list(modifier_count),
+            modifier_chance=dict(modifier_chance),
+            power_score=power_score,
+            base_items=self._base_item_odds(char_class),
+            tiers=self._tier_odds(char_class),
+        )
+
+    def _level_odds(self, level: int) -> tuple[list[float], dict[str, float]]:
+        """Modifier count distribution and per-modifier chance for one level."""
+        cached = self._by_level.get(level)
+        if cached is not None:
+            return cached
+
+        eligible = self._table.eligible(level)
+        chances = [chance for _, chance in eligible]
+        max_mods = max_modifiers_for_level(level)
+
+        # how many modifiers roll, before the max_mods cap
+        rolled = poisson_binomial(chances)
+        # anything over the cap gets cut back to exactly max_mods
+        modifier_count = [0.0] * (max_mods + 1)
+        for k, p in enumerate(rolled):
+            modifier_count[min(k, max_mods)] += p
+
+        # a modifier survives the cap if it rolled, and then random.sample kept it.
+        # sample keeps max_mods out of (1 + the others that rolled), all equally likely
+        modifier_chance: dict[str, float] = {}
+        for position, (mod_id, chance) in enumerate(eligible):
+            others = poisson_binomial(chances[:position] + chances[position + 1:])
+            kept = 0.0
+            for j, p in enumerate(others):
+                kept += p * min(1.0, max_mods / (j + 1))
+            modifier_chance[self._table.names[mod_id]] = chance * kept
+
+        result = (modifier_count, modifier_chance)
+        self._by_level[level] = result
+        return result
+
+    def _base_item_odds(self, char_class: str) -> dict[str, float]:
+        """Base items are picked by their weight within the class."""
+        return self._base_items_by_class.get(char_class, EMPTY_BASE_ITEMS).chances()
+
+    def _tier_odds(self, char_class: str) -> dict[str, float]:
+        items = self._base_items_by_class.get(char_class, EMPTY_BASE_ITEMS)
+        odds: dict[str, float] = {}
+        for name, chance in items.chances().items():
+            tier = items.tier_of(name)
+            odds[tier] = odds.get(tier, 0.0) + chance
+        return odds
@@ -0,0 +1,108 @@
+"""
+loot_parallel.py
+Reproducible loot generation spread over several processes.
+
+The drops are cut into fixed-size shards, and shard i is always rolled with a
+random.Random seeded from (master seed, i). So the output only depends on the
+master seed and the shard size, never on how many workers ran it or which
+worker got which shard. Results come back in input order.
+"""
+
+import hashlib
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from loot_model import Character, LootBatch
+from loot_service import LootService
+
+DEFAULT_SHARD_SIZE = 10000
+
+_worker_service: LootService | None = None
+
+
+def shard_seed(master_seed: int, shard_index: int) -> int:
+    """Seed for one shard's RNG stream, derived from the master seed."""
+    digest = hashlib.sha256(f"{master_seed}:{shard_index}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def chunk_drops(requests, chunk_size: int):
+    """Group requests into lists of at most chunk_size characters, one entry per drop.
+    A request for more drops than chunk_size is split over several chunks.
+    """
+    chunk: list[Character] = []
+    for character, count in requests:
+        while count > 0:
+            take = min(count, chunk_size - len(chunk))
+            chunk.extend([character] * take)
+            count -= take
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def group_runs(characters: list[Character]) -> tuple[list[Character], list[int]]:
+    """Collapse runs of the same character in a one-entry-per-drop list into
+    (characters, counts), the form generate_loot_batch rolls fastest.
+    The drops come out in the same order, so a seeded RNG gives the same items.
+    """
+    grouped: list[Character] = []
+    counts: list[int] = []
+    previous = None
+    for character in characters:
+        if character is previous or (previous is not None and character == previous):
+            counts[-1] += 1
+        else:
+            grouped.append(character)
+            counts.append(1)
+            previous = character
+    return grouped, counts
+
+
+def _init_worker() -> None:
+    global _worker_service
+    _worker_service = LootService()
+
+
+def _generate_shard(master_seed: int, shard_index: int, characters: list[Character]) -> LootBatch:
+    """Roll one drop per entry in characters using the shard's own RNG stream."""
+    global _worker_service
+    if _worker_service is None:
+        _worker_service = LootService()
+    rng = random.Random(shard_seed(master_seed, shard_index))
+    batch = _worker_service.generate_loot_batch(*group_runs(characters), rng=rng)
+    # one row per entry of characters, in order
+    batch.character_index = list(range(len(characters)))
+    return batch
+
+
+def generate_parallel(requests, seed: int, workers: int | None = None,
+                      shard_size: int = DEFAULT_SHARD_SIZE):
+    """Generate loot for (Character, count) requests across worker processes.
+    Yields (characters, batch) per shard in input order, where batch row i is the
+    drop for characters[i]. workers=1 runs in this process, with the same output.
+    """
+    shards = enumerate(chunk_drops(requests, shard_size))
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        for index, characters in shards:
+            yield characters, _generate_shard(seed, index, characters)
+        return
+
+    # only keep a few shards per worker in flight, so memory stays bounded
+    # no matter how many requests there are
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        pending: deque = deque()
+        for index, characters in shards:
+            pending.append((characters, executor.submit(_generate_shard, seed, index, characters)))
+            if len(pending) >= workers * 2:
+                characters, future = pending.popleft()
+                yield characters, future.result()
+        while pending:
+            characters, future = pending.popleft()
+            yield characters, future.result()
@@ -0,0 +1,159 @@
+"""
+loot_pool.py
+Pools of pre-rolled loot, kept topped up by background threads.
+
+LootService.start_loot_pools() turns this on. A drop is then popped from the pool
+for the character's class and level, and only rolled inline when that pool is
+empty, so a burst of requests costs a deque pop each instead of a full roll.
+"""
+
+import random
+import threading
+from collections import deque
+
+from loot_model import Character, Item
+
+DEFAULT_POOL_DEPTH = 256
+# items rolled per batch call while refilling, keeps each GIL hold short
+REFILL_CHUNK = 64
+
+
+class LootPools:
+    """Ring buffers of pre-rolled Items per (class, level), refilled by worker threads.
+    A pool is made the first time its class and level is asked for, or by warm().
+    Once a pool is down to low_watermark items it is queued and topped back up to depth.
+    Pooled drops come from the workers' own random streams (seeded from seed), not the service's rng.
+    """
+    def __init__(self, service, depth: int = DEFAULT_POOL_DEPTH, low_watermark: int | None = None,
+                 workers: int = 1, seed: int | None = None):
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        if low_watermark is None:
+            low_watermark = depth // 2
+        if not 0 <= low_watermark < depth:
+            raise ValueError("low_watermark must be between 0 and depth - 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._service = service  # a loot_service.LootService
+        self.depth = depth
+        self.low_watermark = low_watermark
+
+        self._pools: dict[tuple[str, int], deque[Item]] = {}
+        self._pending: deque[tuple[str, int]] = deque()
+        self._queued: set[tuple[str, int]] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # bumped by clear(), so a refill that started before it throws its items away
+        self._generation = 0
+        self._stopped = False
+
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.discarded = 0
+
+        master = random.Random(seed)
+        self._threads = [
+            threading.Thread(target=self._refill_loop, args=(random.Random(master.getrandbits(64)),),
+                             daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def pop(self, char_class: str, level: int) -> Item | None:
+        """A pre-rolled item for this class and level, or None if the pool is empty."""
+        key = (char_class, level)
+        pool = self._pools.get(key)
+        item = None
+        if pool is not None:
+            try:
+                item = pool.popleft()
+            except IndexError:
+                pass  # drained, the caller rolls inline
+        # like the render cache, counts are bumped without the lock and can miss one under a race
+        if item is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if (pool is None or len(pool) <= self.low_watermark) and key not in self._queued:
+            self._request_refill(key)
+        return item
+
+    def warm(self, keys) -> None:
+        """Start filling the pools for these (char_class, level) pairs ahead of the first request."""
+        for char_class, level in keys:
+            self._request_refill((char_class, level))
+
+    def clear(self) -> None:
+        """Drop every pooled item, e.g. because the loot tables changed. Pools refill on demand."""
+        with self._lock:
+            self._generation += 1
+            self.discarded += sum(len(pool) for pool in self._pools.values())
+            self._pools = {}
+            self._pending.clear()
+            self._queued.clear()
+
+    def stop(self) -> None:
+        """Stop the worker threads. Items still pooled stay poppable."""
+        with self._wake:
+            self._stopped = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self) -> dict:
+        """Hit/miss counts, refill totals and the current size of every pool."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "depth": self.depth,
+                "low_watermark": self.low_watermark,
+                "workers": len(self._threads),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "refilled": self.refilled,
+                "discarded": self.discarded,
+                "pending_refills": len(self._pending),
+                "pools": [
+                    {"char_class": char_class, "level": level, "size": len(pool)}
+                    for (char_class, level), pool in sorted(self._pools.items())
+                ],
+            }
+
+    def _request_refill(self, key: tuple[str, int]) -> None:
+        with self._wake:
+            if self._stopped or key in self._queued:
+                return
+            self._pools.setdefault(key, deque(maxlen=self.depth))
+            self._queued.add(key)
+            self._pending.append(key)
+            self._wake.notify()
+
+    def _refill_loop(self, rng: random.Random) -> None:
+        while True:
+            with self._wake:
+                while not self._pending and not self._stopped:
+                    self._wake.wait()
+                if self._stopped:
+                    return
+                key = self._pending.popleft()
+                pool = self._pools[key]
+                generation = self._generation
+
+            character = Character(name="", char_class=key[0], level=key[1])
+            while len(pool) < self.depth:
+                count = min(REFILL_CHUNK, self.depth - len(pool))
+                # not recorded in the service's metrics, a pooled drop counts once it is popped
+                batch = self._service._generate_batch([character], count, rng, None)
+                with self._lock:
+                    if generation != self._generation or self._stopped:
+                        self.discarded += len(batch)
+                        break
+                    pool.extend(batch.item(row) for row in range(len(batch)))
+                    self.refilled += len(batch)
+
+            with self._lock:
+                if generation == self._generation:
+                    self._queued.discard(key)
@@ -0,0 +1,57 @@
+"""
+loot_rng.py
+A random stream that depends on nothing but its seed, for drops that have to roll
+out the same again long after they were logged (see storage_loot_seeds.py).
+
+random.Random only promises that random() stays the same between Python versions, not
+choice() or sample(). CounterRandom does all three itself: draw i comes from
+sha256("<seed>:<i // 4>"), and choice() and sample() are written out here on top of it.
+"""
+
+import hashlib
+import struct
+
+# one sha256 digest is four 64-bit words, each one draw
+_WORDS = struct.Struct("<4Q")
+# 53 random bits, the precision of a float
+_SCALE = 1.0 / (1 << 53)
+
+
+class CounterRandom:
+    """random(), choice() and sample() like random.Random's, from a counter-based stream.
+    Anything that rolls loot through an rng argument can be given one.
+    """
+    def __init__(self, seed: int):
+        self._prefix = hashlib.sha256(f"{seed}:".encode())
+        self._block = 0
+        self._draws: list[float] = []
+
+    def random(self) -> float:
+        """The next float in [0, 1)."""
+        if not self._draws:
+            digest = self._prefix.copy()
+            digest.update(str(self._block).encode())
+            self._block += 1
+            # reversed, so pop() hands them out in order
+            self._draws = [(word >> 11) * _SCALE for word in reversed(_WORDS.unpack(digest.digest()))]
+        return self._draws.pop()
+
+    def _below(self, n: int) -> int:
+        """A whole number in [0, n)."""
+        return min(int(self.random() * n), n - 1)
+
+    def choice(self, seq):
+        """One element of a non-empty sequence."""
+        if not seq:
+            raise IndexError("cannot choose from an empty sequence")
+        return seq[self._below(len(seq))]
+
+    def sample(self, population, k: int) -> list:
+        """k distinct elements of population in random order, by a partial Fisher-Yates shuffle."""
+        pool = list(population)
+        if not 0 <= k <= len(pool):
+            raise ValueError("sample larger than population or is negative")
+        for i in range(k):
+            j = i + self._below(len(pool) - i)
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
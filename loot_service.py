@@ -3,471 +3,621 @@ loot_service.py
 Loot generation logic: modifiers, chances, and name building.
 """
 
+import os
 import random
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import loot_tables
+import storage_loot
+from loot_cache import RenderCache
+from loot_metrics import LootMetrics
+from loot_model import Character, CompactItem, Item, LootBatch
+from loot_odds import DropOdds, OddsCalculator
+from loot_pool import DEFAULT_POOL_DEPTH, LootPools
+from loot_rng import CounterRandom
+from loot_tables import (EMPTY_BASE_ITEMS, FALLBACK_BASE_ITEM, PREFIX, SUFFIX, LootTables, ModifierTable,
+                         default_loot_tables, max_modifiers_for_level)
+
+# rows of one level rolled per NumPy matrix, so a huge batch doesn't need a huge matrix
+NUMPY_CHUNK_ROWS = 65536
+
+
+class _ActiveTables:
+    """The compiled tables a service generates from, plus the render cache and odds built on them.
+    A reload builds a new one and swaps it in with a single assignment, so a generation
+    call that already picked one up finishes with it and never mixes ids from two tables.
+    """
+    def __init__(self, tables: LootTables, render_cache_size: int, previous: "_ActiveTables | None" = None):
+        self.tables = tables
+        self.version = tables.version
+        self.table = tables.modifiers
+        self.base_items_by_class = tables.base_items_by_class
+        self.render_cache: RenderCache | None = None
+        self.odds: OddsCalculator | None = None
+
+        if previous is not None and previous.odds is not None:
+            self.odds = previous.odds.updated(self.table, self.base_items_by_class)
+        if render_cache_size > 0:
+            if previous is not None and previous.render_cache is not None \
+                    and previous.table.renders_like(self.table):
+                # only chances or base items changed, every cached string is still right
+                self.render_cache = previous.render_cache
+                self.render_cache.table = self.table
+            else:
+                self.render_cache = RenderCache(self.table, render_cache_size)
 
-from loot_model import Character, Item
-from storage_loot import load_base_items
 
 class LootService:
     """Handles loot generation,
     including applying modifiers, 
     how many, based on level,
     how they affect the item
+    Pass rng (a random.Random) for a reproducible stream, otherwise the global random module is used.
+    Pass metrics to record per-stage timings and drop counters.
+    Set render_cache_size to cache names and power texts for that many recent item combinations.
+    It pays off at low and mid levels where the same combinations repeat; at high levels
+    almost every combination is new, so it is off by default.
+    tables defaults to the process-wide compiled tables from loot_tables.default_loot_tables().
+    reload_tables() picks up edits to modifiers.txt / base_items.txt, start_table_watcher()
+    does that automatically from a background thread.
+    start_loot_pools() keeps pre-rolled drops ready per class and level (see loot_pool.py).
     """
-    def __init__(self):
-        self._base_items_by_class = load_base_items()
-        
-        # this will be a huge list of item modifiers
-        # it will be a long list of dictionaries
-        self._modifiers = [
-        # Power texts are modeled after D&D5e. Prefix/suffix controls name position.
-        # AI helped generate a few of these to increase the size of the modifiers list
-        # Level 1
-        {
-            "name": "Flaming",
-            "min_level": 1,
-            "chance": 0.3,
-            "power_text": "+1d4 fire damage",
-            "position": "prefix",
-        },
-        {
-            "name": "of the Flame",
-            "min_level": 1,
-            "chance": 0.2,
-            "power_text": "grants resistance to fire damage",
-            "position": "suffix",
-        },
-        {
-            "name": "Sharp",
-            "min_level": 1,
-            "chance": 0.25,
-            "power_text": "+1 to attack rolls",
-            "position": "prefix",
-        },
-        {
-            "name": "Sturdy",
-            "min_level": 1,
-            "chance": 0.2,
-            "power_text": "while wielded, +1 AC",
-            "position": "prefix",
-        },
-
-        # Level 2
-        {
-            "name": "Freezing",
-            "min_level": 2,
-            "chance": 0.2,
-            "power_text": "+1d4 cold damage",
-            "position": "prefix",
-        },
-        {
-            "name": "Silent",
-            "min_level": 2,
-            "chance": 0.15,
-            "power_text": "reduces noise, granting advantage on Stealth checks while wielded",
-            "position": "prefix",
-        },
-        {
-            "name": "of Focus",
-            "min_level": 2,
-            "chance": 0.2,
-            "power_text": "+1 to concentration checks",
-            "position": "suffix",
-        },
-        {
-            "name": "Tempest-Touched",
-            "min_level": 2,
-            "chance": 0.15,
-            "power_text": "weapon crackles faintly: +1 lightning damage",
-            "position": "prefix",
-        },
-        {
-            "name": "of the Owl",
-            "min_level": 2,
-            "chance": 0.18,
-            "power_text": "+1 to Wisdom (Perception) checks",
-            "position": "suffix",
-        },
-
-        # Level 3
-        {
-            "name": "Poisoned",
-            "min_level": 3,
-            "chance": 0.25,
-            "power_text": "on hit: target makes a DC 12 Con save or take 1d6 poison damage",
-            "position": "prefix",
-        },
-        {
-            "name": "of Venom",
-            "min_level": 3,
-            "chance": 0.15,
-            "power_text": "adds 1d4 poison damage on hit",
-            "position": "suffix",
-        },
-        {
-            "name": "Draining",
-            "min_level": 3,
-            "chance": 0.2,
-            "power_text": "on hit: regain 1 hit point",
-            "position": "prefix",
-        },
-        {
-            "name": "of Weakening",
-            "min_level": 3,
-            "chance": 0.15,
-            "power_text": "on hit: target makes DC 12 Str save or gets -1 on attack rolls next turn",
-            "position": "suffix",
-        },
-
-        # Level 4
-        {
-            "name": "of Jolting",
-            "min_level": 4,
-            "chance": 0.2,
-            "power_text": "on hit: target must make a DC 12 Con save or be stunned until the end of its next turn",
-            "position": "suffix",
-        },
-        {
-            "name": "of Windstep",
-            "min_level": 4,
-            "chance": 0.18,
-            "power_text": "your jump distance is doubled",
-            "position": "suffix",
-        },
-        {
-            "name": "Serrated",
-            "min_level": 4,
-            "chance": 0.2,
-            "power_text": "critical hits deal +1d4 bleeding damage",
-            "position": "prefix",
-        },
-
-        # Level 5
-        {
-            "name": "of the Unseen",
-            "min_level": 5,
-            "chance": 0.2,
-            "power_text": "You are lightly obscured while in dim light or darkness",
-            "position": "suffix",
-        },
-        {
-            "name": "of Swiftness",
-            "min_level": 5,
-            "chance": 0.2,
-            "power_text": "increases movement speed by 10 feet",
-            "position": "suffix",
-        },
-        {
-            "name": "Runic",
-            "min_level": 5,
-            "chance": 0.15,
-            "power_text": "+1 to spell attack rolls",
-            "position": "prefix",
-        },
-        {
-            "name": "of the Turtle",
-            "min_level": 5,
-            "chance": 0.15,
-            "power_text": "gain +2 temporary HP after a short rest",
-            "position": "suffix",
-        },
-
-        # Level 6
-        {
-            "name": "Infernal",
-            "min_level": 6,
-            "chance": 0.18,
-            "power_text": "+2d4 fire damage, resistance to fire",
-            "position": "prefix",
-        },
-        {
-            "name": "Soulbound",
-            "min_level": 6,
-            "chance": 0.14,
-            "power_text": "cannot be disarmed while wielding this item",
-            "position": "prefix",
-        },
-        {
-            "name": "of Echoes",
-            "min_level": 6,
-            "chance": 0.12,
-            "power_text": "spells cast while holding this item produce faint whispers",
-            "position": "suffix",
-        },
-
-        # Level 7
-        {
-            "name": "Glacial",
-            "min_level": 7,
-            "chance": 0.18,
-            "power_text": "+2d4 cold damage, target's speed is reduced by 10 feet until end of next turn",
-            "position": "prefix",
-        },
-        {
-            "name": "of Teleportation",
-            "min_level": 7,
-            "chance": 0.15,
-            "power_text": "cast Misty Step as a bonus action (recharge 5-6)",
-            "position": "suffix",
-        },
-        {
-            "name": "Shocking",
-            "min_level": 7,
-            "chance": 0.15,
-            "power_text": "+1d6 lightning damage",
-            "position": "prefix",
-        },
-        {
-            "name": "Ethereal",
-            "min_level": 7,
-            "chance": 0.12,
-            "power_text": "grants the ability to slightly hover (cosmetic)",
-            "position": "prefix",
-        },
-
-        # Level 8
-        {
-            "name": "Radiant",
-            "min_level": 8,
-            "chance": 0.15,
-            "power_text": "+2d6 radiant damage, emits bright light in a 10-foot radius",
-            "position": "prefix",
-        },
-        {
-            "name": "of Clarity",
-            "min_level": 8,
-            "chance": 0.12,
-            "power_text": "+2 to Arcana checks",
-            "position": "suffix",
-        },
-        {
-            "name": "Vampiric",
-            "min_level": 8,
-            "chance": 0.08,
-            "power_text": "on crit: regain 1d4 hit points",
-            "position": "prefix",
-        },
-
-        # Level 9
-        {
-            "name": "of Regeneration",
-            "min_level": 9,
-            "chance": 0.12,
-            "power_text": "regain 5 hit points at the start of your turn if you have at least 1 hit point",
-            "position": "suffix",
-        },
-        {
-            "name": "of the Leviathan",
-            "min_level": 9,
-            "chance": 0.1,
-            "power_text": "you can breathe underwater",
-            "position": "suffix",
-        },
-
-        # Level 10
-        {
-            "name": "of Void Walking",
-            "min_level": 10,
-            "chance": 0.1,
-            "power_text": "cast Greater Invisibility once per day",
-            "position": "suffix",
-        },
-        {
-            "name": "Arcaneforged",
-            "min_level": 10,
-            "chance": 0.1,
-            "power_text": "weapon counts as magical for overcoming resistance",
-            "position": "prefix",
-        },
-
-        # Level 11
-        {
-            "name": "of Thunder",
-            "min_level": 11,
-            "chance": 0.1,
-            "power_text": "on hit: target must make a DC 15 Con save or take 2d6 thunder damage",
-            "position": "prefix",
-        },
-        {
-            "name": "Howling",
-            "min_level": 11,
-            "chance": 0.08,
-            "power_text": "emits eerie wails when swung; Intimidation checks +2",
-            "position": "prefix",
-        },
-
-        # Level 12
-        {
-            "name": "of the Phoenix",
-            "min_level": 12,
-            "chance": 0.08,
-            "power_text": "once per day, regain 10 hit points when reduced to 0 hit points",
-            "position": "suffix",
-        },
-        {
-            "name": "of the Dragon's Eye",
-            "min_level": 12,
-            "chance": 0.07,
-            "power_text": "you can detect magic at will",
-            "position": "suffix",
-        },
-
-        # Level 13
-        {
-            "name": "of the Storm",
-            "min_level": 13,
-            "chance": 0.07,
-            "power_text": "on hit: target must make a DC 15 Dex save or take 3d6 lightning damage",
-            "position": "prefix",
-        },
-        {
-            "name": "Worldshaker",
-            "min_level": 13,
-            "chance": 0.05,
-            "power_text": "on hit: small shockwave pushes creatures 5 feet",
-            "position": "prefix",
-        },
-
-        # Level 14
-        {
-            "name": "of the Abyss",
-            "min_level": 14,
-            "chance": 0.05,
-            "power_text": "grants the ability to cast Darkness once per day",
-            "position": "suffix",
-        },
-        {
-            "name": "Astral",
-            "min_level": 14,
-            "chance": 0.05,
-            "power_text": "your form flickers, granting +1 AC",
-            "position": "prefix",
-        },
-
-        # Level 15
-        {
-            "name": "of the Titan",
-            "min_level": 15,
-            "chance": 0.03,
-            "power_text": "increases strength score by 2 while wielded",
-            "position": "prefix",
-        },
-        {
-            "name": "of the Horizon",
-            "min_level": 15,
-            "chance": 0.04,
-            "power_text": "vision range is doubled",
-            "position": "suffix",
-        },
-
-        # Level 16
-        {
-            "name": "of Soulfire",
-            "min_level": 16,
-            "chance": 0.03,
-            "power_text": "critical hits deal an extra 2d6 radiant damage",
-            "position": "suffix",
-        },
-
-        # Level 17
-        {
-            "name": "Planar",
-            "min_level": 17,
-            "chance": 0.02,
-            "power_text": "you can speak and understand any language",
-            "position": "prefix",
-        },
-
-        # Level 18
-        {
-            "name": "God-Touched",
-            "min_level": 18,
-            "chance": 0.02,
-            "power_text": "once per day, you may reroll a d20",
-            "position": "prefix",
-        },
-
-        # Level 19
-        {
-            "name": "Eclipseforged",
-            "min_level": 19,
-            "chance": 0.01,
-            "power_text": "this item leaves a trail of shadow-light; cosmetic only",
-            "position": "prefix",
-        },
-
-        # Level 20
-        {
-            "name": "of the Ancients",
-            "min_level": 20,
-            "chance": 0.01,
-            "power_text": "you can cast time stop once in your lifetime",
-            "position": "suffix",
-        },
-    ]
+    def __init__(self, rng: random.Random | None = None, metrics: LootMetrics | None = None,
+                 render_cache_size: int = 0, tables: LootTables | None = None):
+        self._rng = rng if rng is not None else random
+        self._metrics = metrics
+        self._render_cache_size = render_cache_size
+        self._active = _ActiveTables(tables if tables is not None else default_loot_tables(), render_cache_size)
+        self._reload_lock = threading.Lock()
+        self._watcher: threading.Thread | None = None
+        self._watcher_stop = threading.Event()
+        self._pools: LootPools | None = None
+        self._np_rng = None
+        self._np_rng_pid = None
+
+    @property
+    def tables_version(self) -> str:
+        """Hash of the data files the current tables were compiled from."""
+        return self._active.version
+
+    @property
+    def current_tables(self) -> LootTables:
+        """The compiled tables generation currently uses."""
+        return self._active.tables
+
+    @property
+    def modifier_table(self) -> ModifierTable:
+        """The compiled modifier table this service rolls from."""
+        return self._active.table
+
+    def render_cache_stats(self) -> dict | None:
+        """Hit/miss statistics of the name cache, or None when it is turned off."""
+        render_cache = self._active.render_cache
+        if render_cache is None:
+            return None
+        return render_cache.stats()
+
+    def reload_tables(self) -> bool:
+        """Recompile the tables if the data files changed and swap them in. Returns True if they did.
+        Generation keeps running on the old tables while the new ones are built.
+        """
+        with self._reload_lock:
+            current = self._active
+            tables = loot_tables.reload_loot_tables(current.tables)
+            if tables is None:
+                return False
+            self._active = _ActiveTables(tables, self._render_cache_size, current)
+            loot_tables.replace_default_loot_tables(current.tables, tables)
+            if self._pools is not None:
+                # pooled drops were rolled from the old tables
+                self._pools.clear()
+            return True
+
+    def start_table_watcher(self, interval: float = 2.0) -> None:
+        """Check the data files every interval seconds and reload when they change."""
+        if self._watcher is not None:
+            return
+        self._watcher_stop.clear()
+        self._watcher = threading.Thread(target=self._watch_tables, args=(interval,), daemon=True)
+        self._watcher.start()
+
+    def stop_table_watcher(self) -> None:
+        """Stop the thread started by start_table_watcher()."""
+        if self._watcher is None:
+            return
+        self._watcher_stop.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def start_loot_pools(self, depth: int = DEFAULT_POOL_DEPTH, low_watermark: int | None = None,
+                         workers: int = 1, seed: int | None = None, warm=()) -> None:
+        """Serve generate_loot_for_character from pools of pre-rolled drops.
+        Each (class, level) pool holds up to depth items and is refilled by the worker
+        threads once it is down to low_watermark (default depth // 2). warm is a list of
+        (char_class, level) pairs to fill right away instead of on their first request.
+        """
+        if self._pools is not None:
+            return
+        self._pools = LootPools(self, depth, low_watermark, workers, seed)
+        self._pools.warm(warm)
+
+    def stop_loot_pools(self) -> None:
+        """Stop the refill threads and go back to rolling every drop inline."""
+        pools = self._pools
+        if pools is None:
+            return
+        self._pools = None
+        pools.stop()
+
+    def loot_pool_stats(self) -> dict | None:
+        """Statistics of the pre-rolled pools, or None when they are off."""
+        if self._pools is None:
+            return None
+        return self._pools.stats()
+
+    def _watch_tables(self, interval: float) -> None:
+        last = _data_file_stamps()
+        while not self._watcher_stop.wait(interval):
+            stamps = _data_file_stamps()
+            if stamps == last:
+                continue
+            last = stamps
+            try:
+                if self.reload_tables():
+                    print(f"Loot tables reloaded, version {self.tables_version}")
+            except Exception as e:
+                # a half saved file shouldn't kill the watcher, the next save gets picked up
+                print(f"Could not reload loot tables: {e}")
 
-    
     def generate_loot_for_character(self, character: Character) -> Item:
         """Generate one loot item for a given character based on their level and class."""
-        base_item = self._choose_base_item(character.char_class)
-        modifiers = self._roll_modifiers(character.level)
-        full_name = self._build_item_name(base_item, modifiers)
-        power_text = self._build_power_text(modifiers)
+        pools = self._pools
+        if pools is not None:
+            item = pools.pop(character.char_class, character.level)
+            if item is not None:
+                if self._metrics is not None:
+                    # pooled drops are counted here, when they are actually handed out
+                    self._metrics.count_drop(character.char_class, character.level, len(item.modifiers))
+                    if item.truncated:
+                        self._metrics.count_truncations()
+                return item
+        active = self._active
+        if self._metrics is not None:
+            return self._generate_instrumented(character, active)
+        items = active.base_items_by_class.get(character.char_class, EMPTY_BASE_ITEMS)
+        base_item = self._choose_base_item(character.char_class, active)
+        modifier_ids, truncated = self._roll_modifiers_checked(character.level, active)
+        full_name, power_text = self._render(base_item, modifier_ids, active)
+        names = active.table.names
         return Item(
             base_item=base_item,
             full_name=full_name,
-            modifiers=[m["name"] for m in modifiers],
+            modifiers=[names[i] for i in modifier_ids],
             power_text=power_text,
-            power_score=int(len(modifiers) + character.level)
+            power_score=int(len(modifier_ids) + character.level),
+            tier=items.tier_of(base_item),
+            truncated=truncated,
+            modifier_mask=active.table.mask_of(modifier_ids),
         )
-        
-    def _choose_base_item(self, char_class: str) -> str:
-        """Choose a base item for a given character class."""
-        items = self._base_items_by_class.get(char_class, [])
-        if not items:
-            return "Mysterious Lint Ball"
-        return random.choice(items)
+
+    def generate_seeded_loot(self, character: Character, seed: int, tables: LootTables | None = None) -> Item:
+        """Generate the one item seed gives for this character's level and class.
+        The same seed and tables always give the same item, on any Python version, which
+        is what lets a seed-only history (storage_loot_seeds.py) rebuild drops later.
+        tables defaults to the current tables; pass older ones to replay a drop made with them.
+        """
+        active = self._active
+        if tables is not None and tables is not active.tables:
+            active = _ActiveTables(tables, 0)
+        # not random.Random: only its random() is promised to stay the same across versions
+        rng = CounterRandom(seed)
+        base_item = self._choose_base_item(character.char_class, active, rng)
+        modifier_ids, truncated = self._roll_modifiers_checked(character.level, active, rng)
+        if self._metrics is not None:
+            # truncations were counted by the roll, so the drop has to be too
+            self._metrics.count_drop(character.char_class, character.level, len(modifier_ids))
+        full_name, power_text = self._render(base_item, modifier_ids, active)
+        names = active.table.names
+        return Item(
+            base_item=base_item,
+            full_name=full_name,
+            modifiers=[names[i] for i in modifier_ids],
+            power_text=power_text,
+            power_score=int(len(modifier_ids) + character.level),
+            tier=active.base_items_by_class.get(character.char_class, EMPTY_BASE_ITEMS).tier_of(base_item),
+            truncated=truncated,
+            modifier_mask=active.table.mask_of(modifier_ids),
+        )
+
+    def _generate_instrumented(self, character: Character, active: _ActiveTables) -> Item:
+        """generate_loot_for_character, timing each stage into self._metrics."""
+        metrics = self._metrics
+        clock = time.perf_counter
+        t0 = clock()
+        base_item = self._choose_base_item(character.char_class, active)
+        t1 = clock()
+        modifier_ids, truncated = self._roll_modifiers_checked(character.level, active)
+        t2 = clock()
+        if active.render_cache is not None:
+            # name and power text come out of the cache together
+            full_name, power_text = active.render_cache.render(base_item, modifier_ids)
+            t4 = clock()
+            metrics.observe("render_cached", t4 - t2)
+        else:
+            full_name = active.table.build_name(base_item, modifier_ids)
+            t3 = clock()
+            power_text = active.table.build_power_text(modifier_ids)
+            t4 = clock()
+            metrics.observe("build_item_name", t3 - t2)
+            metrics.observe("build_power_text", t4 - t3)
+        metrics.observe("choose_base_item", t1 - t0)
+        metrics.observe("roll_modifiers", t2 - t1)
+        metrics.observe("generate_total", t4 - t0)
+        metrics.count_drop(character.char_class, character.level, len(modifier_ids))
+        names = active.table.names
+        return Item(
+            base_item=base_item,
+            full_name=full_name,
+            modifiers=[names[i] for i in modifier_ids],
+            power_text=power_text,
+            power_score=int(len(modifier_ids) + character.level),
+            tier=active.base_items_by_class.get(character.char_class, EMPTY_BASE_ITEMS).tier_of(base_item),
+            truncated=truncated,
+            modifier_mask=active.table.mask_of(modifier_ids),
+        )
+
+    def generate_loot_batch(self, characters: list[Character], drops_per_character: int | list[int],
+                            rng: random.Random | None = None) -> LootBatch:
+        """Generate many loot items at once and return them as columns.
+        Rows are grouped by character, in the same order as the characters list.
+        drops_per_character is one count for every character, or a list with a count per character.
+        rng overrides the service's random stream for this call.
+        With NumPy installed, and no rng here or on the service, the rolls are done a whole
+        matrix at a time from the service's own numpy.random.Generator. Otherwise (a seeded
+        stream, or no NumPy) every roll goes through rng.random() one by one.
+        """
+        return self._generate_batch(characters, drops_per_character, rng, self._metrics)
+
+    def _generate_batch(self, characters: list[Character], drops_per_character: int | list[int],
+                        rng: random.Random | None, metrics: LootMetrics | None) -> LootBatch:
+        """generate_loot_batch, recording into metrics unless it is None.
+        Pool refills pass None: their drops are counted when they are served.
+        """
+        batch = LootBatch(
+            character_index=[],
+            base_items=[],
+            full_names=[],
+            modifiers=[],
+            power_texts=[],
+            power_scores=[],
+            tiers=[],
+            truncated=[],
+            modifier_masks=[],
+        )
+        if isinstance(drops_per_character, int):
+            counts = [drops_per_character] * len(characters)
+        else:
+            counts = drops_per_character
+        if len(counts) != len(characters):
+            raise ValueError(f"got {len(counts)} drop counts for {len(characters)} characters")
+        if np is not None and rng is None and self._rng is random:
+            return self._generate_batch_numpy(characters, counts, metrics)
+
+        # look these up once instead of once per roll
+        rng = rng if rng is not None else self._rng
+        rand = rng.random
+        sample = rng.sample
+        active = self._active
+        table = active.table
+        names = table.names
+        masks = table.masks
+        render = active.render_cache.render if active.render_cache is not None else None
+        truncations = 0
+        started = time.perf_counter()
+
+        for index, (character, count) in enumerate(zip(characters, counts)):
+            if count <= 0:
+                continue
+            level = character.level
+            eligible = table.eligible(level)
+            max_mods = max_modifiers_for_level(level)
+            items = active.base_items_by_class.get(character.char_class, EMPTY_BASE_ITEMS)
+            choose = items.choose
+            tier_of = items.tier_of
+
+            for _ in range(count):
+                base_item = choose(rng)
+                chosen = [i for i, chance in eligible if rand() < chance]
+                truncated = len(chosen) > max_mods
+                if truncated:
+                    chosen = sample(chosen, k=max_mods)
+                    truncations += 1
+
+                if render is not None:
+                    full_name, power_text = render(base_item, chosen)
+                else:
+                    full_name = table.build_name(base_item, chosen)
+                    power_text = table.build_power_text(chosen)
+                mask = 0
+                for i in chosen:
+                    mask |= masks[i]
+                batch.character_index.append(index)
+                batch.base_items.append(base_item)
+                batch.full_names.append(full_name)
+                batch.modifiers.append([names[i] for i in chosen])
+                batch.power_texts.append(power_text)
+                batch.power_scores.append(len(chosen) + level)
+                batch.tiers.append(tier_of(base_item))
+                batch.truncated.append(truncated)
+                batch.modifier_masks.append(mask)
+
+        if metrics is not None:
+            metrics.observe("generate_batch", time.perf_counter() - started)
+            metrics.count_truncations(truncations)
+            for row, index in enumerate(batch.character_index):
+                character = characters[index]
+                metrics.count_drop(character.char_class, character.level, len(batch.modifiers[row]))
+        return batch
+
+    def _numpy_generator(self):
+        """The service's NumPy generator, made again in a forked child so it doesn't repeat the parent."""
+        if self._np_rng is None or self._np_rng_pid != os.getpid():
+            self._np_rng = np.random.default_rng()
+            self._np_rng_pid = os.getpid()
+        return self._np_rng
+
+    def _generate_batch_numpy(self, characters: list[Character], counts: list[int],
+                              metrics: LootMetrics | None) -> LootBatch:
+        """_generate_batch with the rolls done in NumPy. Each level's rows get their whole
+        Bernoulli matrix in one call, and rows over the cap keep max_mods of their hits picked
+        by random keys. The result is a matrix of modifier ids per row, padded with
+        len(table), which every string column is built from.
+        """
+        started = time.perf_counter()
+        gen = self._numpy_generator()
+        active = self._active
+        table = active.table
+        chances = np.asarray(table.chances, dtype=np.float32)
+
+        row_characters = np.repeat(np.arange(len(characters)), np.maximum(np.asarray(counts, dtype=np.int64), 0))
+        rows_total = len(row_characters)
+        row_levels = np.fromiter((c.level for c in characters), np.int64, len(characters))[row_characters]
+
+        # base items, one class at a time
+        class_ids: dict[str, int] = {}
+        row_classes = np.fromiter((class_ids.setdefault(c.char_class, len(class_ids)) for c in characters),
+                                  np.int64, len(characters))[row_characters]
+        base_items = np.empty(rows_total, dtype=object)
+        tiers = np.empty(rows_total, dtype=object)
+        for char_class, class_id in class_ids.items():
+            rows = np.flatnonzero(row_classes == class_id)
+            if not len(rows):
+                continue
+            items = active.base_items_by_class.get(char_class, EMPTY_BASE_ITEMS)
+            if not len(items):
+                base_items[rows] = FALLBACK_BASE_ITEM
+                tiers[rows] = items.tier_of(FALLBACK_BASE_ITEM)
+                continue
+            if items.uniform:
+                picks = gen.integers(len(items), size=len(rows))
+            else:
+                keep, alias = items.alias_table()
+                u = gen.random(len(rows)) * len(items)
+                slots = np.minimum(u.astype(np.int64), len(items) - 1)
+                picks = np.where(u - slots < np.asarray(keep)[slots], slots, np.asarray(alias)[slots])
+            base_items[rows] = np.array(items.names, dtype=object)[picks]
+            tiers[rows] = np.array(items.tiers, dtype=object)[picks]
+
+        # modifiers, one level at a time, into ids[row, :sizes[row]] in table order
+        levels = np.unique(row_levels).tolist()
+        width = max((max_modifiers_for_level(level) for level in levels), default=1)
+        padding = len(table)
+        ids = np.full((rows_total, width), padding, dtype=np.int64)
+        sizes = np.zeros(rows_total, dtype=np.int64)
+        truncated = np.zeros(rows_total, dtype=bool)
+        # a draw divided by its modifier's chance is under 1 exactly for a hit, and uniform
+        # over [0, 1) given that, so it also serves as the random key that picks which hits a
+        # row over the cap keeps: the max_mods smallest
+        scale = 1.0 / np.maximum(chances, np.finfo(np.float32).tiny)
+        for level in levels:
+            level_rows = np.flatnonzero(row_levels == level)
+            eligible = table.eligible_count(level)
+            max_mods = max_modifiers_for_level(level)
+            if not eligible:
+                continue
+            for start in range(0, len(level_rows), NUMPY_CHUNK_ROWS):
+                rows = level_rows[start:start + NUMPY_CHUNK_ROWS]
+                keys = gen.random((len(rows), eligible), dtype=np.float32) * scale[:eligible]
+                if eligible > max_mods:
+                    kept = np.argpartition(keys, max_mods - 1, axis=1)[:, :max_mods]
+                    truncated[rows] = (keys < 1.0).sum(axis=1) > max_mods
+                else:
+                    kept = np.broadcast_to(np.arange(eligible), keys.shape)
+                valid = np.take_along_axis(keys, kept, axis=1) < 1.0
+                chunk_ids = np.where(valid, kept, padding)
+                chunk_ids.sort(axis=1)
+                ids[rows, :chunk_ids.shape[1]] = chunk_ids
+                sizes[rows] = valid.sum(axis=1)
+
+        # every distinct modifier set ("combo") is rendered once, from per-id pieces of
+        # build_name() and build_power_text(); the padding id adds nothing
+        row_combos = None
+        if (padding + 1) ** width < 2 ** 63:
+            # one int per row sorts much faster than rows of ids
+            combo_keys = ids @ (padding + 1) ** np.arange(width, dtype=np.int64)
+            _, first, inverse = np.unique(combo_keys, return_index=True, return_inverse=True)
+            # at high levels nearly every row is its own combo, and mapping back costs more than it saves
+            if len(first) * 2 <= rows_total:
+                combos, row_combos = ids[first], inverse.reshape(-1)
+        if row_combos is None:
+            combos = ids
+        combo_sizes = (combos != padding).sum(axis=1)
+        names = table.names
+        positions = table.positions
+        prefixes = np.array([name + " " if position == PREFIX else "" for name, position in zip(names, positions)]
+                            + [""], dtype=object)[combos].sum(axis=1)
+        suffixes = np.array([" " + name if position == SUFFIX else "" for name, position in zip(names, positions)]
+                            + [""], dtype=object)[combos].sum(axis=1)
+        power_texts = np.array(table.power_texts + ("",), dtype=object)[combos[:, 0]]
+        if width > 1:
+            power_texts = power_texts + np.array(["\n" + text for text in table.power_texts] + [""],
+                                                 dtype=object)[combos[:, 1:]].sum(axis=1)
+        power_texts[combo_sizes == 0] = "No special properties."
+        if max(table.bits, default=0) < 63:
+            masks = np.array(table.masks + (0,), dtype=np.int64)[combos].sum(axis=1)
+        else:
+            masks = np.array(table.masks + (0,), dtype=object)[combos].sum(axis=1)
+        combo_modifiers = [row[:size] for row, size in
+                           zip(np.array(names + (None,), dtype=object)[combos].tolist(), combo_sizes.tolist())]
+
+        if row_combos is None:
+            modifiers = combo_modifiers
+        else:
+            # a list of its own per row, like the other generate_ functions give
+            modifiers = list(map(list, map(combo_modifiers.__getitem__, row_combos.tolist())))
+            prefixes, suffixes = prefixes[row_combos], suffixes[row_combos]
+            power_texts, masks = power_texts[row_combos], masks[row_combos]
+        batch = LootBatch(
+            character_index=row_characters.tolist(),
+            base_items=base_items.tolist(),
+            full_names=(prefixes + base_items + suffixes).tolist(),
+            modifiers=modifiers,
+            power_texts=power_texts.tolist(),
+            power_scores=(sizes + row_levels).tolist(),
+            tiers=tiers.tolist(),
+            truncated=truncated.tolist(),
+            modifier_masks=masks.tolist(),
+        )
+
+        if metrics is not None:
+            metrics.observe("generate_batch", time.perf_counter() - started)
+            metrics.count_truncations(int(truncated.sum()))
+            for row, index in enumerate(batch.character_index):
+                character = characters[index]
+                metrics.count_drop(character.char_class, character.level, len(batch.modifiers[row]))
+        return batch
+
+    def generate_compact_loot_for_character(self, character: Character) -> CompactItem:
+        """Like generate_loot_for_character, but the strings are only built if they are read."""
+        active = self._active
+        base_item = self._choose_base_item(character.char_class, active)
+        modifier_ids, truncated = self._roll_modifiers_checked(character.level, active)
+        if self._metrics is not None:
+            # truncations were counted by the roll, so the drop has to be too
+            self._metrics.count_drop(character.char_class, character.level, len(modifier_ids))
+        tier = active.base_items_by_class.get(character.char_class, EMPTY_BASE_ITEMS).tier_of(base_item)
+        return CompactItem(base_item, tuple(modifier_ids), len(modifier_ids) + character.level, active.table,
+                           tier, truncated)
+
+    def generate_compact_loot(self, characters: list[Character], drops_per_character: int,
+                              rng: random.Random | None = None) -> list[CompactItem]:
+        """Like generate_loot_batch, but returns CompactItems, grouped by character in list order.
+        For holding very many drops in memory at once.
+        """
+        rng = rng if rng is not None else self._rng
+        rand = rng.random
+        sample = rng.sample
+        active = self._active
+        table = active.table
+        metrics = self._metrics
+        result: list[CompactItem] = []
+        truncations = 0
+        started = time.perf_counter()
+
+        for character in characters:
+            level = character.level
+            eligible = table.eligible(level)
+            max_mods = max_modifiers_for_level(level)
+            items = active.base_items_by_class.get(character.char_class, EMPTY_BASE_ITEMS)
+            choose = items.choose
+            tier_of = items.tier_of
+
+            for _ in range(drops_per_character):
+                base_item = choose(rng)
+                chosen = [i for i, chance in eligible if rand() < chance]
+                truncated = len(chosen) > max_mods
+                if truncated:
+                    chosen = sample(chosen, k=max_mods)
+                    truncations += 1
+                result.append(CompactItem(base_item, tuple(chosen), len(chosen) + level, table,
+                                          tier_of(base_item), truncated))
+
+        if metrics is not None:
+            metrics.observe("generate_compact", time.perf_counter() - started)
+            metrics.count_truncations(truncations)
+            for row, item in enumerate(result):
+                character = characters[row // drops_per_character]
+                metrics.count_drop(character.char_class, character.level, len(item.modifier_ids))
+        return result
+
+    def drop_odds(self, level: int, char_class: str) -> DropOdds:
+        """Exact chances for what a character of this level and class can get."""
+        active = self._active
+        if active.odds is None:
+            active.odds = OddsCalculator(active.table, active.base_items_by_class)
+        return active.odds.odds(level, char_class)
+
+    def _choose_base_item(self, char_class: str, active: _ActiveTables | None = None,
+                          rng: random.Random | None = None) -> str:
+        """Choose a base item for a given character class, weighted by base_items.txt."""
+        active = active or self._active
+        return active.base_items_by_class.get(char_class, EMPTY_BASE_ITEMS).choose(rng or self._rng)
     
-    def _roll_modifiers(self, level: int) -> list[dict[str, any]]:
+    def _roll_modifiers(self, level: int, active: _ActiveTables | None = None,
+                        rng: random.Random | None = None) -> list[int]:
         """Roll for item modifiers based on character level.
         The gimmick for my modifier logic is the higher the level of the character, the more modifiers apply
+        Returns modifier ids into the compiled table.
         """
-        chosen: list[dict[str, any]] = []
-        for mod in self._modifiers:
-            if level < mod["min_level"]:
-                continue
-            if random.random() < mod["chance"]:
-                chosen.append(mod)
-        # the math for determining the max mods is:
-        # take the player level, divide by 4 and round down
-        # Never going below 1, or above 5
-        # can go higher with any future updates i'd want to do to it
-        max_mods = max(1, min(5, level // 4))
+        return self._roll_modifiers_checked(level, active, rng)[0]
+
+    def _roll_modifiers_checked(self, level: int, active: _ActiveTables | None = None,
+                                rng: random.Random | None = None) -> tuple[list[int], bool]:
+        """_roll_modifiers, plus whether max_mods cut the roll down."""
+        # only the modifiers this level can get are walked, the table is sorted by min_level
+        active = active or self._active
+        rng = rng or self._rng
+        rand = rng.random
+        chosen = [i for i, chance in active.table.eligible(level) if rand() < chance]
+        max_mods = max_modifiers_for_level(level)
         
         if len(chosen) > max_mods:
-            chosen = random.sample(chosen, k=max_mods)
-        return chosen
+            chosen = rng.sample(chosen, k=max_mods)
+            if self._metrics is not None:
+                self._metrics.count_truncations()
+            return chosen, True
+        return chosen, False
     
-    def _build_item_name(self, base_item: str, modifiers: list[dict[str, any]]) -> str:
+    def _render(self, base_item: str, modifier_ids: list[int],
+                active: _ActiveTables | None = None) -> tuple[str, str]:
+        """Full name and power text, from the cache when it is on."""
+        active = active or self._active
+        if active.render_cache is not None:
+            return active.render_cache.render(base_item, modifier_ids)
+        return active.table.build_name(base_item, modifier_ids), active.table.build_power_text(modifier_ids)
+
+    def _build_item_name(self, base_item: str, modifier_ids: list[int]) -> str:
         """Construct the full item name based on base item and modifiers."""
-        prefixes: list[str] = []
-        suffixes: list[str] = []
-        
-        for mod in modifiers:
-            if mod.get("position") == "prefix":
-                prefixes.append(mod["name"])
-            elif mod.get("position") == "suffix":
-                suffixes.append(mod["name"])
-        
-        parts: list[str] = []
-        parts.extend(prefixes)
-        parts.append(base_item)
-        parts.extend(suffixes)
-        
-        return " ".join(parts)
+        return self._active.table.build_name(base_item, modifier_ids)
     
-    def _build_power_text(self, modifiers: list[dict[str, any]]) -> str:
+    def _build_power_text(self, modifier_ids: list[int]) -> str:
         """Construct a descriptive power text based on item modifiers."""
-        if not modifiers:
-            return "No special properties."
-        return "\n".join(mod["power_text"] for mod in modifiers)
\ No newline at end of file
+        return self._active.table.build_power_text(modifier_ids)
+
+
+def _data_file_stamps() -> tuple:
+    """(mtime, size) of the loot data files, None for a missing one."""
+    stamps = []
+    for path in (storage_loot.MODIFIERS_FILE, storage_loot.BASE_ITEMS_FILE):
+        try:
+            st = os.stat(path)
+            stamps.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
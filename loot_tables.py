@@ -0,0 +1,467 @@
+"""
+loot_tables.py
+Compiled loot tables used by the loot generator.
+
+load_loot_tables() compiles modifiers.txt and base_items.txt once and keeps
+the result in LOOT_TABLES_CACHE_FILE, tagged with a hash of both files. Later
+processes load the cache instead, as long as the hash still matches.
+reload_loot_tables() rebuilds a running process's tables after the files change.
+retain_loot_tables() keeps a copy of a version in RETAINED_TABLES_DIR for good, as JSON,
+so drops logged against it can be rebuilt later (see storage_loot_seeds.py).
+"""
+
+import bisect
+import hashlib
+import json
+import marshal
+import os
+import threading
+from dataclasses import dataclass
+
+import storage_loot
+
+# position codes, so name building doesn't have to compare strings
+PREFIX = 0
+SUFFIX = 1
+NO_POSITION = 2
+
+POSITION_CODES = {"prefix": PREFIX, "suffix": SUFFIX}
+
+MAX_LEVEL = 20
+
+LOOT_TABLES_CACHE_FILE = ".loot_tables.cache"
+# a reload that would leave fewer than this share of the current modifiers is taken
+# for a half saved or clobbered modifiers.txt and refused
+RELOAD_MIN_MODIFIER_SHARE = 0.5
+# one <version>.json file per retained table version
+RETAINED_TABLES_DIR = "loot_table_versions"
+# bump when the cache layout changes
+_CACHE_FORMAT = 3
+# retained versions stay readable after a bump
+_READABLE_FORMATS = (2, 3)
+
+# what a class with no base items drops
+FALLBACK_BASE_ITEM = "Mysterious Lint Ball"
+
+
+def max_modifiers_for_level(level: int) -> int:
+    """How many modifiers an item can keep at a given level."""
+    # the math for determining the max mods is:
+    # take the player level, divide by 4 and round down
+    # Never going below 1, or above 5
+    # can go higher with any future updates i'd want to do to it
+    return max(1, min(5, level // 4))
+
+
+class ModifierTable:
+    """The modifier list flattened into parallel tuples, sorted by min_level.
+    A modifier id is its index into these tuples.
+
+    Each modifier also has a bit, so a set of modifiers fits in one int: masks[id] is
+    1 << bits[id]. Ids move when modifiers.txt is edited, bits don't (they come from
+    storage_loot.assign_modifier_bits), so masks compare across table versions.
+    Without a bits mapping, a modifier's bit is its line in the modifiers list.
+    """
+    def __init__(self, modifiers: list[dict[str, any]], bits: dict[str, int] | None = None):
+        if bits is None:
+            bits = {mod["name"]: i for i, mod in enumerate(modifiers)}
+        # sorted() is stable, so modifiers with the same min_level keep their order
+        ordered = sorted(modifiers, key=lambda mod: mod["min_level"])
+        self._set_columns(
+            tuple(mod["name"] for mod in ordered),
+            tuple(mod["min_level"] for mod in ordered),
+            tuple(mod["chance"] for mod in ordered),
+            tuple(mod["power_text"] for mod in ordered),
+            tuple(POSITION_CODES.get(mod.get("position"), NO_POSITION) for mod in ordered),
+            tuple(bits[mod["name"]] for mod in ordered),
+        )
+
+    @classmethod
+    def from_columns(cls, columns: tuple) -> "ModifierTable":
+        """Rebuild a table from columns(), skipping the sort."""
+        table = cls.__new__(cls)
+        table._set_columns(*columns)
+        return table
+
+    def columns(self) -> tuple:
+        """The parallel tuples, in a form marshal and JSON can store."""
+        return (self.names, self.min_levels, self.chances, self.power_texts, self.positions, self.bits)
+
+    def _set_columns(self, names, min_levels, chances, power_texts, positions, bits) -> None:
+        self.names: tuple[str, ...] = tuple(names)
+        self.min_levels: tuple[int, ...] = tuple(min_levels)
+        self.chances: tuple[float, ...] = tuple(chances)
+        self.power_texts: tuple[str, ...] = tuple(power_texts)
+        self.positions: tuple[int, ...] = tuple(positions)
+        self.bits: tuple[int, ...] = tuple(bits)
+        self.masks: tuple[int, ...] = tuple(1 << bit for bit in self.bits)
+        self._id_by_bit = {bit: i for i, bit in enumerate(self.bits)}
+        self._mask_by_name = dict(zip(self.names, self.masks))
+
+        # _eligible[level] is the (id, chance) prefix a character of that level can roll
+        self._eligible: list[tuple[tuple[int, float], ...]] = []
+        for level in range(MAX_LEVEL + 1):
+            count = bisect.bisect_right(self.min_levels, level)
+            self._eligible.append(tuple((i, self.chances[i]) for i in range(count)))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def eligible_count(self, level: int) -> int:
+        """Number of modifiers (from the start of the table) a level can roll."""
+        if 0 <= level <= MAX_LEVEL:
+            return len(self._eligible[level])
+        return bisect.bisect_right(self.min_levels, level)
+
+    def eligible(self, level: int) -> tuple[tuple[int, float], ...]:
+        """The (id, chance) pairs a character of this level can roll."""
+        if 0 <= level <= MAX_LEVEL:
+            return self._eligible[level]
+        count = self.eligible_count(level)
+        return tuple((i, self.chances[i]) for i in range(count))
+
+    def mask_of(self, modifier_ids) -> int:
+        """The mask of a set of modifier ids."""
+        masks = self.masks
+        mask = 0
+        for i in modifier_ids:
+            mask |= masks[i]
+        return mask
+
+    def mask_of_names(self, names) -> int:
+        """The mask of some modifier names. KeyError for a name this table doesn't have."""
+        mask_by_name = self._mask_by_name
+        mask = 0
+        for name in names:
+            mask |= mask_by_name[name]
+        return mask
+
+    def ids_in(self, mask: int) -> list[int]:
+        """The ids of the modifiers in a mask, in table order. Bits this table doesn't have are skipped."""
+        id_by_bit = self._id_by_bit
+        ids = []
+        while mask:
+            low = mask & -mask
+            i = id_by_bit.get(low.bit_length() - 1)
+            if i is not None:
+                ids.append(i)
+            mask ^= low
+        ids.sort()
+        return ids
+
+    def names_in(self, mask: int) -> list[str]:
+        """The names of the modifiers in a mask, in table order."""
+        names = self.names
+        return [names[i] for i in self.ids_in(mask)]
+
+    def renders_like(self, other: "ModifierTable") -> bool:
+        """True if both tables build the same names and power texts for every id (chances may differ)."""
+        return (self.names == other.names and self.positions == other.positions
+                and self.power_texts == other.power_texts)
+
+    def build_name(self, base_item: str, modifier_ids: list[int]) -> str:
+        """Prefixes, then the base item, then suffixes.
+        For a mask, pass ids_in(mask): the modifiers then come out in table order.
+        """
+        names = self.names
+        positions = self.positions
+        parts = [names[i] for i in modifier_ids if positions[i] == PREFIX]
+        parts.append(base_item)
+        parts.extend(names[i] for i in modifier_ids if positions[i] == SUFFIX)
+        return " ".join(parts)
+
+    def build_power_text(self, modifier_ids: list[int]) -> str:
+        """One line of power text per modifier."""
+        if not modifier_ids:
+            return "No special properties."
+        power_texts = self.power_texts
+        return "\n".join(power_texts[i] for i in modifier_ids)
+
+
+class BaseItemTable:
+    """One class's base items with their weights and tiers.
+    Weighted picks go through a Vose alias table, so a pick costs the same however
+    many items the class has. If every weight is equal it is a plain rng.choice.
+    """
+    def __init__(self, items: list[dict[str, any]]):
+        self._set_columns(*_base_item_columns(items))
+
+    @classmethod
+    def from_columns(cls, columns: tuple) -> "BaseItemTable":
+        """Rebuild a table from columns()."""
+        table = cls.__new__(cls)
+        table._set_columns(*columns)
+        return table
+
+    def columns(self) -> tuple:
+        """The parallel tuples, in a form marshal and JSON can store."""
+        return (self.names, self.weights, self.tiers)
+
+    def _set_columns(self, names, weights, tiers) -> None:
+        self.names: tuple[str, ...] = tuple(names)
+        self.weights: tuple[float, ...] = tuple(weights)
+        self.tiers: tuple[str, ...] = tuple(tiers)
+        self._tier_by_name = dict(zip(self.names, self.tiers))
+        self.uniform = len(set(self.weights)) <= 1
+
+        # Vose's alias method: slot i keeps item i with chance _keep[i], otherwise it is _alias[i]
+        count = len(self.weights)
+        total = sum(self.weights)
+        self._keep = [1.0] * count
+        self._alias = list(range(count))
+        if self.uniform:
+            return
+        scaled = [weight * count / total for weight in self.weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            lo = small.pop()
+            hi = large.pop()
+            self._keep[lo] = scaled[lo]
+            self._alias[lo] = hi
+            scaled[hi] -= 1.0 - scaled[lo]
+            (small if scaled[hi] < 1.0 else large).append(hi)
+        # whatever is left is 1 give or take rounding, those slots keep their own item
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def choose(self, rng) -> str:
+        """Pick one base item by weight. rng is a random.Random or the random module."""
+        if not self.names:
+            return FALLBACK_BASE_ITEM
+        if self.uniform:
+            return rng.choice(self.names)
+        # one random number picks both the slot and whether to take its alias
+        u = rng.random() * len(self.names)
+        slot = int(u)
+        if u - slot < self._keep[slot]:
+            return self.names[slot]
+        return self.names[self._alias[slot]]
+
+    def alias_table(self) -> tuple[list[float], list[int]]:
+        """(keep, alias) of the alias table choose() walks, for picking many items at once."""
+        return self._keep, self._alias
+
+    def tier_of(self, name: str) -> str:
+        """Rarity tier of a base item, "common" for the fallback item."""
+        return self._tier_by_name.get(name, "common")
+
+    def chances(self) -> dict[str, float]:
+        """Chance of each base item being picked."""
+        if not self.names:
+            return {FALLBACK_BASE_ITEM: 1.0}
+        total = sum(self.weights)
+        chances: dict[str, float] = {}
+        for name, weight in zip(self.names, self.weights):
+            chances[name] = chances.get(name, 0.0) + weight / total
+        return chances
+
+
+def _base_item_columns(items: list[dict[str, any]]) -> tuple:
+    return (
+        tuple(item["name"] for item in items),
+        tuple(float(item["weight"]) for item in items),
+        tuple(item["tier"] for item in items),
+    )
+
+
+# shared by every class that has no base items
+EMPTY_BASE_ITEMS = BaseItemTable([])
+
+
+@dataclass
+class LootTables:
+    """Everything generation reads: the modifier table and the base items per class.
+    version is a hash of the sources they were compiled from.
+    """
+    version: str
+    modifiers: ModifierTable
+    base_items_by_class: dict[str, BaseItemTable]
+
+
+def _base_item_tables(base_items: dict[str, list[dict[str, any]]]) -> dict[str, BaseItemTable]:
+    return {char_class: BaseItemTable(items) for char_class, items in base_items.items()}
+
+
+def _modifier_table(modifiers: list[dict[str, any]]) -> ModifierTable:
+    """A ModifierTable with bits from the registry, registering new modifiers first."""
+    return ModifierTable(modifiers, storage_loot.assign_modifier_bits([mod["name"] for mod in modifiers]))
+
+
+def _read_bytes(path: str) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return b""
+
+
+def tables_version() -> str:
+    """Hash of the modifiers file and the base items file."""
+    digest = hashlib.sha256()
+    digest.update(_read_bytes(storage_loot.MODIFIERS_FILE))
+    digest.update(b"\0")
+    digest.update(_read_bytes(storage_loot.BASE_ITEMS_FILE))
+    return digest.hexdigest()[:16]
+
+
+def compile_loot_tables(version: str | None = None) -> LootTables:
+    """Build the tables straight from the data files, without the cache."""
+    return LootTables(
+        version=version or tables_version(),
+        modifiers=_modifier_table(storage_loot.load_modifiers()),
+        base_items_by_class=_base_item_tables(storage_loot.load_base_items()),
+    )
+
+
+def _stored_form(tables: LootTables) -> dict:
+    """The tables as plain dicts, tuples, strings and numbers, for marshal or JSON."""
+    return {
+        "format": _CACHE_FORMAT,
+        "version": tables.version,
+        "modifiers": tables.modifiers.columns(),
+        "base_items": {char_class: items.columns() for char_class, items in tables.base_items_by_class.items()},
+    }
+
+
+def _from_stored_form(stored: dict, version: str) -> LootTables | None:
+    """Tables back from _stored_form(), or None if they are some other version."""
+    if stored.get("format") not in _READABLE_FORMATS or stored.get("version") != version:
+        return None
+    modifier_columns = stored["modifiers"]
+    if len(modifier_columns) == 5:
+        # format 2, written before modifier bits: look them up in the registry
+        bits = storage_loot.assign_modifier_bits(modifier_columns[0])
+        modifier_columns = (*modifier_columns, tuple(bits[name] for name in modifier_columns[0]))
+    return LootTables(
+        version=version,
+        modifiers=ModifierTable.from_columns(modifier_columns),
+        base_items_by_class={char_class: BaseItemTable.from_columns(columns)
+                             for char_class, columns in stored["base_items"].items()},
+    )
+
+
+def _read_tables_file(path: str, version: str) -> LootTables | None:
+    """Tables stored by _write_tables_file, or None if the file is missing, stale or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            return _from_stored_form(marshal.load(f), version)
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, KeyError):
+        return None
+
+
+def _write_tables_file(tables: LootTables, path: str) -> None:
+    try:
+        temp_path = path + f".{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            marshal.dump(_stored_form(tables), f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write {path}: {e}")
+
+
+def load_loot_tables() -> LootTables:
+    """Load the compiled tables from the cache file, recompiling it if the sources changed."""
+    version = tables_version()
+    tables = _read_tables_file(LOOT_TABLES_CACHE_FILE, version)
+    if tables is None:
+        # missing, stale or unreadable: rebuild it
+        tables = compile_loot_tables(version)
+        _write_tables_file(tables, LOOT_TABLES_CACHE_FILE)
+    return tables
+
+
+def _retained_path(version: str) -> str:
+    return os.path.join(RETAINED_TABLES_DIR, f"{version}.json")
+
+
+def retain_loot_tables(tables: LootTables) -> None:
+    """Keep these tables in RETAINED_TABLES_DIR, if that version isn't there yet.
+    They are kept as JSON: unlike the cache's marshal format, it reads the same on every
+    Python version, and these files have to outlive many of them.
+    """
+    path = _retained_path(tables.version)
+    if os.path.exists(path):
+        return
+    try:
+        os.makedirs(RETAINED_TABLES_DIR, exist_ok=True)
+        temp_path = path + f".{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(_stored_form(tables), f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write {path}: {e}")
+
+
+def load_retained_loot_tables(version: str) -> LootTables | None:
+    """The tables of an earlier version, from RETAINED_TABLES_DIR or the current data files.
+    None if that version was never retained.
+    """
+    tables = None
+    try:
+        with open(_retained_path(version), "r", encoding="utf-8") as f:
+            tables = _from_stored_form(json.load(f), version)
+    except (OSError, ValueError, TypeError, AttributeError, KeyError):
+        pass
+    if tables is None and version == tables_version():
+        tables = load_loot_tables()
+    return tables
+
+
+def reload_loot_tables(current: LootTables) -> LootTables | None:
+    """Rebuild the tables if the data files changed since current was built, else None.
+    Whatever didn't change is reused as the same object: the whole modifier table
+    if only base items changed, and each class's BaseItemTable whose items are the same.
+    Also None, keeping current, if modifiers.txt has lines that can't be read or lost
+    most of its modifiers: nothing from such a file gets a bit in the registry.
+    """
+    version = tables_version()
+    if version == current.version:
+        return None
+
+    loaded, skipped = storage_loot.load_modifiers_checked()
+    if skipped:
+        print(f"Not reloading loot tables: {skipped} bad line(s) in {storage_loot.MODIFIERS_FILE}")
+        return None
+    if len(loaded) < len(current.modifiers.names) * RELOAD_MIN_MODIFIER_SHARE:
+        print(f"Not reloading loot tables: {storage_loot.MODIFIERS_FILE} has {len(loaded)} modifiers, "
+              f"down from {len(current.modifiers.names)}")
+        return None
+    modifiers = _modifier_table(loaded)
+    if modifiers.columns() == current.modifiers.columns():
+        modifiers = current.modifiers
+
+    base_items: dict[str, BaseItemTable] = {}
+    for char_class, items in storage_loot.load_base_items().items():
+        columns = _base_item_columns(items)
+        previous = current.base_items_by_class.get(char_class)
+        if previous is not None and previous.columns() == columns:
+            base_items[char_class] = previous
+        else:
+            base_items[char_class] = BaseItemTable.from_columns(columns)
+
+    tables = LootTables(version=version, modifiers=modifiers, base_items_by_class=base_items)
+    _write_tables_file(tables, LOOT_TABLES_CACHE_FILE)
+    return tables
+
+
+_default_tables: LootTables | None = None
+_default_lock = threading.Lock()
+
+
+def default_loot_tables() -> LootTables:
+    """The tables for this process, loaded the first time they are asked for."""
+    global _default_tables
+    with _default_lock:
+        if _default_tables is None:
+            _default_tables = load_loot_tables()
+        return _default_tables
+
+
+def replace_default_loot_tables(old: LootTables, new: LootTables) -> None:
+    """Make new the process-wide tables, if old still is. Used after a reload."""
+    global _default_tables
+    with _default_lock:
+        if _default_tables is old:
+            _default_tables = new
@@ -1,15 +1,141 @@
 """
 main.py
 The main file with tkinter for the loot generation
+
+Generation, history writes and character saves run on a worker thread, so slow
+storage never freezes the window. Results come back through a queue that the Tk
+loop polls with after().
 """
 
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
 
+from character_index import CharacterIndex
 from loot_model import Character
 from loot_service import LootService
-from storage_loot import save_loot_history
-from storage_characters import load_characters, save_characters, modify_character
+from storage_loot import LootHistoryWriter
+from storage_characters import CharacterRepository
+
+# how often the Tk loop checks for worker results, and how many it handles per check
+POLL_INTERVAL_MS = 50
+MAX_RESULTS_PER_POLL = 50
+# drops per chunk in "Generate N", each chunk is appended to the output as it is ready
+BULK_CHUNK_SIZE = 25
+MAX_BULK_COUNT = 10000
+# rows the character browser shows at once, only these are ever formatted
+BROWSER_ROWS = 10
+# the roster is loaded on the worker and shown in chunks, starting with this many characters
+ROSTER_FIRST_CHUNK = 1000
+
+
+def format_item(character: Character, item) -> str:
+    """The text shown in the output box for one drop."""
+    modifier_list = ", ".join(item.modifiers) if item.modifiers else "None"
+    return (
+        f"Character: {character.name}\n"
+        f"Level: {character.level}\n"
+        f"Base Item: {item.base_item} ({item.tier})\n"
+        f"Full Name: {item.full_name}\n"
+        f"Modifiers: {modifier_list}\n"
+        f"Power Score: {item.power_score}\n"
+        f"Properties:\n{item.power_text}\n"
+    )
+
+
+class CharacterBrowser(tk.Frame):
+    """Type-to-filter list of characters that only renders the rows in view.
+    The listbox holds just the visible rows; scrolling moves a window over the
+    matching range of the CharacterIndex instead of loading every name into the widget.
+    """
+    def __init__(self, master, index: CharacterIndex, on_select, rows: int = BROWSER_ROWS):
+        super().__init__(master)
+        self.index = index
+        self.rows = rows
+        self._on_select = on_select
+        self._start = 0   # matching range in the index
+        self._end = 0
+        self._top = 0     # first visible match, relative to _start
+
+        self.filter_text = tk.StringVar()
+        self.entry_filter = tk.Entry(self, textvariable=self.filter_text)
+        self.listbox = tk.Listbox(self, height=rows, exportselection=False, activestyle="none")
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.label_count = tk.Label(self, anchor="w")
+
+        self.entry_filter.grid(row=0, column=0, columnspan=2, sticky="we")
+        self.listbox.grid(row=1, column=0, sticky="nsew")
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+        self.label_count.grid(row=2, column=0, columnspan=2, sticky="we")
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+
+        self.filter_text.trace_add("write", lambda *args: self.refresh(reset_scroll=True))
+        self.entry_filter.bind("<Return>", lambda event: self._select_row(0))
+        self.listbox.bind("<<ListboxSelect>>", self._on_listbox_select)
+        for widget in (self.listbox, self.entry_filter):
+            widget.bind("<MouseWheel>", self._on_mousewheel)
+            widget.bind("<Button-4>", lambda event: self._scroll_to(self._top - 3))
+            widget.bind("<Button-5>", lambda event: self._scroll_to(self._top + 3))
+        self.listbox.bind("<Up>", lambda event: self._scroll_to(self._top - 1))
+        self.listbox.bind("<Down>", lambda event: self._scroll_to(self._top + 1))
+        self.listbox.bind("<Prior>", lambda event: self._scroll_to(self._top - self.rows))
+        self.listbox.bind("<Next>", lambda event: self._scroll_to(self._top + self.rows))
+        self.refresh()
+
+    def refresh(self, reset_scroll: bool = False):
+        """Recompute the matches for the filter text and redraw the visible rows."""
+        self._start, self._end = self.index.prefix_range(self.filter_text.get().strip())
+        if reset_scroll:
+            self._top = 0
+        self._scroll_to(self._top)
+        self.label_count.config(text=f"{self._end - self._start} of {len(self.index)} characters")
+
+    def add_characters(self, characters: list[Character]):
+        """Add or update many characters, e.g. a chunk of the roster while it loads."""
+        self.index.extend(characters)
+        self.refresh()
+
+    def character_changed(self, character: Character):
+        """Add or update one character. Only the visible rows are redrawn."""
+        self.index.upsert(character)
+        self.refresh()
+
+    def _scroll_to(self, top: int):
+        matches = self._end - self._start
+        self._top = max(0, min(top, matches - self.rows))
+        self.listbox.delete(0, tk.END)
+        first = self._start + self._top
+        for position in range(first, min(first + self.rows, self._end)):
+            c = self.index.at(position)
+            self.listbox.insert(tk.END, f"{c.name} ({c.char_class} L{c.level})")
+        if matches:
+            self.scrollbar.set(self._top / matches, min(1.0, (self._top + self.rows) / matches))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * (self._end - self._start)))
+        elif action == "scroll":
+            step = self.rows if unit == "pages" else 1
+            self._scroll_to(self._top + int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        return self._scroll_to(self._top - (3 if event.delta > 0 else -3))
+
+    def _on_listbox_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            self._select_row(selection[0])
+
+    def _select_row(self, row: int):
+        position = self._start + self._top + row
+        if position < self._end:
+            self._on_select(self.index.at(position))
+
 
 class LootApp(tk.Tk):
     """Main application window for the loot generation GUI."""
@@ -20,12 +146,44 @@ class LootApp(tk.Tk):
         self.geometry("800x500")
         
         self.loot_service: LootService = LootService()
-        self.characters: list[Character] = load_characters()
+        # loaded on the worker, chunk by chunk, so the window comes up right away
+        self.character_repository = CharacterRepository(load=False)
+        # the GUI's own index, the repository itself is only touched on the worker thread
+        self.character_index = CharacterIndex()
+        self.history_writer = LootHistoryWriter()
+
+        # jobs are (kind, job id, args), results are (kind, job id, payload)
+        self._jobs: queue.Queue = queue.Queue()
+        self._results: queue.Queue = queue.Queue()
+        # bumped for every generate click, a running "Generate N" stops once it changes
+        self._job_id = 0
+        # set when the window closes: the roster load and generates stop, queued saves still run
+        self._stopping = threading.Event()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+        # first job, so saves queued while it runs land after the roster is in
+        self._jobs.put(("load_roster", self._job_id, None))
         
         self._create_widgets()
         self._layout_widgets()
         self._populate_classes()
-        self._populate_character_dropdown()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.after(POLL_INTERVAL_MS, self._poll_results)
+    
+    def _on_close(self):
+        """Close the window right away. The worker winds down and the buffered loot history
+        is written out on a separate (non-daemon) thread, so the process waits for that
+        before exiting but the GUI never does.
+        """
+        self._job_id += 1
+        self._stopping.set()
+        self._jobs.put(None)
+        threading.Thread(target=self._shut_down, name="loot-app-shutdown").start()
+        self.destroy()
+
+    def _shut_down(self):
+        self._worker.join()
+        self.history_writer.close()
     
     def _create_widgets(self):
         """Create all the widgets for the GUI."""
@@ -41,10 +199,15 @@ class LootApp(tk.Tk):
         self.spin_level.insert(0, "1")
         
         self.button_generate = tk.Button(self, text="Generate Loot", command=self._generate_loot_clicked)
+        self.frame_bulk = tk.Frame(self)
+        self.spin_count = tk.Spinbox(self.frame_bulk, from_=1, to=MAX_BULK_COUNT, width=6)
+        self.spin_count.delete(0, tk.END)
+        self.spin_count.insert(0, "10")
+        self.button_generate_many = tk.Button(self.frame_bulk, text="Generate N", command=self._generate_many_clicked)
         self.button_save = tk.Button(self, text="Save / Update Character", command=self._save_character_clicked)
         
         self.label_existing = tk.Label(self, text="Existing Characters:")
-        self.combo_existing = ttk.Combobox(self, state="readonly")
+        self.character_browser = CharacterBrowser(self, self.character_index, self.on_character_selected)
         
         self.text_loot = tk.Text(self, height=10, width=50, state="disabled")
         self.label_status = tk.Label(self, text="Ready.", anchor="w")
@@ -58,15 +221,18 @@ class LootApp(tk.Tk):
         self.label_level.grid(row=4, column=0, sticky="w", padx=10, pady=(10, 0))
         self.spin_level.grid(row=5, column=0, sticky="w", padx=10)
         self.button_generate.grid(row=6, column=0, sticky="we", padx=10, pady=(10, 5))
-        self.button_save.grid(row=7, column=0, sticky="we", padx=10, pady=(0, 10))
-        self.label_existing.grid(row=8, column=0, sticky="w", padx=10, pady=(10, 0))
-        self.combo_existing.grid(row=9, column=0, sticky="we", padx=10, pady=(0, 10))
+        self.frame_bulk.grid(row=7, column=0, sticky="we", padx=10, pady=(0, 5))
+        self.spin_count.pack(side="left")
+        self.button_generate_many.pack(side="left", fill="x", expand=True, padx=(5, 0))
+        self.button_save.grid(row=8, column=0, sticky="we", padx=10, pady=(0, 10))
+        self.label_existing.grid(row=9, column=0, sticky="w", padx=10, pady=(10, 0))
+        self.character_browser.grid(row=10, column=0, sticky="nsew", padx=10, pady=(0, 10))
         
-        self.text_loot.grid(row=0, column=1, rowspan=10, padx=10, pady=10, sticky="nsew")
-        self.label_status.grid(row=10, column=0, columnspan=2, sticky="we", padx=10, pady=(0, 10))
+        self.text_loot.grid(row=0, column=1, rowspan=11, padx=10, pady=10, sticky="nsew")
+        self.label_status.grid(row=11, column=0, columnspan=2, sticky="we", padx=10, pady=(0, 10))
         
         self.grid_columnconfigure(1, weight=1)
-        self.grid_rowconfigure(9, weight=1)
+        self.grid_rowconfigure(10, weight=1)
         
     def _populate_classes(self):
         """Populate the class dropdown with available character classes."""
@@ -75,101 +241,151 @@ class LootApp(tk.Tk):
         if classes:
             self.combo_class.current(0)
     
-    def _populate_character_dropdown(self):
-        """Populate the existing character dropdown with loaded characters."""
-        names = [f"{c.name} ({c.char_class} L{c.level})" for c in self.characters]
-        self.combo_existing['values'] = names
-        if names:
-            self.combo_existing.current(0)
-            self.combo_existing.bind("<<ComboboxSelected>>", self.on_character_selected)
-    
-    def on_character_selected(self, event=None):
-        """When a saved character is selected from the dropdown, populate the fields with its data."""
-        index = self.combo_existing.current()
-        if index >= 0 and index < len(self.characters):
-            character = self.characters[index]
-            self.entry_name.delete(0, tk.END)
-            self.entry_name.insert(0, character.name)
-            if character.char_class in self.combo_class['values']:
-                self.combo_class.current(self.combo_class['values'].index(character.char_class))
-            self.spin_level.delete(0, tk.END)
-            self.spin_level.insert(0, str(character.level))
-            self._set_status(f"Loaded character: {character.name}")
+    def on_character_selected(self, character: Character):
+        """When a saved character is picked in the browser, populate the fields with its data."""
+        self.entry_name.delete(0, tk.END)
+        self.entry_name.insert(0, character.name)
+        if character.char_class in self.combo_class['values']:
+            self.combo_class.current(self.combo_class['values'].index(character.char_class))
+        self.spin_level.delete(0, tk.END)
+        self.spin_level.insert(0, str(character.level))
+        self._set_status(f"Loaded character: {character.name}")
         
-    def _save_character_clicked(self):
-        """Save/update the character in characters.csv."""
+    def _read_character(self) -> Character | None:
+        """The character described by the input fields, or None (with an error status) if they are invalid."""
         name = self.entry_name.get().strip()
         if not name:
             self._set_status("Character name cannot be empty.", is_error=True)
-            return
+            return None
 
         char_class = self.combo_class.get().strip()
         if not char_class:
             self._set_status("Character class must be selected.", is_error=True)
-            return
+            return None
 
         try:
             level = int(self.spin_level.get())
         except ValueError:
             self._set_status("Level must be a number between 1 and 20.", is_error=True)
-            return
+            return None
 
         if level < 1 or level > 20:
             self._set_status("Level must be between 1 and 20.", is_error=True)
-            return
+            return None
 
-        character = Character(name=name, char_class=char_class, level=level)
+        return Character(name=name, char_class=char_class, level=level)
 
-        modify_character(self.characters, character)
-        save_characters(self.characters)
-        self._populate_character_dropdown()
-        self._set_status("Character saved/updated.", is_error=False)
+    def _save_character_clicked(self):
+        """Save/update the character in characters.csv."""
+        character = self._read_character()
+        if character is None:
+            return
+        self._jobs.put(("save", self._job_id, character))
+        self._set_status(f"Saving {character.name}...")
         
     def _generate_loot_clicked(self):
         """Generate loot for the selected character."""
-        name: str = self.entry_name.get().strip()
-        if not name:
-            self._set_status("Character name cannot be empty.", is_error=True)
+        character = self._read_character()
+        if character is None:
             return
-        char_class: str = self.combo_class.get().strip()
-        if not char_class:
-            self._set_status("Character class must be selected.", is_error=True)
+        self._job_id += 1
+        self._jobs.put(("generate", self._job_id, character))
+        self._set_status(f"Generating loot for {character.name}...")
+
+    def _generate_many_clicked(self):
+        """Generate N drops for the selected character, shown as they come in."""
+        character = self._read_character()
+        if character is None:
             return
         try:
-            level: int = int(self.spin_level.get())
+            count = int(self.spin_count.get())
         except ValueError:
-            self._set_status("Level must be a number between 1 and 20.", is_error=True)
+            self._set_status(f"N must be a number between 1 and {MAX_BULK_COUNT}.", is_error=True)
             return
-
-        if level < 1 or level > 20:
-            self._set_status("Level must be between 1 and 20.", is_error=True)
+        if count < 1 or count > MAX_BULK_COUNT:
+            self._set_status(f"N must be between 1 and {MAX_BULK_COUNT}.", is_error=True)
             return
 
-        character = Character(name=name, char_class=char_class, level=level)
-        
-        try:
-            item = self.loot_service.generate_loot_for_character(character)
-        except Exception as e:
-            self._set_status(f"Error generating loot: {e}", is_error=True)
-            return
+        self._job_id += 1
+        self._set_output("")
+        self._jobs.put(("generate_many", self._job_id, (character, count)))
+        self._set_status(f"Generating {count} drops for {character.name}...")
 
-        save_loot_history(character, item)
-        
-        modifier_list = ", ".join(item.modifiers) if item.modifiers else "None"
-        
-        output = (
-            f"Character: {character.name}\n"
-            f"Level: {character.level}\n"
-            f"Base Item: {item.base_item}\n"
-            f"Full Name: {item.full_name}\n"
-            f"Modifiers: {modifier_list}\n"
-            f"Power Score: {item.power_score}\n"
-            f"Properties:\n{item.power_text}\n"
-        )
-        
-        self._set_output(output)
-        self._set_status(f"Loot generated for {character.name} and saved to history.", is_error=False)
-        
+    def _work(self):
+        """Worker thread: runs queued jobs one at a time and posts what the GUI needs to show."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            kind, job_id, args = job
+            if self._stopping.is_set() and kind != "save":
+                continue  # nobody is left to see it, only saves still matter
+            try:
+                if kind == "load_roster":
+                    for chunk in self.character_repository.load_chunks(ROSTER_FIRST_CHUNK):
+                        if self._stopping.is_set():
+                            break
+                        # copies: the repository keeps changing its own objects on this thread
+                        self._results.put(("roster_chunk", job_id,
+                                           [Character(c.name, c.char_class, c.level) for c in chunk]))
+                    self._results.put(("roster_done", job_id, len(self.character_repository)))
+                elif kind == "save":
+                    self.character_repository.upsert(args)
+                    self._results.put(("saved", job_id, Character(args.name, args.char_class, args.level)))
+                elif kind == "generate":
+                    item = self.loot_service.generate_loot_for_character(args)
+                    self.history_writer.write(args, item)
+                    self._results.put(("loot", job_id, (args, format_item(args, item))))
+                elif kind == "generate_many":
+                    self._generate_many(job_id, *args)
+            except Exception as e:
+                self._results.put(("error", job_id, f"Error: {e}"))
+
+    def _generate_many(self, job_id: int, character: Character, count: int):
+        done = 0
+        while done < count:
+            if job_id != self._job_id:
+                return  # a newer generate click took over
+            batch = self.loot_service.generate_loot_batch([character], min(BULK_CHUNK_SIZE, count - done))
+            texts = []
+            for row in range(len(batch)):
+                item = batch.item(row)
+                self.history_writer.write(character, item)
+                done += 1
+                texts.append(f"#{done}\n" + format_item(character, item))
+            self._results.put(("loot_chunk", job_id, "\n".join(texts) + "\n"))
+        self._results.put(("loot_done", job_id, (character, count)))
+
+    def _poll_results(self):
+        """Show whatever the worker has finished since the last check."""
+        for _ in range(MAX_RESULTS_PER_POLL):
+            try:
+                kind, job_id, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "roster_chunk":
+                self.character_browser.add_characters(payload)
+                self._set_status(f"Loading characters... {len(self.character_index)}")
+            elif kind == "roster_done":
+                self._set_status(f"Loaded {payload} characters.")
+            elif kind == "saved":
+                self.character_browser.character_changed(payload)
+                self._set_status("Character saved/updated.", is_error=False)
+            elif kind == "error":
+                self._set_status(payload, is_error=True)
+            elif job_id != self._job_id:
+                continue  # output of a generate that was superseded
+            elif kind == "loot":
+                character, text = payload
+                self._set_output(text)
+                self._set_status(f"Loot generated for {character.name} and saved to history.", is_error=False)
+            elif kind == "loot_chunk":
+                self._append_output(payload)
+            elif kind == "loot_done":
+                character, count = payload
+                self._set_status(f"{count} drops generated for {character.name} and saved to history.",
+                                 is_error=False)
+        self.after(POLL_INTERVAL_MS, self._poll_results)
         
     def _set_output(self, text: str):
         """Display text in the output box."""
@@ -177,6 +393,13 @@ class LootApp(tk.Tk):
         self.text_loot.delete("1.0", tk.END)
         self.text_loot.insert(tk.END, text)
         self.text_loot.config(state="disabled")
+
+    def _append_output(self, text: str):
+        """Add text to the end of the output box, leaving what is already there."""
+        self.text_loot.config(state="normal")
+        self.text_loot.insert(tk.END, text)
+        self.text_loot.config(state="disabled")
+        self.text_loot.see(tk.END)
     
     def _set_status(self, text: str, is_error: bool = False):
         """Update status label"""
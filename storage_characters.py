@@ -3,32 +3,66 @@ storage_characters.py
 """
 
 import csv
+import mmap
+import os
+import storage_config
 from loot_model import Character
 
 CHARACTERS_FILE = "characters.csv"
+# changes made through CharacterRepository since the last full save of CHARACTERS_FILE
+CHARACTERS_LOG_FILE = "characters.log"
 
-def load_characters() -> list[Character]:
-    """Load characters from the CSV file and return a list of Character objects."""
-    characters = []
+def _read_character_rows(path: str):
+    """Yield a Character for every valid name,char_class,level row in a CSV file."""
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) != 3:
+                continue
+            name, char_class, level_str = row
+            try:
+                level = int(level_str)
+            except ValueError:
+                continue  # also skips the header row
+            yield Character(name=name, char_class=char_class, level=level)
+
+def iter_characters():
+    """Yield the roster one Character at a time without building a list of it.
+    Each character comes out once, in roster order, at its latest level. Only the
+    change log (which compaction keeps small) is read into memory; CHARACTERS_FILE
+    is streamed with logged changes swapped in, then characters only the log has follow.
+    """
+    sqlite = storage_config.sqlite_storage()
+    if sqlite is not None:
+        yield from sqlite.load_characters()
+        return
+    logged: dict[tuple[str, str], Character] = {}
     try:
-        with open(CHARACTERS_FILE, newline='') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip the header row
-            for row in reader:
-                if len(row) != 3:
-                    continue
-                name, char_class, level_str = row
-                try:
-                    level = int(level_str)
-                except ValueError:
-                    continue
-                characters.append(Character(name=name, char_class=char_class, level=level))
+        for character in _read_character_rows(CHARACTERS_LOG_FILE):
+            logged[(character.name, character.char_class)] = character
     except FileNotFoundError:
-        print(f"File {CHARACTERS_FILE} not found.")
-    return characters
+        pass
+    try:
+        for character in _read_character_rows(CHARACTERS_FILE):
+            yield logged.pop((character.name, character.char_class), character)
+    except FileNotFoundError:
+        pass
+    yield from logged.values()
+
+def load_characters() -> list[Character]:
+    """Load characters from the CSV file and return a list of Character objects.
+    Changes logged by CharacterRepository since the last full save are applied on top.
+    """
+    sqlite = storage_config.sqlite_storage()
+    if sqlite is not None:
+        return sqlite.load_characters()
+    return CharacterRepository().characters
 
 def save_characters(characters: list[Character]) -> None:
     """Save a list of Character objects to the CSV file."""
+    sqlite = storage_config.sqlite_storage()
+    if sqlite is not None:
+        sqlite.save_characters(characters)
+        return
     try:
         with open(CHARACTERS_FILE, 'w', newline='') as f:
             writer = csv.writer(f)
@@ -37,6 +71,17 @@ def save_characters(characters: list[Character]) -> None:
                 writer.writerow([c.name, c.char_class, c.level])
     except IOError as e:
         print(f"Error writing to file {CHARACTERS_FILE}: {e}")
+        return
+    # everything in the log is in the file now
+    _clear_log(CHARACTERS_LOG_FILE)
+
+def _clear_log(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Error clearing {path}: {e}")
 
 def modify_character(characters: list[Character], character: Character) -> None:
     """Modify an existing character in the list based on the character's name."""
@@ -44,4 +89,218 @@ def modify_character(characters: list[Character], character: Character) -> None:
         if existing.name == character.name and existing.char_class == character.char_class:
             existing.level = character.level
             return
-    characters.append(character)
\ No newline at end of file
+    characters.append(character)
+
+
+class CharacterRepository:
+    """Characters keyed by (name, char_class) with O(1) lookup and upsert.
+    Each upsert is appended to the change log instead of rewriting characters.csv;
+    once the log has compact_every entries it is folded back into characters.csv.
+    With the sqlite backend upserts go straight to the database and there is no log.
+    With load=False it starts empty; call load_chunks() to load it in steps.
+    """
+    def __init__(self, path: str | None = None, log_path: str | None = None, compact_every: int = 1000,
+                 load: bool = True):
+        self.path = path or CHARACTERS_FILE
+        self.log_path = log_path or CHARACTERS_LOG_FILE
+        self.compact_every = compact_every
+
+        # the list keeps roster order, the dict finds things
+        self.characters: list[Character] = []
+        self._index: dict[tuple[str, str], int] = {}
+        self._log_entries = 0
+        # False until load_chunks() has run to the end; until then compact() would lose characters
+        self.loaded = False
+
+        self._sqlite = storage_config.sqlite_storage()
+        if load:
+            for _ in self.load_chunks():
+                pass
+
+    def load_chunks(self, first_size: int = 1000, max_size: int = 100_000):
+        """Load the roster, yielding the characters added or changed every so often along the way.
+        For load=False repositories that should show characters before the whole roster is in.
+        Chunks start at first_size and double up to max_size, so the first ones arrive quickly.
+        """
+        chunk: list[Character] = []
+        size = first_size
+        for character, logged in self._stored_characters():
+            chunk.append(self._apply(character))
+            if logged:
+                self._log_entries += 1
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+                size = min(size * 2, max_size)
+        if chunk:
+            yield chunk
+        self.loaded = True
+
+    def _stored_characters(self):
+        """(character, came from the log) for everything in storage, oldest first."""
+        if self._sqlite is not None:
+            for character in self._sqlite.load_characters():
+                yield character, False
+            return
+        try:
+            for character in _read_character_rows(self.path):
+                yield character, False
+        except FileNotFoundError:
+            print(f"File {self.path} not found.")
+        try:
+            for character in _read_character_rows(self.log_path):
+                yield character, True
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self.characters)
+
+    def __iter__(self):
+        return iter(self.characters)
+
+    def get(self, name: str, char_class: str) -> Character | None:
+        """Find a character by name and class."""
+        index = self._index.get((name, char_class))
+        return None if index is None else self.characters[index]
+
+    def upsert(self, character: Character) -> None:
+        """Add a new character or update the level of an existing one, and log the change."""
+        self._apply(character)
+        if self._sqlite is not None:
+            self._sqlite.upsert_character(character)
+            return
+        try:
+            with open(self.log_path, 'a', newline='') as f:
+                csv.writer(f).writerow([character.name, character.char_class, character.level])
+        except IOError as e:
+            print(f"Error writing to file {self.log_path}: {e}")
+            return
+        self._log_entries += 1
+        if self._log_entries >= self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """Write the whole roster to the snapshot file and empty the change log.
+        Does nothing while the roster is only partly loaded, the log just keeps growing.
+        """
+        if self._sqlite is not None or not self.loaded:
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["name", "char_class", "level"])
+                for c in self.characters:
+                    writer.writerow([c.name, c.char_class, c.level])
+            # swap the new file in whole, so a crash leaves either the old or new snapshot
+            os.replace(temp_path, self.path)
+        except IOError as e:
+            print(f"Error writing to file {self.path}: {e}")
+            return
+        _clear_log(self.log_path)
+        self._log_entries = 0
+
+    def _apply(self, character: Character) -> Character:
+        """Add or update a character in memory, returning the one the roster now holds."""
+        key = (character.name, character.char_class)
+        index = self._index.get(key)
+        if index is None:
+            self._index[key] = len(self.characters)
+            self.characters.append(character)
+            return character
+        existing = self.characters[index]
+        existing.level = character.level
+        return existing
+
+
+def _row_key(line: bytes) -> tuple[str, str] | None:
+    """(name, char_class) of one raw characters.csv line, None for the header and bad lines."""
+    text = line.decode("utf-8", errors="replace").rstrip("\r")
+    if '"' in text:
+        row = next(csv.reader([text]), [])
+    else:
+        row = text.split(",")
+    if len(row) != 3 or not row[2].strip().lstrip("-").isdigit():
+        return None
+    return row[0], row[1]
+
+
+class RosterFileIndex:
+    """Finds single characters in characters.csv without loading the roster.
+    The file is memory-mapped and scanned once for where each row starts; get()
+    parses only the row it returns. Changes in the log win over the file.
+    CSV backend only.
+    """
+    def __init__(self, path: str | None = None, log_path: str | None = None):
+        self.path = path or CHARACTERS_FILE
+        self._offsets: dict[tuple[str, str], int] = {}
+        self._logged: dict[tuple[str, str], Character] = {}
+        self._file = None
+        self._map: mmap.mmap | None = None
+
+        try:
+            self._file = open(self.path, "rb")
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            pass
+        if self._map is not None:
+            self._scan()
+        try:
+            for character in _read_character_rows(log_path or CHARACTERS_LOG_FILE):
+                self._logged[(character.name, character.char_class)] = character
+        except FileNotFoundError:
+            pass
+
+    def _scan(self) -> None:
+        buf = self._map
+        end = len(buf)
+        offset = 0
+        while offset < end:
+            newline = buf.find(b"\n", offset)
+            if newline == -1:
+                newline = end
+            key = _row_key(buf[offset:newline])
+            if key is not None:
+                # a later row for the same character replaces the earlier one, like a full load
+                self._offsets[key] = offset
+            offset = newline + 1
+
+    def __enter__(self) -> "RosterFileIndex":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self) -> int:
+        return len(self._offsets.keys() | self._logged.keys())
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return key in self._logged or key in self._offsets
+
+    def keys(self):
+        """Every (name, char_class) in the roster."""
+        return self._offsets.keys() | self._logged.keys()
+
+    def get(self, name: str, char_class: str) -> Character | None:
+        """One character by name and class, parsed straight from its row."""
+        key = (name, char_class)
+        character = self._logged.get(key)
+        if character is not None:
+            return character
+        offset = self._offsets.get(key)
+        if offset is None:
+            return None
+        newline = self._map.find(b"\n", offset)
+        line = self._map[offset:newline if newline != -1 else len(self._map)]
+        row = next(csv.reader([line.decode("utf-8").rstrip("\r")]))
+        return Character(name=row[0], char_class=row[1], level=int(row[2]))
@@ -0,0 +1,19 @@
+"""
+storage_config.py
+Which storage backend storage_characters and storage_loot use.
+"""
+
+import os
+
+# "csv" for characters.csv / loot_history.csv, "sqlite" for the database in storage_sqlite.py
+STORAGE_BACKEND = os.environ.get("LOOT_STORAGE_BACKEND", "csv")
+
+
+def sqlite_storage():
+    """The storage_sqlite module if it is the selected backend, otherwise None.
+    Imported here on first use so the CSV backend never loads sqlite3.
+    """
+    if STORAGE_BACKEND != "sqlite":
+        return None
+    import storage_sqlite
+    return storage_sqlite
@@ -3,43 +3,422 @@ storage_loot.py
 Loading base items and saving loot history.
 """
 
+import atexit
 import csv
+import io
+import os
+import threading
+import time
+from contextlib import nullcontext
+import storage_config
+from file_lock import locked
+from loot_analytics import analytics_for
+from loot_metrics import LootMetrics
 from loot_model import Character, Item
 
 BASE_ITEMS_FILE = "base_items.txt"
+MODIFIERS_FILE = "modifiers.txt"
+# the bit each modifier has in a modifier mask, see assign_modifier_bits()
+MODIFIER_BITS_FILE = "modifier_bits.txt"
 LOOT_HISTORY_FILE = "loot_history.csv"
+# keep loot_history.csv.idx up to date as rows are appended (see loot_history_query.py)
+INDEX_LOOT_HISTORY = True
+# keep loot_history.csv.summary up to date as drops are saved (see loot_analytics.py)
+TRACK_LOOT_ANALYTICS = True
+# lock loot_history.csv (file_lock.py) around every append, so writers in several processes can't interleave
+LOCK_LOOT_HISTORY = True
+# append to a per-process segment instead, merged later by storage_loot_shards.merge_segments()
+SHARD_LOOT_HISTORY = False
 
-def load_base_items() -> dict[str, list[str]]:
-    """Load base items from a text file and return a dictionary by character class."""
-    base_items: dict[str, list[str]] = {}
+def load_base_items() -> dict[str, list[dict[str, any]]]:
+    """Load base items from a text file and return them by character class.
+    One class|item|weight|tier per line, weight and tier are optional (1 and "common").
+    """
+    base_items: dict[str, list[dict[str, any]]] = {}
     try:
         with open(BASE_ITEMS_FILE, "r", encoding="utf-8") as f:
-            for line in f:
+            for line_number, line in enumerate(f, start=1):
                 line = line.strip()
-                if not line or "|" not in line:
+                if not line or line.startswith("#") or "|" not in line:
+                    continue
+                parts = [part.strip() for part in line.split("|", 3)]
+                char_class, item_name = parts[0], parts[1]
+                weight = parts[2] if len(parts) > 2 and parts[2] else "1"
+                tier = parts[3] if len(parts) > 3 and parts[3] else "common"
+                try:
+                    weight = float(weight)
+                except ValueError:
+                    print(f"Skipping line {line_number} of {BASE_ITEMS_FILE}: bad weight")
+                    continue
+                if weight <= 0:
+                    print(f"Skipping line {line_number} of {BASE_ITEMS_FILE}: weight must be positive")
                     continue
-                char_class, item_name = line.split("|", 1)
-                char_class = char_class.strip()
-                item_name = item_name.strip()
-                base_items.setdefault(char_class, []).append(item_name)
+                base_items.setdefault(char_class, []).append(
+                    {"name": item_name, "weight": weight, "tier": tier})
     except FileNotFoundError:
         print(f"Error: {BASE_ITEMS_FILE} not found.")
     return base_items
 
-def save_loot_history(character: Character, item: Item) -> None:
-    """Save a loot entry to the CSV loot history file."""
+def load_modifiers() -> list[dict[str, any]]:
+    """Load item modifiers from a text file, one name|min_level|chance|position|power_text per line."""
+    return load_modifiers_checked()[0]
+
+def load_modifiers_checked() -> tuple[list[dict[str, any]], int]:
+    """load_modifiers, plus how many lines were skipped because they couldn't be read."""
+    modifiers: list[dict[str, any]] = []
+    skipped = 0
+    try:
+        with open(MODIFIERS_FILE, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                parts = [part.strip() for part in line.split("|", 4)]
+                if len(parts) != 5:
+                    print(f"Skipping line {line_number} of {MODIFIERS_FILE}: expected 5 fields")
+                    skipped += 1
+                    continue
+                name, min_level, chance, position, power_text = parts
+                try:
+                    modifiers.append({
+                        "name": name,
+                        "min_level": int(min_level),
+                        "chance": float(chance),
+                        "power_text": power_text,
+                        "position": position,
+                    })
+                except ValueError:
+                    print(f"Skipping line {line_number} of {MODIFIERS_FILE}: bad min_level or chance")
+                    skipped += 1
+    except FileNotFoundError:
+        print(f"Error: {MODIFIERS_FILE} not found.")
+    return modifiers, skipped
+
+# the registry as this process last read it, and names that weren't in it
+_modifier_bits: dict[str, int] | None = None
+_unregistered: set[str] = set()
+
+def load_modifier_bits() -> dict[str, int]:
+    """Read the modifier bit registry, name -> bit index. One name|bit per line."""
+    bits: dict[str, int] = {}
+    try:
+        with open(MODIFIER_BITS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "|" not in line:
+                    continue
+                name, bit = line.rsplit("|", 1)
+                try:
+                    bits[name.strip()] = int(bit)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return bits
+
+def _add_modifier_bits(bits: dict[str, int], names: list[str]) -> list[str]:
+    """Give the names not in bits the next unused bits, returning their registry lines."""
+    next_bit = max(bits.values(), default=-1) + 1
+    lines = []
+    for name in names:
+        if name not in bits:
+            bits[name] = next_bit
+            lines.append(f"{name}|{next_bit}\n")
+            next_bit += 1
+    return lines
+
+def assign_modifier_bits(names: list[str]) -> dict[str, int]:
+    """Bit indexes for every registered modifier, registering any of names that are new.
+    New names get the next unused bit, appended to MODIFIER_BITS_FILE. A bit is never
+    reused, even after its modifier is removed, so a mask means the same thing in every
+    table version. The registry is only locked when there are new names; if it can't be
+    (a read-only directory), they get bits for this process only.
+    """
+    global _modifier_bits
+    # names that are all registered already only need a read, no lock
+    bits = load_modifier_bits()
+    new = [name for name in dict.fromkeys(names) if name not in bits]
+    if new:
+        try:
+            with locked(MODIFIER_BITS_FILE):
+                # another process may have registered some of them since
+                bits = load_modifier_bits()
+                lines = _add_modifier_bits(bits, new)
+                if lines:
+                    try:
+                        with open(MODIFIER_BITS_FILE, "a", encoding="utf-8") as f:
+                            f.write("".join(lines))
+                    except OSError as e:
+                        print(f"Error saving {MODIFIER_BITS_FILE}: {e}")
+        except OSError as e:
+            # can't take the lock, e.g. a read-only directory: the new bits only last this process
+            print(f"Could not register new modifiers in {MODIFIER_BITS_FILE}: {e}")
+            _add_modifier_bits(bits, new)
+    _modifier_bits = bits
+    _unregistered.clear()
+    return bits
+
+def modifier_mask(names: list[str]) -> int:
+    """The bitmask of some modifier names, from the registry. Unregistered names are left out."""
+    global _modifier_bits
+    bits = _modifier_bits
+    if bits is None or any(name not in bits and name not in _unregistered for name in names):
+        # first use, or the registry may have grown since it was read
+        bits = _modifier_bits = load_modifier_bits()
+        _unregistered.update(name for name in names if name not in bits)
+    mask = 0
+    for name in names:
+        bit = bits.get(name)
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+def _history_row(character: Character, item: Item) -> list:
+    """The columns written to the loot history file for one drop."""
+    return [
+        character.name,
+        character.char_class,
+        character.level,
+        item.base_item,
+        item.full_name,
+        ", ".join(item.modifiers) if item.modifiers else "None",
+        item.power_text if item.power_text else "No special properties.",
+        item.power_score
+    ]
+
+def _render_history_row(character: Character, item: Item) -> bytes:
+    """One history row exactly as it is written to the file."""
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter="|").writerow(_history_row(character, item))
+    return buffer.getvalue().encode("utf-8")
+
+def parse_history_row(row: list[str]) -> tuple[Character, Item] | None:
+    """Turn the columns of one history row back into a Character and Item.
+    Returns None for rows that don't parse.
+    """
+    if len(row) != 8:
+        return None
+    name, char_class, level, base_item, full_name, modifiers, power_text, power_score = row
     try:
-        with open(LOOT_HISTORY_FILE, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f, delimiter="|")
-            writer.writerow([
-                character.name,
-                character.char_class,
-                character.level,
-                item.base_item,
-                item.full_name,
-                ", ".join(item.modifiers) if item.modifiers else "None",
-                item.power_text if item.power_text else "No special properties.",
-                item.power_score
-            ])
+        character = Character(name=name, char_class=char_class, level=int(level))
+        score = int(power_score)
+    except ValueError:
+        return None
+    modifier_names = [] if modifiers == "None" else modifiers.split(", ")
+    item = Item(
+        base_item=base_item,
+        full_name=full_name,
+        modifiers=modifier_names,
+        power_text=power_text,
+        power_score=score,
+        modifier_mask=modifier_mask(modifier_names),
+    )
+    return character, item
+
+def history_index_path(path: str) -> str:
+    """The index file kept next to a loot history file."""
+    return path + ".idx"
+
+def history_summary_path(path: str) -> str:
+    """The analytics summary file kept next to a loot history file."""
+    return path + ".summary"
+
+def rebuild_history_summary(path: str | None = None) -> None:
+    """Recount the summary from scratch by reading the whole history file.
+    For a history that was written before the summary existed. Truncations aren't
+    stored in the history, so the drops counted here don't go into the truncation rate.
+    """
+    path = path or LOOT_HISTORY_FILE
+
+    def drops():
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                for row in csv.reader(f, delimiter="|"):
+                    parsed = parse_history_row(row)
+                    if parsed is not None:
+                        yield parsed
+        except FileNotFoundError:
+            return
+
+    analytics_for(history_summary_path(path)).rebuild(drops())
+
+def _write_index_entries(f, entries: list[tuple[int, int, Character, Item]]) -> None:
+    """Append (offset, length, character, item) entries to an open index file."""
+    writer = csv.writer(f, delimiter="|")
+    for offset, length, character, item in entries:
+        writer.writerow([
+            offset,
+            length,
+            character.name,
+            character.char_class,
+            character.level,
+            item.power_score,
+            ", ".join(item.modifiers),
+            # an Item built by hand may not have its mask filled in
+            f"{item.modifier_mask or modifier_mask(item.modifiers):x}",
+        ])
+
+def save_loot_history(character: Character, item: Item, metrics: LootMetrics | None = None) -> None:
+    """Save a loot entry to the CSV loot history file.
+    With metrics, the time taken is recorded as the "history_write" stage.
+    """
+    started = time.perf_counter()
+    sqlite = storage_config.sqlite_storage()
+    if sqlite is not None:
+        sqlite.save_loot_history(character, item)
+    else:
+        _save_loot_history_csv(character, item)
+    if TRACK_LOOT_ANALYTICS:
+        analytics = analytics_for(history_summary_path(LOOT_HISTORY_FILE))
+        analytics.record(character, item)
+        analytics.save_if_due()
+    if metrics is not None:
+        metrics.observe("history_write", time.perf_counter() - started)
+
+def _history_lock(path: str):
+    """The cross-process lock around appends to a single history file, if LOCK_LOOT_HISTORY is on."""
+    return locked(path) if LOCK_LOOT_HISTORY else nullcontext()
+
+def _history_segment(path: str):
+    # only imported in sharded mode, it imports this module
+    import storage_loot_shards
+    return storage_loot_shards.segment_for(path)
+
+def _save_loot_history_csv(character: Character, item: Item) -> None:
+    try:
+        data = _render_history_row(character, item)
+        if SHARD_LOOT_HISTORY:
+            _history_segment(LOOT_HISTORY_FILE).append([data])
+            return
+        with _history_lock(LOOT_HISTORY_FILE):
+            with open(LOOT_HISTORY_FILE, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            if INDEX_LOOT_HISTORY:
+                with open(history_index_path(LOOT_HISTORY_FILE), "a", newline="", encoding="utf-8") as f:
+                    _write_index_entries(f, [(offset, len(data), character, item)])
     except Exception as e:
         print(f"Error saving loot history: {e}")
+
+
+class LootHistoryWriter:
+    """Keeps the loot history file open and writes rows in batches.
+    Buffered rows are written out when there are max_rows of them, when they reach
+    max_bytes, or max_delay seconds after the first one was buffered,
+    whichever comes first. close() (also run at exit) writes anything left over.
+    Safe to share between threads.
+    With the sqlite backend each flush is one bulk insert instead of a file write.
+    With metrics, each flush is timed as the "history_flush" stage.
+    """
+    def __init__(self, path: str | None = None, max_rows: int = 100,
+                 max_bytes: int = 64 * 1024, max_delay: float = 1.0,
+                 metrics: LootMetrics | None = None):
+        self.path = path or LOOT_HISTORY_FILE
+        self.metrics = metrics
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+        self._file = None
+        self._index_file = None
+        self._pending: list[tuple[bytes, Character, Item]] = []
+        self._pending_bytes = 0
+        self._timer: threading.Timer | None = None
+        self._lock = threading.RLock()
+        self._closed = False
+        self._sqlite = storage_config.sqlite_storage()
+        self._analytics = analytics_for(history_summary_path(self.path)) if TRACK_LOOT_ANALYTICS else None
+        atexit.register(self.close)
+
+    def __enter__(self) -> "LootHistoryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def write(self, character: Character, item: Item) -> None:
+        """Buffer one loot entry."""
+        data = b"" if self._sqlite is not None else _render_history_row(character, item)
+        with self._lock:
+            if self._closed:
+                raise ValueError("LootHistoryWriter is closed")
+            self._pending.append((data, character, item))
+            self._pending_bytes += len(data)
+            if len(self._pending) >= self.max_rows or self._pending_bytes >= self.max_bytes:
+                self._flush_locked()
+            elif self._timer is None and self.max_delay > 0:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """Write all buffered rows to the file."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        """Flush, sync to disk and close the file. Calling it again does nothing."""
+        with self._lock:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._closed = True
+            for f in (self._file, self._index_file):
+                if f is None:
+                    continue
+                try:
+                    os.fsync(f.fileno())
+                    f.close()
+                except OSError as e:
+                    print(f"Error closing loot history: {e}")
+            self._file = None
+            self._index_file = None
+            if self._analytics is not None:
+                self._analytics.save()
+        atexit.unregister(self.close)
+
+    def _flush_locked(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+        self._pending_bytes = 0
+        started = time.perf_counter()
+        if self._sqlite is not None:
+            self._sqlite.save_loot_history_batch([(character, item) for _, character, item in pending])
+        else:
+            self._write_pending(pending)
+        if self._analytics is not None:
+            for _, character, item in pending:
+                self._analytics.record(character, item)
+            self._analytics.save_if_due()
+        if self.metrics is not None:
+            self.metrics.observe("history_flush", time.perf_counter() - started)
+
+    def _write_pending(self, pending: list[tuple[bytes, Character, Item]]) -> None:
+        try:
+            if SHARD_LOOT_HISTORY:
+                _history_segment(self.path).append([data for data, _, _ in pending])
+                return
+            with _history_lock(self.path):
+                if self._file is None:
+                    self._file = open(self.path, "ab")
+                # other processes may have appended since our last write
+                offset = self._file.seek(0, os.SEEK_END)
+                self._file.write(b"".join(data for data, _, _ in pending))
+                self._file.flush()
+
+                if INDEX_LOOT_HISTORY:
+                    entries = []
+                    for data, character, item in pending:
+                        entries.append((offset, len(data), character, item))
+                        offset += len(data)
+                    if self._index_file is None:
+                        self._index_file = open(history_index_path(self.path), "a", newline="", encoding="utf-8")
+                    _write_index_entries(self._index_file, entries)
+                    self._index_file.flush()
+        except Exception as e:
+            print(f"Error saving loot history: {e}")
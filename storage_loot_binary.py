@@ -0,0 +1,457 @@
+"""
+storage_loot_binary.py
+Compact binary loot history: fixed-width records plus string dictionaries.
+
+Layout of loot_history.bin:
+    header   magic, version, record size, header size
+    records  one fixed-width record per drop, readable straight out of an mmap
+
+Character names, classes and base items are not fixed like the modifiers, so they
+go in an append-only side file (loot_history.bin.strings) and records point at them.
+
+Modifiers go in another append-only side file (loot_history.bin.modifiers), one
+entry per (bit, position, name, power text) the writer has seen. The bit is the
+modifier's stable bit from loot_tables, so an entry means the same modifier in every
+table version. A modifier added or edited after the file was created just gets a
+new entry, and old records keep pointing at the text they were rolled with.
+
+Any number of writers can append to one file, see BinaryHistoryWriter.
+
+Version 1 files kept the modifier table in the header and can still be read.
+"""
+
+import atexit
+import csv
+import mmap
+import os
+import struct
+import threading
+from dataclasses import dataclass
+
+import loot_tables
+from file_lock import locked
+from loot_model import Character, Item
+from loot_tables import ModifierTable, PREFIX, SUFFIX
+from storage_loot import modifier_mask, parse_history_row
+
+BINARY_HISTORY_FILE = "loot_history.bin"
+
+MAGIC = b"LOOTHIST"
+VERSION = 2
+MAX_SLOTS = 5
+EMPTY_SLOT = 0xFFFF
+
+# header: magic, version, record size, header size, modifier count (always 0 since version 2)
+_HEADER = struct.Struct("<8sHHIH")
+# record: name id, class id, level, base item id, 5 modifier entry ids, power score
+_RECORD = struct.Struct("<IIBI5HH")
+# modifier entry: bit, position, then name and power text as strings
+_MODIFIER_ENTRY = struct.Struct("<IB")
+_LENGTH = struct.Struct("<H")
+
+# version 1: modifier table in the header, records point into it with one byte per slot
+_RECORD_V1 = struct.Struct("<IIBI5BH")
+_EMPTY_SLOT_V1 = 0xFF
+
+
+@dataclass
+class HistoryRecord:
+    """One decoded drop from the binary history, still as ids."""
+    name_id: int
+    class_id: int
+    level: int
+    base_item_id: int
+    modifier_ids: tuple[int, ...]  # entries in the modifier dictionary
+    power_score: int
+
+
+@dataclass
+class ModifierEntry:
+    """One modifier as it was when drops with it were written."""
+    bit: int | None  # None in version 1 files
+    position: int
+    name: str
+    power_text: str
+
+
+def _strings_path(path: str) -> str:
+    return path + ".strings"
+
+
+def _modifiers_path(path: str) -> str:
+    return path + ".modifiers"
+
+
+def _pack_string(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+def _unpack_string(buf: bytes, offset: int) -> tuple[str, int]:
+    (length,) = _LENGTH.unpack_from(buf, offset)
+    offset += _LENGTH.size
+    if offset + length > len(buf):
+        raise struct.error("string runs past the end of the buffer")
+    return bytes(buf[offset:offset + length]).decode("utf-8"), offset + length
+
+
+def _build_header() -> bytes:
+    return _HEADER.pack(MAGIC, VERSION, _RECORD.size, _HEADER.size, 0)
+
+
+def _read_header(buf: bytes) -> tuple[int, int, list[ModifierEntry]]:
+    """Return (version, header size, modifier entries kept in the header)."""
+    magic, version, record_size, size, count = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("not a binary loot history file")
+    expected = {1: _RECORD_V1.size, VERSION: _RECORD.size}
+    if expected.get(version) != record_size:
+        raise ValueError(f"unsupported binary loot history version {version}")
+    modifiers = []
+    offset = _HEADER.size
+    for _ in range(count):
+        position = buf[offset]
+        name, offset = _unpack_string(buf, offset + 1)
+        power_text, offset = _unpack_string(buf, offset)
+        modifiers.append(ModifierEntry(None, position, name, power_text))
+    return version, size, modifiers
+
+
+def _parse_strings(data: bytes) -> tuple[list[str], int]:
+    """The whole strings in data, and how many bytes they take. A torn one at the end is left out."""
+    strings = []
+    offset = 0
+    while offset + _LENGTH.size <= len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        if offset + _LENGTH.size + length > len(data):
+            break  # torn write at the end
+        text, offset = _unpack_string(data, offset)
+        strings.append(text)
+    return strings, offset
+
+
+def _pack_modifier(entry: ModifierEntry) -> bytes:
+    return _MODIFIER_ENTRY.pack(entry.bit, entry.position) + _pack_string(entry.name) + _pack_string(entry.power_text)
+
+
+def _parse_modifiers(data: bytes) -> tuple[list[ModifierEntry], int]:
+    """The whole modifier entries in data, and how many bytes they take."""
+    entries = []
+    offset = 0
+    while offset + _MODIFIER_ENTRY.size <= len(data):
+        try:
+            bit, position = _MODIFIER_ENTRY.unpack_from(data, offset)
+            name, end = _unpack_string(data, offset + _MODIFIER_ENTRY.size)
+            power_text, end = _unpack_string(data, end)
+        except struct.error:
+            break  # torn write at the end
+        entries.append(ModifierEntry(bit, position, name, power_text))
+        offset = end
+    return entries, offset
+
+
+def _read_from(path: str, offset: int) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.read()
+    except FileNotFoundError:
+        return b""
+
+
+def _load_strings(path: str) -> list[str]:
+    return _parse_strings(_read_from(_strings_path(path), 0))[0]
+
+
+def _load_modifiers(path: str) -> list[ModifierEntry]:
+    return _parse_modifiers(_read_from(_modifiers_path(path), 0))[0]
+
+
+class BinaryHistoryWriter:
+    """Appends drops to the binary history.
+    Modifiers are looked up in table to find their bit, position and power text.
+    Leave table out to follow the process-wide tables (loot_tables.default_loot_tables),
+    which LootService.reload_tables() keeps current; or set writer.table after a reload.
+    Records are buffered and written every max_rows drops, on flush() and on close().
+
+    Several writers, in this process or others, can append to the same file. A flush
+    holds file_lock.locked(path) while it reads the strings and modifier entries the
+    others added since its last flush, and only then numbers its own. Whatever a crashed
+    writer left half written at the end of a file is cut off before anything goes after it.
+    """
+    def __init__(self, table: ModifierTable | None = None, path: str | None = None, max_rows: int = 1000):
+        self.path = path or BINARY_HISTORY_FILE
+        self.table = table
+        self.max_rows = max_rows
+        self._lock = threading.RLock()
+        self._closed = False
+
+        # the side files as far as this writer has read them
+        self._string_ids: dict[str, int] = {}
+        self._strings_end = 0
+        self._entry_ids: dict[tuple, int] = {}
+        self._modifiers_end = 0
+        # name -> (bit, position, name, power text) for the table last written with
+        self._entry_table: ModifierTable | None = None
+        self._key_by_name: dict[str, tuple] = {}
+        # (name, class, level, base item, modifier keys, power score), numbered at flush
+        self._pending: list[tuple] = []
+
+        with locked(self.path):
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                with open(self.path, "wb") as f:
+                    f.write(_build_header())
+            with open(self.path, "rb") as f:
+                magic, version, _, header_size, _ = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not a binary loot history file")
+            if version != VERSION:
+                raise ValueError(f"{self.path} is a version {version} binary history, write to a new file")
+            self._header_size = header_size
+            self._catch_up()
+
+        self._file = open(self.path, "ab")
+        self._strings_file = open(_strings_path(self.path), "ab")
+        self._modifiers_file = open(_modifiers_path(self.path), "ab")
+        atexit.register(self.close)
+
+    def __enter__(self) -> "BinaryHistoryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def write(self, character: Character, item: Item) -> None:
+        """Buffer one loot entry."""
+        if len(item.modifiers) > MAX_SLOTS:
+            raise ValueError(f"binary history holds at most {MAX_SLOTS} modifiers per item")
+        if not 0 <= character.level <= 0xFF or not 0 <= item.power_score <= 0xFFFF:
+            raise ValueError("binary history holds levels up to 255 and power scores up to 65535")
+
+        with self._lock:
+            if self._closed:
+                raise ValueError("BinaryHistoryWriter is closed")
+            key_by_name = self._keys_for(self.table or loot_tables.default_loot_tables().modifiers)
+            try:
+                keys = tuple(key_by_name[name] for name in item.modifiers)
+            except KeyError as e:
+                raise ValueError(f"modifier {e} is not in the loot tables") from None
+            self._pending.append((character.name, character.char_class, character.level, item.base_item,
+                                  keys, item.power_score))
+            if len(self._pending) >= self.max_rows:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Write all buffered records to the file."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        """Flush, sync to disk and close all three files."""
+        with self._lock:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._closed = True
+            for f in (self._strings_file, self._modifiers_file, self._file):
+                try:
+                    os.fsync(f.fileno())
+                    f.close()
+                except OSError as e:
+                    print(f"Error closing binary loot history: {e}")
+        atexit.unregister(self.close)
+
+    def _keys_for(self, table: ModifierTable) -> dict[str, tuple]:
+        """Modifier name -> dictionary entry key for a table."""
+        if table is not self._entry_table:
+            self._key_by_name = {name: (table.bits[i], table.positions[i], name, table.power_texts[i])
+                                 for i, name in enumerate(table.names)}
+            self._entry_table = table
+        return self._key_by_name
+
+    def _catch_up(self) -> None:
+        """Read what other writers appended to the side files, and cut torn tails off all
+        three files. Only with the file lock held."""
+        data = _read_from(_strings_path(self.path), self._strings_end)
+        strings, used = _parse_strings(data)
+        for text in strings:
+            self._string_ids.setdefault(text, len(self._string_ids))
+        self._strings_end = _trim(_strings_path(self.path), self._strings_end, used, len(data))
+
+        data = _read_from(_modifiers_path(self.path), self._modifiers_end)
+        entries, used = _parse_modifiers(data)
+        for e in entries:
+            self._entry_ids.setdefault((e.bit, e.position, e.name, e.power_text), len(self._entry_ids))
+        self._modifiers_end = _trim(_modifiers_path(self.path), self._modifiers_end, used, len(data))
+
+        size = os.path.getsize(self.path)
+        records = (size - self._header_size) // _RECORD.size
+        _trim(self.path, self._header_size, records * _RECORD.size, size - self._header_size)
+
+    def _string_id(self, text: str, new: bytearray) -> int:
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = len(self._string_ids)
+            self._string_ids[text] = string_id
+            new += _pack_string(text)
+        return string_id
+
+    def _entry_id(self, key: tuple, new: bytearray) -> int:
+        entry_id = self._entry_ids.get(key)
+        if entry_id is None:
+            entry_id = len(self._entry_ids)
+            if entry_id >= EMPTY_SLOT:
+                raise ValueError("binary history modifier dictionary is full")
+            self._entry_ids[key] = entry_id
+            new += _pack_modifier(ModifierEntry(*key))
+        return entry_id
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        try:
+            with locked(self.path):
+                self._catch_up()
+                new_strings = bytearray()
+                new_entries = bytearray()
+                records = bytearray()
+                string_id = self._string_id
+                entry_id = self._entry_id
+                for name, char_class, level, base_item, keys, power_score in self._pending:
+                    slots = [entry_id(key, new_entries) for key in keys]
+                    slots += [EMPTY_SLOT] * (MAX_SLOTS - len(slots))
+                    records += _RECORD.pack(
+                        string_id(name, new_strings),
+                        string_id(char_class, new_strings),
+                        level,
+                        string_id(base_item, new_strings),
+                        *slots,
+                        power_score,
+                    )
+                # dictionaries first, so a record never points at an entry that isn't on disk
+                if new_strings:
+                    self._strings_file.write(new_strings)
+                    self._strings_file.flush()
+                    self._strings_end += len(new_strings)
+                if new_entries:
+                    self._modifiers_file.write(new_entries)
+                    self._modifiers_file.flush()
+                    self._modifiers_end += len(new_entries)
+                self._file.write(records)
+                self._file.flush()
+            self._pending = []
+        except Exception as e:
+            print(f"Error saving binary loot history: {e}")
+            # ids handed out above may not have reached the disk, so read the side files
+            # again from the start next time; the records are still pending
+            self._string_ids, self._strings_end = {}, 0
+            self._entry_ids, self._modifiers_end = {}, 0
+
+
+def _trim(path: str, offset: int, used: int, read: int) -> int:
+    """Cut path off after offset + used if more than that was read, returning the new end."""
+    if used < read:
+        with open(path, "r+b") as f:
+            f.truncate(offset + used)
+    return offset + used
+
+
+class BinaryHistoryReader:
+    """Reads the binary history through mmap without parsing any text."""
+    def __init__(self, path: str | None = None):
+        self.path = path or BINARY_HISTORY_FILE
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.version, self._header_size, modifiers = _read_header(self._mmap)
+        if self.version == 1:
+            self._record = _RECORD_V1
+            self._empty_slot = _EMPTY_SLOT_V1
+        else:
+            self._record = _RECORD
+            self._empty_slot = EMPTY_SLOT
+            modifiers = _load_modifiers(self.path)
+        self.modifiers: list[ModifierEntry] = modifiers
+        self.strings = _load_strings(self.path)
+
+    def __enter__(self) -> "BinaryHistoryReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __len__(self) -> int:
+        # a partly written record at the end is not counted
+        return (len(self._mmap) - self._header_size) // self._record.size
+
+    def records(self):
+        """Yield every drop as a HistoryRecord."""
+        end = self._header_size + len(self) * self._record.size
+        view = memoryview(self._mmap)[self._header_size:end]
+        empty = self._empty_slot
+        try:
+            for name_id, class_id, level, base_id, *slots, power_score in self._record.iter_unpack(view):
+                yield HistoryRecord(
+                    name_id=name_id,
+                    class_id=class_id,
+                    level=level,
+                    base_item_id=base_id,
+                    modifier_ids=tuple(i for i in slots if i != empty),
+                    power_score=power_score,
+                )
+        finally:
+            view.release()
+
+    def rows(self):
+        """Yield every drop as a (Character, Item) pair, like the CSV history holds."""
+        for record in self.records():
+            yield self.character(record), self.item(record)
+
+    def character(self, record: HistoryRecord) -> Character:
+        return Character(
+            name=self.strings[record.name_id],
+            char_class=self.strings[record.class_id],
+            level=record.level,
+        )
+
+    def item(self, record: HistoryRecord) -> Item:
+        """Rebuild the full Item from the ids in a record."""
+        base_item = self.strings[record.base_item_id]
+        entries = [self.modifiers[i] for i in record.modifier_ids]
+        parts = [e.name for e in entries if e.position == PREFIX]
+        parts.append(base_item)
+        parts.extend(e.name for e in entries if e.position == SUFFIX)
+        power_text = "\n".join(e.power_text for e in entries) or "No special properties."
+        if self.version == 1:
+            # v1 dictionaries carry no bits, so look the names up in the registry
+            mask = modifier_mask([e.name for e in entries])
+        else:
+            mask = 0
+            for e in entries:
+                mask |= 1 << e.bit
+        return Item(
+            base_item=base_item,
+            full_name=" ".join(parts),
+            modifiers=[e.name for e in entries],
+            power_text=power_text,
+            power_score=record.power_score,
+            modifier_mask=mask,
+        )
+
+
+def convert_csv_history(table: ModifierTable | None, csv_path: str, binary_path: str | None = None) -> int:
+    """Copy an existing pipe-delimited loot history into the binary format.
+    Returns the number of rows converted.
+    """
+    count = 0
+    with open(csv_path, newline="", encoding="utf-8") as f, \
+            BinaryHistoryWriter(table, binary_path) as writer:
+        for row in csv.reader(f, delimiter="|"):
+            parsed = parse_history_row(row)
+            if parsed is None:
+                continue
+            writer.write(*parsed)
+            count += 1
+    return count
@@ -0,0 +1,186 @@
+"""
+storage_loot_seeds.py
+Seed-only loot history: every drop is logged as the few values that produced it,
+and the full Item is rebuilt from them when it is needed.
+
+Layout of loot_history_seeds.csv, every row tagged with its record type:
+    stream,<stream seed>,<table version>
+    drop,<name>,<class>,<level>,<counter>
+    ...
+
+Each drop's RNG seed is drop_seed(stream seed, counter), and its item is
+LootService.generate_seeded_loot() with that seed against the table version of the
+stream line above it. That rolls through loot_rng.CounterRandom, so a drop comes out
+the same on any Python version. Every flush starts with its own stream line, so writers in
+several processes can append to the same file. The table versions used are kept
+with loot_tables.retain_loot_tables(), so old drops replay exactly after a balance change.
+"""
+
+import atexit
+import csv
+import hashlib
+import io
+import os
+import random
+import threading
+from dataclasses import dataclass
+
+import loot_tables
+from loot_model import Character, Item
+from loot_tables import LootTables
+
+SEED_HISTORY_FILE = "loot_history_seeds.csv"
+
+# first column of every row
+STREAM_RECORD = "stream"
+DROP_RECORD = "drop"
+
+
+def drop_seed(stream_seed: int, counter: int) -> int:
+    """RNG seed of the counter-th drop of a stream."""
+    digest = hashlib.sha256(f"{stream_seed}:{counter}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+@dataclass
+class SeedRecord:
+    """One logged drop: who got it, and what it takes to roll it again."""
+    name: str
+    char_class: str
+    level: int
+    stream_seed: int
+    counter: int
+    table_version: str
+
+    @property
+    def seed(self) -> int:
+        return drop_seed(self.stream_seed, self.counter)
+
+    def character(self) -> Character:
+        return Character(name=self.name, char_class=self.char_class, level=self.level)
+
+
+class SeedHistoryWriter:
+    """Generates drops through a LootService and logs each one as a seed record.
+    Records are buffered and written every max_rows drops, on flush() and on close().
+    stream_seed defaults to a fresh random one; counters start at 0.
+    """
+    def __init__(self, service, path: str | None = None, stream_seed: int | None = None,
+                 max_rows: int = 1000):
+        self._service = service  # a loot_service.LootService
+        self.path = path or SEED_HISTORY_FILE
+        self.stream_seed = stream_seed if stream_seed is not None else random.SystemRandom().getrandbits(64)
+        self.max_rows = max_rows
+        self._counter = 0
+        self._pending: list[tuple[str, list]] = []  # (table version, row)
+        self._retained: set[str] = set()
+        self._lock = threading.RLock()
+        self._closed = False
+        self._file = open(self.path, "a", encoding="utf-8", newline="")
+        atexit.register(self.close)
+
+    def __enter__(self) -> "SeedHistoryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def generate(self, character: Character) -> Item:
+        """Roll the next drop of this stream for a character and log it."""
+        # read the tables once, so the logged version is the one the item was rolled from
+        tables = self._service.current_tables
+        with self._lock:
+            if self._closed:
+                raise ValueError("SeedHistoryWriter is closed")
+            counter = self._counter
+            self._counter += 1
+            if tables.version not in self._retained:
+                loot_tables.retain_loot_tables(tables)
+                self._retained.add(tables.version)
+            self._pending.append((tables.version, [DROP_RECORD, character.name, character.char_class,
+                                                   character.level, counter]))
+            if len(self._pending) >= self.max_rows:
+                self._flush_locked()
+        return self._service.generate_seeded_loot(character, drop_seed(self.stream_seed, counter), tables)
+
+    def flush(self) -> None:
+        """Write all buffered records to the file."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        """Flush, sync to disk and close the file."""
+        with self._lock:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._closed = True
+            try:
+                os.fsync(self._file.fileno())
+                self._file.close()
+            except OSError as e:
+                print(f"Error closing seed loot history: {e}")
+        atexit.unregister(self.close)
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        version = None
+        for row_version, row in self._pending:
+            if row_version != version:
+                version = row_version
+                writer.writerow([STREAM_RECORD, self.stream_seed, version])
+            writer.writerow(row)
+        try:
+            # one write per flush, so appends from other processes never split a stream's rows
+            self._file.write(buffer.getvalue())
+            self._file.flush()
+            self._pending = []
+        except Exception as e:
+            print(f"Error saving seed loot history: {e}")
+
+
+def read_seed_history(path: str | None = None):
+    """Yield a SeedRecord for every drop in the file, oldest first."""
+    path = path or SEED_HISTORY_FILE
+    stream_seed = None
+    version = None
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                try:
+                    if row[0] == STREAM_RECORD:
+                        _, seed, table_version = row
+                        stream_seed, version = int(seed), table_version
+                    elif row[0] == DROP_RECORD and stream_seed is not None:
+                        _, name, char_class, level, counter = row
+                        yield SeedRecord(name, char_class, int(level), stream_seed, int(counter), version)
+                except ValueError:
+                    continue  # a torn line from a crash, skip it
+    except FileNotFoundError:
+        return
+
+
+class SeedHistoryReplayer:
+    """Rebuilds full Items from seed records, loading each retained table version once."""
+    def __init__(self, service):
+        self._service = service  # a loot_service.LootService
+        self._tables: dict[str, LootTables | None] = {}
+
+    def item(self, record: SeedRecord) -> Item:
+        """The exact item the record's drop produced."""
+        if record.table_version not in self._tables:
+            self._tables[record.table_version] = loot_tables.load_retained_loot_tables(record.table_version)
+        tables = self._tables[record.table_version]
+        if tables is None:
+            raise LookupError(f"loot table version {record.table_version} was not retained")
+        return self._service.generate_seeded_loot(record.character(), record.seed, tables)
+
+    def replay(self, path: str | None = None):
+        """Yield (Character, Item) for every drop in a seed history file."""
+        for record in read_seed_history(path):
+            yield record.character(), self.item(record)
@@ -0,0 +1,269 @@
+"""
+storage_loot_shards.py
+Sharded loot history: every process appends to its own segment file, and
+merge_segments() folds finished segments into the single history file.
+
+    python storage_loot_shards.py [--history loot_history.csv] [--include-open]
+
+Turn it on with storage_loot.SHARD_LOOT_HISTORY. Segments live in
+loot_history.csv.segments/, one per process, named host-pid-start. A row there is
+    <sequence number>|<time in ns>|<the history row>
+and the merge orders rows from all segments by time, then segment, then sequence
+number. A segment being written ends in .open; it is closed (renamed to .seg) when
+it gets big or old (a timer closes an idle one too), and at exit. Only closed segments
+are merged, unless include_open.
+
+A merge is journaled: if it dies halfway, the next merge rolls the history back to
+where it started and does it again, so no row is lost or merged twice.
+"""
+
+import argparse
+import atexit
+import csv
+import heapq
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import storage_loot
+from file_lock import locked
+from storage_loot import _render_history_row, _write_index_entries, history_index_path, parse_history_row
+
+OPEN_SUFFIX = ".open"
+SEGMENT_SUFFIX = ".seg"
+# a segment is closed and a new one started after this many bytes or seconds
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+SEGMENT_MAX_AGE = 60.0
+
+
+def segments_dir(history_path: str) -> str:
+    """The directory holding a history's segments."""
+    return history_path + ".segments"
+
+
+def _journal_path(history_path: str) -> str:
+    return os.path.join(segments_dir(history_path), "merge.journal")
+
+
+class HistorySegment:
+    """This process's segment of a sharded history. Safe to share between threads."""
+    def __init__(self, history_path: str, max_bytes: int = SEGMENT_MAX_BYTES, max_age: float = SEGMENT_MAX_AGE):
+        self.history_path = history_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._last_time = 0
+        self._file = None
+        self._timer: threading.Timer | None = None
+        self._at_exit = False
+        self.path: str | None = None
+
+    def append(self, rows: list[bytes]) -> None:
+        """Append rendered history rows, each one tagged with the next sequence number."""
+        with self._lock:
+            if self._file is None:
+                self._open()
+            parts = []
+            for data in rows:
+                # never go backwards, even if the wall clock does
+                self._last_time = max(time.time_ns(), self._last_time)
+                parts.append(f"{self._seq}|{self._last_time}|".encode("ascii") + data)
+                self._seq += 1
+            self._file.write(b"".join(parts))
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes or time.monotonic() - self._opened >= self.max_age:
+                self._close_file()
+
+    def close(self) -> None:
+        """Close the current segment so it can be merged. A later append() starts a new one."""
+        with self._lock:
+            if self._file is not None:
+                self._close_file()
+            if self._at_exit:
+                atexit.unregister(self.close)
+                self._at_exit = False
+
+    def _open(self) -> None:
+        directory = segments_dir(self.history_path)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{socket.gethostname()}-{os.getpid()}-{time.time_ns()}"
+        self.path = os.path.join(directory, name + OPEN_SUFFIX)
+        self._file = open(self.path, "ab")
+        self._opened = time.monotonic()
+        if not self._at_exit:
+            atexit.register(self.close)
+            self._at_exit = True
+        # an idle process would otherwise keep its segment open, out of the merge's reach
+        self._timer = threading.Timer(self.max_age, self._close_if_old)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _close_if_old(self) -> None:
+        with self._lock:
+            if self._file is not None and time.monotonic() - self._opened >= self.max_age:
+                self._close_file()
+
+    def _close_file(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        try:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self.path, self.path[:-len(OPEN_SUFFIX)] + SEGMENT_SUFFIX)
+        except OSError as e:
+            print(f"Error closing loot history segment {self.path}: {e}")
+        self._file = None
+
+
+_segments: dict[tuple[str, int], HistorySegment] = {}
+_segments_lock = threading.Lock()
+
+
+def segment_for(history_path: str) -> HistorySegment:
+    """This process's segment for a history file. A forked child gets its own."""
+    key = (os.path.abspath(history_path), os.getpid())
+    with _segments_lock:
+        segment = _segments.get(key)
+        if segment is None:
+            segment = _segments[key] = HistorySegment(history_path)
+        return segment
+
+
+def _read_segment(path: str, segment_number: int):
+    """Yield (time, segment number, sequence number, Character, Item) for each whole row of a segment."""
+    with open(path, "rb") as f:
+        data = f.read()
+    # a crashed writer can leave half a row at the end
+    data = data[:data.rfind(b"\n") + 1]
+    try:
+        for row in csv.reader(io.StringIO(data.decode("utf-8"), newline=""), delimiter="|"):
+            if len(row) != 10:
+                continue
+            parsed = parse_history_row(row[2:])
+            if parsed is None:
+                continue
+            try:
+                yield int(row[1]), segment_number, int(row[0]), parsed[0], parsed[1]
+            except ValueError:
+                continue
+    except (csv.Error, UnicodeDecodeError) as e:
+        print(f"Stopped reading damaged segment {path}: {e}")
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_journal(history_path: str, journal: dict) -> None:
+    path = _journal_path(history_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _recover(history_path: str) -> None:
+    """Finish or undo a merge that was interrupted."""
+    path = _journal_path(history_path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            journal = json.load(f)
+    except FileNotFoundError:
+        return
+    if journal["done"]:
+        # everything was appended, only some segments were left to delete
+        for name in journal["segments"]:
+            try:
+                os.remove(os.path.join(segments_dir(history_path), name))
+            except FileNotFoundError:
+                pass
+    else:
+        # roll back to before the merge, its segments are all still there
+        for file_path, size in ((history_path, journal["history_size"]),
+                                (history_index_path(history_path), journal["index_size"])):
+            if _file_size(file_path) > size:
+                with open(file_path, "r+b") as f:
+                    f.truncate(size)
+    os.remove(path)
+
+
+def merge_segments(history_path: str | None = None, include_open: bool = False) -> int:
+    """Append the rows of every closed segment to the history, oldest first, then delete them.
+    include_open also takes segments still being written, only safe once every writer has stopped.
+    Returns the number of rows merged.
+    """
+    history_path = history_path or storage_loot.LOOT_HISTORY_FILE
+    directory = segments_dir(history_path)
+    if not os.path.isdir(directory):
+        return 0
+    index_path = history_index_path(history_path)
+
+    # the same lock single-file writers take, so nothing else appends while this runs
+    with locked(history_path):
+        _recover(history_path)
+        suffixes = (SEGMENT_SUFFIX, OPEN_SUFFIX) if include_open else (SEGMENT_SUFFIX,)
+        names = sorted(name for name in os.listdir(directory) if name.endswith(suffixes))
+        if not names:
+            return 0
+
+        journal = {
+            "history_size": _file_size(history_path),
+            "index_size": _file_size(index_path),
+            "segments": names,
+            "done": False,
+        }
+        _write_journal(history_path, journal)
+
+        rows = heapq.merge(*(_read_segment(os.path.join(directory, name), number)
+                             for number, name in enumerate(names)))
+        merged = 0
+        with open(history_path, "ab") as history, open(index_path, "a", newline="", encoding="utf-8") as index:
+            offset = history.tell()
+            chunk, entries = [], []
+            for _, _, _, character, item in rows:
+                data = _render_history_row(character, item)
+                chunk.append(data)
+                if storage_loot.INDEX_LOOT_HISTORY:
+                    entries.append((offset, len(data), character, item))
+                offset += len(data)
+                merged += 1
+                if len(chunk) >= 1000:
+                    history.write(b"".join(chunk))
+                    _write_index_entries(index, entries)
+                    chunk, entries = [], []
+            history.write(b"".join(chunk))
+            _write_index_entries(index, entries)
+            history.flush()
+            index.flush()
+            os.fsync(history.fileno())
+            os.fsync(index.fileno())
+
+        journal["done"] = True
+        _write_journal(history_path, journal)
+        _recover(history_path)
+    return merged
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Merge sharded loot history segments into the history file.")
+    parser.add_argument("--history", default=None, help=f"history file (default {storage_loot.LOOT_HISTORY_FILE})")
+    parser.add_argument("--include-open", action="store_true",
+                        help="also merge segments still marked open, only when no writer is running")
+    args = parser.parse_args(argv)
+    merged = merge_segments(args.history, include_open=args.include_open)
+    print(f"Merged {merged} rows.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
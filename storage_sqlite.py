@@ -0,0 +1,209 @@
+"""
+storage_sqlite.py
+SQLite storage for characters and loot history, used when
+storage_config.STORAGE_BACKEND is "sqlite".
+
+Same functions as the CSV storage (load_characters, save_characters, save_loot_history)
+plus batch versions. The database runs in WAL mode so readers don't block the writer,
+and a small pool of connections is shared between threads.
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from loot_model import Character, Item
+from storage_loot import modifier_mask
+
+DATABASE_FILE = "loot.db"
+POOL_SIZE = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    name TEXT NOT NULL,
+    char_class TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    PRIMARY KEY (name, char_class)
+);
+CREATE TABLE IF NOT EXISTS loot_history (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    char_class TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    base_item TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    modifiers TEXT NOT NULL,
+    power_text TEXT NOT NULL,
+    power_score INTEGER NOT NULL,
+    modifier_mask TEXT NOT NULL DEFAULT '0'
+);
+CREATE TABLE IF NOT EXISTS loot_modifiers (
+    history_id INTEGER NOT NULL REFERENCES loot_history(id),
+    position INTEGER NOT NULL,
+    modifier TEXT NOT NULL,
+    PRIMARY KEY (history_id, position)
+);
+CREATE INDEX IF NOT EXISTS loot_history_character ON loot_history (name, char_class);
+CREATE INDEX IF NOT EXISTS loot_modifiers_modifier ON loot_modifiers (modifier);
+"""
+
+# the same SQL text every time, so sqlite3's per-connection statement cache
+# prepares each of these once
+_UPSERT_CHARACTER = (
+    "INSERT INTO characters (name, char_class, level) VALUES (?, ?, ?) "
+    "ON CONFLICT (name, char_class) DO UPDATE SET level = excluded.level"
+)
+_INSERT_HISTORY = (
+    "INSERT INTO loot_history (id, name, char_class, level, base_item, full_name, "
+    "modifiers, power_text, power_score, modifier_mask) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_INSERT_MODIFIER = "INSERT INTO loot_modifiers (history_id, position, modifier) VALUES (?, ?, ?)"
+
+
+class ConnectionPool:
+    """A fixed number of connections to one database, handed out one per caller."""
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self._idle: queue.Queue = queue.Queue()
+        for i in range(size):
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if i == 0:
+                conn.executescript(_SCHEMA)
+                _add_modifier_mask(conn)
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting if they are all in use."""
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection inside a write transaction, committed on success."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _add_modifier_mask(conn: sqlite3.Connection) -> None:
+    """Add the modifier_mask column to a database made before it existed,
+    filling it in for the rows already there."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(loot_history)")]
+        if "modifier_mask" in columns:
+            conn.execute("COMMIT")
+            return
+        conn.execute("ALTER TABLE loot_history ADD COLUMN modifier_mask TEXT NOT NULL DEFAULT '0'")
+        names: dict[int, list[str]] = {}
+        for history_id, modifier in conn.execute(
+            "SELECT history_id, modifier FROM loot_modifiers ORDER BY history_id, position"
+        ):
+            names.setdefault(history_id, []).append(modifier)
+        conn.executemany(
+            "UPDATE loot_history SET modifier_mask = ? WHERE id = ?",
+            [(f"{modifier_mask(mods):x}", history_id) for history_id, mods in names.items()],
+        )
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """The shared pool for DATABASE_FILE, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DATABASE_FILE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE_FILE)
+        return _pool
+
+
+def load_characters() -> list[Character]:
+    """Load every character, in the order they were first saved."""
+    with get_pool().connection() as conn:
+        rows = conn.execute("SELECT name, char_class, level FROM characters ORDER BY rowid").fetchall()
+    return [Character(name=name, char_class=char_class, level=level) for name, char_class, level in rows]
+
+
+def save_characters(characters: list[Character]) -> None:
+    """Replace the stored roster with this list."""
+    try:
+        with get_pool().transaction() as conn:
+            conn.execute("DELETE FROM characters")
+            conn.executemany(_UPSERT_CHARACTER, [(c.name, c.char_class, c.level) for c in characters])
+    except sqlite3.Error as e:
+        print(f"Error writing characters to {DATABASE_FILE}: {e}")
+
+
+def upsert_character(character: Character) -> None:
+    """Insert one character, or update its level if it is already stored."""
+    try:
+        with get_pool().transaction() as conn:
+            conn.execute(_UPSERT_CHARACTER, (character.name, character.char_class, character.level))
+    except sqlite3.Error as e:
+        print(f"Error writing characters to {DATABASE_FILE}: {e}")
+
+
+def save_loot_history(character: Character, item: Item) -> None:
+    """Save one loot entry."""
+    save_loot_history_batch([(character, item)])
+
+
+def save_loot_history_batch(entries: list[tuple[Character, Item]]) -> None:
+    """Save many loot entries in one transaction."""
+    if not entries:
+        return
+    try:
+        with get_pool().transaction() as conn:
+            # ids are handed out here so the modifier rows can point at them
+            # without a round trip per row; the write lock is already held
+            (next_id,) = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM loot_history").fetchone()
+            history_rows = []
+            modifier_rows = []
+            for history_id, (character, item) in enumerate(entries, start=next_id):
+                history_rows.append((
+                    history_id,
+                    character.name,
+                    character.char_class,
+                    character.level,
+                    item.base_item,
+                    item.full_name,
+                    ", ".join(item.modifiers) if item.modifiers else "None",
+                    item.power_text if item.power_text else "No special properties.",
+                    item.power_score,
+                    # hex, as in the .idx, since masks can outgrow a 64-bit INTEGER
+                    f"{item.modifier_mask or modifier_mask(item.modifiers):x}",
+                ))
+                modifier_rows.extend(
+                    (history_id, position, modifier) for position, modifier in enumerate(item.modifiers)
+                )
+            conn.executemany(_INSERT_HISTORY, history_rows)
+            conn.executemany(_INSERT_MODIFIER, modifier_rows)
+    except sqlite3.Error as e:
+        print(f"Error saving loot history to {DATABASE_FILE}: {e}")
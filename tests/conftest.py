@@ -0,0 +1,25 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import loot_tables  # noqa: E402
+import storage_loot  # noqa: E402
+
+DATA_FILES = ("base_items.txt", "modifiers.txt", "modifier_bits.txt")
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Run in a temp directory holding a copy of the data files, with no tables loaded yet."""
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(REPO, name), tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(loot_tables, "_default_tables", None)
+    monkeypatch.setattr(storage_loot, "_modifier_bits", None)
+    monkeypatch.setattr(storage_loot, "_unregistered", set())
+    return tmp_path
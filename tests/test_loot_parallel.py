@@ -0,0 +1,27 @@
+from loot_model import Character
+from loot_parallel import generate_parallel
+
+
+def _drops(requests, workers, seed=1234):
+    items = []
+    for characters, batch in generate_parallel(requests, seed=seed, workers=workers, shard_size=50):
+        assert len(batch) == len(characters)
+        items.extend(batch.item(i) for i in range(len(batch)))
+    return items
+
+
+def test_output_does_not_depend_on_worker_count(data_dir):
+    requests = [
+        (Character(name="Ayla", char_class="Warrior", level=3), 120),
+        (Character(name="Bram", char_class="Wizard", level=17), 45),
+        (Character(name="Cole", char_class="Rogue", level=9), 90),
+    ]
+    single = _drops(requests, 1)
+    assert len(single) == 255
+    assert _drops(requests, 2) == single
+    assert _drops(requests, 3) == single
+
+
+def test_seed_changes_output(data_dir):
+    requests = [(Character(name="Ayla", char_class="Warrior", level=20), 100)]
+    assert _drops(requests, 1, seed=1) != _drops(requests, 1, seed=2)
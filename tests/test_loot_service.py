@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+import loot_service
+import storage_loot
+from loot_metrics import LootMetrics
+from loot_model import Character
+from loot_service import LootService
+from loot_tables import max_modifiers_for_level
+
+CHARACTERS = [
+    Character(name="Ayla", char_class="Warrior", level=3),
+    Character(name="Bram", char_class="Wizard", level=12),
+    Character(name="Cole", char_class="Rogue", level=20),
+    Character(name="Dell", char_class="Bard", level=7),
+]
+
+
+def _check_rows(service, characters, counts, batch):
+    table = service.modifier_table
+    ids_by_name = {name: i for i, name in enumerate(table.names)}
+    assert batch.character_index == [i for i, count in enumerate(counts) for _ in range(count)]
+    for row in range(len(batch)):
+        character = characters[batch.character_index[row]]
+        item = batch.item(row)
+        ids = [ids_by_name[name] for name in item.modifiers]
+        assert len(ids) <= max_modifiers_for_level(character.level)
+        assert item.full_name == table.build_name(item.base_item, ids)
+        assert item.power_text == table.build_power_text(ids)
+        assert item.power_score == len(ids) + character.level
+        assert item.modifier_mask == table.mask_of(ids)
+
+
+@pytest.mark.parametrize("seeded", [True, False])
+def test_batch_rows_are_consistent(data_dir, seeded):
+    service = LootService()
+    counts = [300, 200, 0, 50]
+    batch = service.generate_loot_batch(CHARACTERS, counts, rng=random.Random(5) if seeded else None)
+    _check_rows(service, CHARACTERS, counts, batch)
+    assert all(name == "Mysterious Lint Ball" for name in batch.base_items[500:])
+
+
+def test_numpy_batch_keeps_to_the_chances(data_dir):
+    if loot_service.np is None:
+        pytest.skip("NumPy is not installed")
+    service = LootService()
+    character = Character(name="Bram", char_class="Wizard", level=12)
+    numpy_batch = service.generate_loot_batch([character], 40000)
+    stdlib_batch = service.generate_loot_batch([character], 40000, rng=random.Random(9))
+    for batch in (numpy_batch, stdlib_batch):
+        assert len(batch) == 40000
+    for name in service.modifier_table.names[:10]:
+        numpy_share = sum(name in mods for mods in numpy_batch.modifiers) / 40000
+        stdlib_share = sum(name in mods for mods in stdlib_batch.modifiers) / 40000
+        assert numpy_share == pytest.approx(stdlib_share, abs=0.02)
+    assert sum(numpy_batch.truncated) / 40000 == pytest.approx(sum(stdlib_batch.truncated) / 40000, abs=0.02)
+
+
+def test_batch_rejects_a_count_list_of_the_wrong_length(data_dir):
+    with pytest.raises(ValueError):
+        LootService().generate_loot_batch(CHARACTERS, [1, 2])
+
+
+def test_compact_drops_are_counted(data_dir):
+    metrics = LootMetrics()
+    service = LootService(metrics=metrics)
+    items = service.generate_compact_loot(CHARACTERS, 50, rng=random.Random(3))
+    items += [service.generate_compact_loot_for_character(character) for character in CHARACTERS]
+    snapshot = metrics.snapshot()
+    assert "generate_compact" in snapshot["stages"]
+    assert sum(drop["count"] for drop in snapshot["drops"]) == len(items)
+    assert snapshot["modifiers_rolled"] == sum(len(item.modifier_ids) for item in items)
+    assert snapshot["max_mods_truncations"] == sum(item.truncated for item in items)
+
+
+def test_reload_refuses_a_modifiers_file_with_bad_lines(data_dir):
+    service = LootService()
+    version = service.tables_version
+    with open("modifiers.txt", "a", encoding="utf-8") as f:
+        f.write("Flamming|1|0.3|prefix|+1d4 fire damage\nHalf a line|1\n")
+    assert not service.reload_tables()
+    assert service.tables_version == version
+    assert "Flamming" not in storage_loot.load_modifier_bits()
+
+
+def test_reload_refuses_a_modifiers_file_that_lost_most_lines(data_dir):
+    service = LootService()
+    names = service.modifier_table.names
+    with open("modifiers.txt", "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    with open("modifiers.txt", "w", encoding="utf-8") as f:
+        f.writelines(lines[:10])
+    assert not service.reload_tables()
+    assert service.modifier_table.names == names
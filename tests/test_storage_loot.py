@@ -0,0 +1,18 @@
+import os
+
+import storage_loot
+
+
+def test_registered_names_do_not_take_the_lock(data_dir):
+    registered = storage_loot.load_modifier_bits()
+    assert storage_loot.assign_modifier_bits(list(registered)) == registered
+    assert not os.path.exists("modifier_bits.txt.lock")
+
+
+def test_new_names_get_stable_bits(data_dir):
+    before = storage_loot.load_modifier_bits()
+    bits = storage_loot.assign_modifier_bits(["Gleaming", "Flaming"])
+    assert bits["Gleaming"] == max(before.values()) + 1
+    assert bits["Flaming"] == before["Flaming"]
+    assert storage_loot.load_modifier_bits()["Gleaming"] == bits["Gleaming"]
+    assert storage_loot.assign_modifier_bits(["Gleaming"])["Gleaming"] == bits["Gleaming"]
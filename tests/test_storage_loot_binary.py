@@ -0,0 +1,53 @@
+import random
+
+from loot_model import Character
+from loot_service import LootService
+from storage_loot_binary import BinaryHistoryReader, BinaryHistoryWriter
+
+
+def _drops(seed, count):
+    service = LootService(rng=random.Random(seed))
+    characters = [Character(name=f"p{seed}-{i % 7}", char_class=("Rogue", "Wizard")[i % 2], level=1 + i % 20)
+                  for i in range(count)]
+    return [(character, service.generate_loot_for_character(character)) for character in characters]
+
+
+def _stored(drops):
+    """What the binary history keeps of each drop (not the tier or the truncated flag)."""
+    return [(character, item.full_name, item.modifiers, item.power_text, item.power_score, item.modifier_mask)
+            for character, item in drops]
+
+
+def _read():
+    with BinaryHistoryReader() as reader:
+        return _stored(reader.rows())
+
+
+def test_reopening_cuts_off_torn_writes(data_dir):
+    drops = _drops(1, 6)
+    with BinaryHistoryWriter() as writer:
+        for drop in drops[:3]:
+            writer.write(*drop)
+    # a crash halfway through a record and a string
+    with open("loot_history.bin", "ab") as f:
+        f.write(b"xyz")
+    with open("loot_history.bin.strings", "ab") as f:
+        f.write(b"\x09\x00ab")
+    with BinaryHistoryWriter() as writer:
+        for drop in drops[3:]:
+            writer.write(*drop)
+    assert _read() == _stored(drops)
+
+
+def test_writers_sharing_a_file_keep_their_ids_apart(data_dir):
+    first, second = _drops(1, 40), _drops(2, 40)
+    a = BinaryHistoryWriter(max_rows=3)
+    b = BinaryHistoryWriter(max_rows=5)
+    for drop_a, drop_b in zip(first, second):
+        a.write(*drop_a)
+        b.write(*drop_b)
+    a.close()
+    b.close()
+    rows = _read()
+    assert sorted(rows, key=repr) == sorted(_stored(first + second), key=repr)
+    assert [row for row in rows if row in _stored(first)] == _stored(first)
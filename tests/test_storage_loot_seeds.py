@@ -0,0 +1,51 @@
+import os
+
+from loot_model import Character
+from loot_service import LootService
+from storage_loot_seeds import SeedHistoryReplayer, SeedHistoryWriter, read_seed_history
+
+CHARACTERS = [
+    Character(name="Ayla", char_class="Warrior", level=3),
+    Character(name="Bram", char_class="Wizard", level=17),
+    Character(name="Cole", char_class="Rogue", level=20),
+]
+
+
+def _roll(writer, count):
+    drops = []
+    for i in range(count):
+        character = CHARACTERS[i % len(CHARACTERS)]
+        drops.append((character, writer.generate(character)))
+    return drops
+
+
+def test_replay_gives_the_logged_items(data_dir):
+    service = LootService()
+    with SeedHistoryWriter(service, stream_seed=42, max_rows=16) as writer:
+        drops = _roll(writer, 100)
+    assert list(SeedHistoryReplayer(LootService()).replay()) == drops
+
+
+def test_replay_survives_a_table_change(data_dir):
+    service = LootService()
+    with SeedHistoryWriter(service, stream_seed=7) as writer:
+        drops = _roll(writer, 60)
+        with open("modifiers.txt", "a", encoding="utf-8") as f:
+            f.write("Gleaming|1|0.9|prefix|Sheds dim light in a 10 ft radius\n")
+        assert service.reload_tables()
+        drops += _roll(writer, 60)
+
+    records = list(read_seed_history())
+    versions = {record.table_version for record in records}
+    assert len(versions) == 2
+    assert all(os.path.exists(os.path.join("loot_table_versions", f"{version}.json")) for version in versions)
+    assert any("Gleaming" in item.modifiers for _, item in drops[60:])
+    assert list(SeedHistoryReplayer(LootService()).replay()) == drops
+
+
+def test_names_that_look_like_record_types(data_dir):
+    characters = [Character(name=name, char_class="Rogue", level=4) for name in ("#stream", "stream", "drop", "Bob")]
+    with SeedHistoryWriter(LootService(), stream_seed=3) as writer:
+        drops = [(character, writer.generate(character)) for character in characters]
+    assert [record.name for record in read_seed_history()] == ["#stream", "stream", "drop", "Bob"]
+    assert list(SeedHistoryReplayer(LootService()).replay()) == drops
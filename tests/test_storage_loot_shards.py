@@ -0,0 +1,96 @@
+import csv
+import os
+
+from loot_model import Character, Item
+from storage_loot import _render_history_row, history_index_path
+from storage_loot_shards import HistorySegment, _write_journal, merge_segments, segments_dir
+
+HISTORY = "loot_history.csv"
+
+
+def _rows(start, count):
+    character = Character(name="Ayla", char_class="Warrior", level=5)
+    return [
+        _render_history_row(character, Item(base_item="Longsword", full_name=f"Flaming Longsword {i}",
+                                            modifiers=["Flaming"], power_text="+1d4 fire damage",
+                                            power_score=i))
+        for i in range(start, start + count)
+    ]
+
+
+def _write_segments(*batches):
+    """Write each batch of rows to its own closed segment, returning the segment file names."""
+    segment = HistorySegment(HISTORY)
+    for rows in batches:
+        segment.append(rows)
+        segment.close()
+    return sorted(os.listdir(segments_dir(HISTORY)))
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _check_index(history):
+    with open(history_index_path(HISTORY), "r", encoding="utf-8", newline="") as f:
+        entries = list(csv.reader(f, delimiter="|"))
+    offset = 0
+    for entry in entries:
+        assert int(entry[0]) == offset
+        offset += int(entry[1])
+    assert offset == len(history)
+    return len(entries)
+
+
+def test_merge_keeps_rows_in_order(data_dir):
+    rows = _rows(0, 30)
+    _write_segments(rows[:10], rows[10:25], rows[25:])
+    assert merge_segments(HISTORY) == 30
+    assert _read(HISTORY) == b"".join(rows)
+    assert _check_index(_read(HISTORY)) == 30
+    assert os.listdir(segments_dir(HISTORY)) == []
+
+
+def test_interrupted_merge_is_rolled_back_and_redone(data_dir):
+    before = _rows(0, 10)
+    _write_segments(before)
+    merge_segments(HISTORY)
+
+    rows = _rows(10, 20)
+    names = _write_segments(rows[:12], rows[12:])
+    # a merge that died after the journal and part of the appends
+    _write_journal(HISTORY, {
+        "history_size": os.path.getsize(HISTORY),
+        "index_size": os.path.getsize(history_index_path(HISTORY)),
+        "segments": names,
+        "done": False,
+    })
+    with open(HISTORY, "ab") as f:
+        f.write(b"".join(rows[:5]) + rows[5][:7])
+    with open(history_index_path(HISTORY), "ab") as f:
+        f.write(b"1234|56|Ayl")
+
+    assert merge_segments(HISTORY) == 20
+    assert _read(HISTORY) == b"".join(before + rows)
+    assert _check_index(_read(HISTORY)) == 30
+    assert os.listdir(segments_dir(HISTORY)) == []
+
+
+def test_finished_merge_only_deletes_its_segments(data_dir):
+    rows = _rows(0, 10)
+    names = _write_segments(rows[:4], rows[4:])
+    paths = [os.path.join(segments_dir(HISTORY), name) for name in names]
+    segments = [_read(path) for path in paths]
+    merge_segments(HISTORY)
+    history = _read(HISTORY)
+
+    # a merge that died after appending everything, before deleting its segments
+    for path, data in zip(paths, segments):
+        with open(path, "wb") as f:
+            f.write(data)
+    _write_journal(HISTORY, {"history_size": 0, "index_size": 0, "segments": names, "done": True})
+
+    assert merge_segments(HISTORY) == 0
+    assert _read(HISTORY) == history
+    assert os.listdir(segments_dir(HISTORY)) == []